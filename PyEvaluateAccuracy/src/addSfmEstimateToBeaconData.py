@@ -5,6 +5,7 @@ import json
 import numpy as np
 import sys
 import shutil
+import hulo_ibeacon.IBeaconUtils as IBeaconUtils
 
 VISION_LOCALIZE_WORKSPACE_PATH = "/home/ishihara/VisionLoc"
 
@@ -53,18 +54,36 @@ def addSfMEstimateToBeaconCSV(csv_file, sfm_result_file, beacon_file):
     with open(csv_file) as f:
         for line in f:
             csv_orig_lines.append(line)
+    csv_split_lines = [line.strip().split(",") for line in csv_orig_lines]
+    
+    # list SfM estimate of photos
+    sfmTimestamp = []
+    sfmTList = []
+    for splitline in csv_split_lines:
+        if splitline[1] == "Misc" and splitline[2] == "Photo":
+            if splitline[3] in filenameSfmPosMap:
+                if filenameSfmDistMap[splitline[3]]<medianDist and len(filenameSfmPosMap[splitline[3]])>=3:
+                    sfmTimestamp.append(int(splitline[0]))
+                    sfmTList.append(filenameSfmPosMap[splitline[3]])
+    sfmOrder = np.argsort(np.array(sfmTimestamp, dtype=np.int64), kind="mergesort")
+    sfmTimestamp = np.array(sfmTimestamp, dtype=np.int64)[sfmOrder]
+    sfmTList = [sfmTList[i] for i in sfmOrder]
+    
+    # find SfM estimate of latest photo before each beacon sample within time difference
+    beaconLineIndex = [i for i in range(len(csv_split_lines)) if csv_split_lines[i][1] == "Beacon"]
+    beaconSfmIndex = IBeaconUtils.alignTimestamps([int(csv_split_lines[i][0]) for i in beaconLineIndex], 
+                                                  sfmTimestamp, "previous", MAX_TIME_DIFF_BEACON_SFM*1000)
+    lineSfmIndex = dict(zip(beaconLineIndex, beaconSfmIndex.tolist()))
     
     # add SfM estimate to original CSV data
-    sfmTimestamp = -1
-    sfmT = []
     with open(csv_file,"w") as f:
-        for line in csv_orig_lines:
+        for lineIndex, line in enumerate(csv_orig_lines):
             line = line.strip()
-            splitline = line.split(",")
+            splitline = csv_split_lines[lineIndex]
             
             # parse by type
-            timestamp = int(splitline[0])
-            if len(sfmT)>=3 and abs(timestamp-sfmTimestamp)/1000<MAX_TIME_DIFF_BEACON_SFM and splitline[1] == "Beacon":
+            if lineSfmIndex.get(lineIndex, -1) >= 0:
+                sfmT = sfmTList[lineSfmIndex[lineIndex]]
                 # write time stamp and Beacon name
                 for i in range(2):
                     f.write(splitline[i])
@@ -85,13 +104,6 @@ def addSfMEstimateToBeaconCSV(csv_file, sfm_result_file, beacon_file):
             else:
                 f.write(line)
                 f.write("\n")
-            
-            # cache SfM estimate
-            if splitline[1] == "Misc" and splitline[2] == "Photo":
-                if splitline[3] in filenameSfmPosMap:
-                    if filenameSfmDistMap[splitline[3]]<medianDist:
-                        sfmTimestamp = int(splitline[0])
-                        sfmT = filenameSfmPosMap[splitline[3]]
         
         f.close()
 
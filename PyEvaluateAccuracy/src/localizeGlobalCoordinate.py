@@ -31,8 +31,10 @@ import shutil
 import glob
 import hulo_file.FileUtils as FileUtils
 import hulo_file.PlyUtils as PlyUtis
+from hulo_file.LocResult import LocResult
 import hulo_file.SfmDataUtils as SfmDataUtils
 import hulo_sfm.mergeSfM as mergeSfM
+import hulo_transform.TransformUtils as TransformUtils
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_param.LocalizeParam as LocalizeParam
 import hulo_bow.LocalizeBOWParam as LocalizeBOWParam
@@ -69,6 +71,8 @@ def main():
                         help='Use BOW to accelerate localization if this flag is set (default: False)')    
     parser.add_argument('--beacon', action='store_true', default=False, \
                         help='Use iBeacon to accelerate localization if this flag is set (default: False)')    
+    parser.add_argument('--ransac-method', action='store', choices=['ransac', 'loransac'], default=reconstructParam.ransacMethod, \
+                        help='RANSAC method to find transformation to global coordinate (default: ' + reconstructParam.ransacMethod + ')')
     args = parser.parse_args()
     project_dir = args.project_dir
     matches_dir = args.matches_dir
@@ -77,6 +81,7 @@ def main():
     output_json_filename = args.output_json_filename
     USE_BOW = args.bow
     USE_BEACON = args.beacon
+    RANSAC_METHOD = args.ransac_method
     
     BOW_FILE = os.path.join(matches_dir, "BOWfile.yml")
     PCA_FILE = os.path.join(matches_dir, "PCAfile.yml")
@@ -158,22 +163,10 @@ def main():
                       " -r=" + str(localizeParam.locRansacRound) + \
                       guideMatchOption)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(REF_FOLDER_LOC,"center.txt"),"w")
-        countLocFrame = 0
-        
-        for filename in sorted(os.listdir(REF_FOLDER_LOC)):
-            if filename[-4:]!="json":
-                continue
-                                    
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(REF_FOLDER_LOC,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )  
-        
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(REF_FOLDER_LOC)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(REF_FOLDER_LOC,"center.txt"))
         
         # read reference data
         mapNameLocRef = FileUtils.loadImageLocationListTxt(os.path.join(REF_FOLDER,"refcoor.txt"))
@@ -182,22 +175,14 @@ def main():
         worldCoor = []
         locCoor = []
         countLoc = 0
-        for filename in os.listdir(REF_FOLDER_LOC):
-            if filename[-4:] != "json":
-                continue
+        for i in locResult.getLocalizedIndex().tolist():
+            imgLocName = os.path.basename(locResult.filename[i])
             
-            # read json localization file
-            with open(os.path.join(REF_FOLDER_LOC,filename)) as jsonlocfile:
-                jsonLoc = json.load(jsonlocfile)
-                
-                imgLocName = os.path.basename(jsonLoc["filename"])
-                
-                # if file exist in map, add to matrix
-                if imgLocName in mapNameLocRef:
-                    if "t" in jsonLoc:
-                        locCoor.append(jsonLoc["t"])
-                        worldCoor.append(mapNameLocRef[imgLocName])
-                        countLoc = countLoc + 1
+            # if file exist in map, add to matrix
+            if imgLocName in mapNameLocRef:
+                locCoor.append(locResult.t[i].tolist())
+                worldCoor.append(mapNameLocRef[imgLocName])
+                countLoc = countLoc + 1
         
         print "From " + str(len(mapNameLocRef)) + " reference images, " + str(countLoc) + " images has been localized."
         
@@ -207,7 +192,8 @@ def main():
         
         # find tranformation
         Amat, inliers = mergeSfM.ransacTransform(np.array(worldCoor).T, np.array(locCoor).T, 
-                                                 reconstructParam.ransacThresTransformWorldCoordinateRefImage, ransacRound=1000)
+                                                 reconstructParam.ransacThresTransformWorldCoordinateRefImage, ransacRound=1000,
+                                                 method=RANSAC_METHOD, confidence=reconstructParam.ransacConfidence)
         
         if len(inliers) < 4:
             print "Cannot estimate transformation matrix to world coordinate"
@@ -303,20 +289,10 @@ def main():
                               " -f=" + str(localizeParam.locFeatDistRatio) + \
                               " -r=" + str(localizeParam.locRansacRound))
                 
-                # extract centers from all json file and write to a file
-                countLocFrame = 0                
-                fileLoc = open(os.path.join(TEST_FOLDER_LOC,"center.txt"),"w")
-                for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-                    if filename[-4:]!="json":
-                        continue
-                    
-                    countLocFrame = countLocFrame + 1
-                    with open(os.path.join(TEST_FOLDER_LOC,filename)) as locJson:
-                        if "t" in locJsonDict:
-                            locJsonDict = json.load(locJson)
-                            loc = locJsonDict["t"]
-                            fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )
-                fileLoc.close()
+                # convert all json files to consolidated result, and write centers to a file
+                locResult = LocResult.convertFolder(TEST_FOLDER_LOC)
+                countLocFrame = locResult.getImageCount()
+                locResult.saveCenterTxt(os.path.join(TEST_FOLDER_LOC,"center.txt"))
             
                 # count input images
                 imageTypes = ("*.jpg", "*.JPG", "*.jpeg", "*.JPEG", "*.png", "*.PNG")
@@ -336,22 +312,10 @@ def main():
             # convert all localization results to world coordinate and merge to one json file
             locGlobalJsonObj = {}
             locGlobalJsonObj["locGlobal"] = []
-            locGlobalPoints = []
-            for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-                if filename[-4:]!="json":
-                    continue
-                with open(os.path.join(TEST_FOLDER_LOC,filename)) as jsonfile:
-                    jsonLoc = json.load(jsonfile)
-                    
-                    if "t" in jsonLoc:
-                        jsonLoc["t_relative"] = jsonLoc["t"]
-                        jsonLoc["R_relative"] = jsonLoc["R"]
-                        jsonLoc["t"] = np.dot(Amat,np.concatenate([jsonLoc["t"],[1]])).tolist()
-                        jsonLoc["R"] = np.dot(jsonLoc["R"],Amat[:, 0:3].T).tolist()
-                        
-                        locGlobalPoints.append(jsonLoc["t"])
-                    
-                    locGlobalJsonObj["locGlobal"].append(jsonLoc)
+            locResult = LocResult.load(TEST_FOLDER_LOC)
+            for i in range(0, locResult.getImageCount()):
+                locGlobalJsonObj["locGlobal"].append(locResult.toJson(i))
+            locGlobalPoints = TransformUtils.transformLocJson(Amat, locGlobalJsonObj["locGlobal"])
             with open(os.path.join(TEST_FOLDER_LOC, output_json_filename),"w") as jsonfile:
                 json.dump(locGlobalJsonObj, jsonfile)
             
@@ -32,8 +32,10 @@ import shutil
 import glob
 import hulo_file.FileUtils as FileUtils
 import hulo_file.PlyUtils as PlyUtis
+from hulo_file.LocResult import LocResult
 import hulo_file.SfmDataUtils as SfmDataUtils
 import hulo_sfm.mergeSfM as mergeSfM
+import hulo_transform.TransformUtils as TransformUtils
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_param.LocalizeParam as LocalizeParam
 import hulo_bow.LocalizeBOWParam as LocalizeBOWParam
@@ -48,10 +50,7 @@ localizeIBeaconParam = LocalizeIBeaconParam.LocalizeIBeaconParam
 reconstructIBeaconParam = ReconstructIBeaconParam.ReconstructIBeaconParam
 
 def reduceClosePoints(sfmData, Amat, thres):
-    strKeyGlobalXMap = {}
-    for strKey in range(0,len(sfmData['structure'])):
-        struct = sfmData['structure'][strKey]
-        strKeyGlobalXMap[strKey] = np.dot(Amat,np.concatenate([struct["value"]["X"],[1]]))
+    strKeyGlobalXMap = TransformUtils.transformPoints(Amat, [struct["value"]["X"] for struct in sfmData['structure']])
      
     reduceStructures = []
     for strKey1 in range(0,len(sfmData['structure'])):            
@@ -79,14 +78,7 @@ def reduceClosePoints(sfmData, Amat, thres):
     print "finish remove reduced points from sfmData."
 
 def reduceClosePointsKDTree(sfmData, Amat, thres, knn):
-    allGlobalX = np.asarray([])
-    for strKey in range(0,len(sfmData['structure'])):
-        struct = sfmData['structure'][strKey]
-        globalX = np.dot(Amat,np.concatenate([struct["value"]["X"],[1]]))
-        if allGlobalX.shape[0]==0:
-            allGlobalX = globalX
-        else:
-            allGlobalX = np.vstack((allGlobalX, globalX))
+    allGlobalX = TransformUtils.transformPoints(Amat, [struct["value"]["X"] for struct in sfmData['structure']])
     
     print "start build kdtree : " + str(allGlobalX.shape)
     kdtree = cKDTree(allGlobalX)
@@ -143,6 +135,8 @@ def main():
                         help='Use iBeacon to accelerate localization if this flag is set (default: False)')    
     parser.add_argument('--reduce-points', action='store_true', default=False, \
                         help='Reduce 3D points if points are close after transforming to global coordinate (default: False)')    
+    parser.add_argument('--ransac-method', action='store', choices=['ransac', 'loransac'], default=reconstructParam.ransacMethod, \
+                        help='RANSAC method to find transformation to global coordinate (default: ' + reconstructParam.ransacMethod + ')')
     args = parser.parse_args()
     project_dir = args.project_dir
     matches_dir = args.matches_dir
@@ -152,6 +146,7 @@ def main():
     USE_BOW = args.bow
     USE_BEACON = args.beacon
     USE_REDUCE_POINTS = args.reduce_points
+    RANSAC_METHOD = args.ransac_method
     
     BOW_FILE = os.path.join(matches_dir, "BOWfile.yml")
     PCA_FILE = os.path.join(matches_dir, "PCAfile.yml")
@@ -189,7 +184,8 @@ def main():
         
         # find tranformation
         Amat, inliers = mergeSfM.ransacTransform(np.array(worldCoor).T, np.array(locCoor).T, 
-                                                 reconstructParam.ransacThresTransformWorldCoordinateRefPoint, ransacRound=1000)
+                                                 reconstructParam.ransacThresTransformWorldCoordinateRefPoint, ransacRound=1000,
+                                                 method=RANSAC_METHOD, confidence=reconstructParam.ransacConfidence)
         
         if len(inliers) < 4:
             print "Cannot estimate transformation matrix to world coordinate"
@@ -315,20 +311,10 @@ def main():
                               " -r=" + str(localizeParam.locRansacRound) + \
                               guideMatchOption)
                 
-                # extract centers from all json file and write to a file
-                countLocFrame = 0
-                fileLoc = open(os.path.join(TEST_FOLDER_LOC,"center.txt"),"w")
-                for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-                    if filename[-4:]!="json":
-                        continue
-                    
-                    countLocFrame = countLocFrame + 1
-                    with open(os.path.join(TEST_FOLDER_LOC,filename)) as locJson:
-                        locJsonDict = json.load(locJson)
-                        if "t" in locJsonDict:
-                            loc = locJsonDict["t"]
-                            fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )
-                fileLoc.close()
+                # convert all json files to consolidated result, and write centers to a file
+                locResult = LocResult.convertFolder(TEST_FOLDER_LOC)
+                countLocFrame = locResult.getImageCount()
+                locResult.saveCenterTxt(os.path.join(TEST_FOLDER_LOC,"center.txt"))
                 
                 # count input images
                 imageTypes = ("*.jpg", "*.JPG", "*.jpeg", "*.JPEG", "*.png", "*.PNG")
@@ -348,22 +334,10 @@ def main():
             # convert all localization results to world coordinate and merge to one json file
             locGlobalJsonObj = {}
             locGlobalJsonObj["locGlobal"] = []
-            locGlobalPoints = []
-            for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-                if filename[-4:]!="json":
-                    continue
-                with open(os.path.join(TEST_FOLDER_LOC,filename)) as jsonfile:
-                    jsonLoc = json.load(jsonfile)
-                    
-                    if "t" in jsonLoc:
-                        jsonLoc["t_relative"] = jsonLoc["t"]
-                        jsonLoc["R_relative"] = jsonLoc["R"]
-                        jsonLoc["t"] = np.dot(Amat,np.concatenate([jsonLoc["t"],[1]])).tolist()
-                        jsonLoc["R"] = np.dot(jsonLoc["R"],Amat[:, 0:3].T).tolist()
-                        
-                        locGlobalPoints.append(jsonLoc["t"])
-                    
-                    locGlobalJsonObj["locGlobal"].append(jsonLoc)
+            locResult = LocResult.load(TEST_FOLDER_LOC)
+            for i in range(0, locResult.getImageCount()):
+                locGlobalJsonObj["locGlobal"].append(locResult.toJson(i))
+            locGlobalPoints = TransformUtils.transformLocJson(Amat, locGlobalJsonObj["locGlobal"])
             with open(os.path.join(TEST_FOLDER_LOC, output_json_filename),"w") as jsonfile:
                 json.dump(locGlobalJsonObj, jsonfile)
             
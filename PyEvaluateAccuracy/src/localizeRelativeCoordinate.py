@@ -28,6 +28,7 @@ import sys
 import json
 import shutil
 import hulo_file.PlyUtils as PlyUtis
+from hulo_file.LocResult import LocResult
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_param.LocalizeParam as LocalizeParam
 import hulo_bow.LocalizeBOWParam as LocalizeBOWParam
@@ -153,36 +154,21 @@ def main():
                           " -r=" + str(localizeParam.locRansacRound) + \
                           guideMatchOption)
             
-            # extract centers from all json file and write to a file
-            fileLoc = open(os.path.join(TEST_FOLDER_LOC,"center.txt"),"w")
-            countLocFrame = 0
-            
-            for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-                if filename[-4:]!="json":
-                    continue
-                
-                countLocFrame = countLocFrame + 1
-                with open(os.path.join(TEST_FOLDER_LOC,filename)) as locJson:
-                    locJsonDict = json.load(locJson)
-                    if "t" in locJsonDict:
-                        loc = locJsonDict["t"]
-                        fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )
-            
-            fileLoc.close()
+            # convert all json files to consolidated result, and write centers to a file
+            locResult = LocResult.convertFolder(TEST_FOLDER_LOC)
+            countLocFrame = locResult.getImageCount()
+            locResult.saveCenterTxt(os.path.join(TEST_FOLDER_LOC,"center.txt"))
             
         # merge all localization results to one json file
         locRelativeJsonObj = {}
         locRelativeJsonObj["locRelative"] = []
         locRelativePoints = []
-        for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-            if filename[-4:]!="json":
-                continue
-            with open(os.path.join(TEST_FOLDER_LOC,filename)) as jsonfile:
-                jsonLoc = json.load(jsonfile)
-                if "t" in jsonLoc:                    
-                    locRelativePoints.append(jsonLoc["t"])
-                
-                locRelativeJsonObj["locRelative"].append(jsonLoc)
+        locResult = LocResult.load(TEST_FOLDER_LOC)
+        for i in range(0, locResult.getImageCount()):
+            if locResult.isLocalized[i]:
+                locRelativePoints.append(locResult.t[i].tolist())
+            
+            locRelativeJsonObj["locRelative"].append(locResult.toJson(i))
         with open(os.path.join(TEST_FOLDER_LOC,"loc_relative.json"),"w") as jsonfile:
             json.dump(locRelativeJsonObj, jsonfile)
         
@@ -30,8 +30,10 @@ import numpy as np
 import shutil
 import hulo_file.FileUtils as FileUtils
 import hulo_file.PlyUtils as PlyUtis
+from hulo_file.LocResult import LocResult
 import hulo_file.SfmDataUtils as SfmDataUtils
 import hulo_sfm.mergeSfM as mergeSfM
+import hulo_transform.TransformUtils as TransformUtils
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_param.LocalizeParam as LocalizeParam
 import hulo_bow.LocalizeBOWParam as LocalizeBOWParam
@@ -77,6 +79,8 @@ def main():
                         help='Number of Beacon KNN(default : ' + str(localizeIBeaconParam.locKNNnum) + ')')
     parser.add_argument('--beacon_cooc_thres', action='store', type=float, default=False, \
                         help='Number of Beacon co-occurrence Threshold(default : ' + str(localizeIBeaconParam.coocThres) + ')')
+    parser.add_argument('--ransac-method', action='store', choices=['ransac', 'loransac'], default=reconstructParam.ransacMethod, \
+                        help='RANSAC method to find transformation to global coordinate (default: ' + reconstructParam.ransacMethod + ')')
     args = parser.parse_args()
     project_dir = args.project_dir
     matches_dir = args.matches_dir
@@ -89,6 +93,7 @@ def main():
     BOW_KNN_NUM = args.bow_knn_num
     BEACON_KNN_NUM = args.beacon_knn_num
     BEACON_COOC_THRES = args.beacon_cooc_thres
+    RANSAC_METHOD = args.ransac_method
     
     BOW_FILE = os.path.join(matches_dir, "BOWfile.yml")
     PCA_FILE = os.path.join(matches_dir, "PCAfile.yml")
@@ -188,22 +193,10 @@ def main():
                       " -r=" + str(localizeParam.locRansacRound) + \
                       guideMatchOption)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(REF_FOLDER_LOC,"center.txt"),"w")
-        countLocFrame = 0
-        
-        for filename in sorted(os.listdir(REF_FOLDER_LOC)):
-            if filename[-4:]!="json":
-                continue
-                                    
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(REF_FOLDER_LOC,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )  
-        
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(REF_FOLDER_LOC)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(REF_FOLDER_LOC,"center.txt"))
         
         # read reference data
         mapNameLocRef = FileUtils.loadImageLocationListTxt(os.path.join(REF_FOLDER,"refcoor.txt"))
@@ -212,22 +205,14 @@ def main():
         worldCoor = []
         locCoor = []
         countLoc = 0
-        for filename in os.listdir(REF_FOLDER_LOC):
-            if filename[-4:] != "json":
-                continue
+        for i in locResult.getLocalizedIndex().tolist():
+            imgLocName = os.path.basename(locResult.filename[i])
             
-            # read json localization file
-            with open(os.path.join(REF_FOLDER_LOC,filename)) as jsonlocfile:
-                jsonLoc = json.load(jsonlocfile)
-                
-                imgLocName = os.path.basename(jsonLoc["filename"])
-                
-                # if file exist in map, add to matrix
-                if imgLocName in mapNameLocRef:
-                    if "t" in jsonLoc:
-                        locCoor.append(jsonLoc["t"])
-                        worldCoor.append(mapNameLocRef[imgLocName])
-                        countLoc = countLoc + 1
+            # if file exist in map, add to matrix
+            if imgLocName in mapNameLocRef:
+                locCoor.append(locResult.t[i].tolist())
+                worldCoor.append(mapNameLocRef[imgLocName])
+                countLoc = countLoc + 1
         
         print "From " + str(len(mapNameLocRef)) + " reference images, " + str(countLoc) + " images has been localized."
         
@@ -237,7 +222,8 @@ def main():
         
         # find tranformation
         Amat, inliers = mergeSfM.ransacTransform(np.array(worldCoor).T, np.array(locCoor).T, 
-                                                 reconstructParam.ransacThresTransformWorldCoordinateRefImage, ransacRound=1000)
+                                                 reconstructParam.ransacThresTransformWorldCoordinateRefImage, ransacRound=1000,
+                                                 method=RANSAC_METHOD, confidence=reconstructParam.ransacConfidence)
         
         if len(inliers) < 4:
             print "Cannot estimate transformation matrix to world coordinate"
@@ -327,22 +313,10 @@ def main():
                       " -r=" + str(localizeParam.locRansacRound) + \
                       guideMatchOption)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(TEST_FOLDER_LOC,"center.txt"),"w")
-        countLocFrame = 0
-        
-        for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-            if filename[-4:]!="json":
-                continue
-                                        
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(TEST_FOLDER_LOC,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )  
-        
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(TEST_FOLDER_LOC)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(TEST_FOLDER_LOC,"center.txt"))
     
     # read test data
     mapNameLocTest = FileUtils.loadImageLocationListTxt(os.path.join(test_dir,"testcoor.txt"))
@@ -351,29 +325,21 @@ def main():
     worldCoorTest = []
     locCoorTest = []
     countLocTest = 0
-    for filename in os.listdir(TEST_FOLDER_LOC):
-        if filename[-4:] != "json":
-            continue
+    locResult = LocResult.load(TEST_FOLDER_LOC)
+    for i in locResult.getLocalizedIndex().tolist():
+        imgLocName = os.path.basename(locResult.filename[i])
         
-        # read json localization file
-        with open(os.path.join(TEST_FOLDER_LOC,filename)) as jsonlocfile:
-            jsonLoc = json.load(jsonlocfile)
-            
-            imgLocName = os.path.basename(jsonLoc["filename"])
-            
-            # if file exist in map, add to matrix
-            if imgLocName in mapNameLocTest:
-                if "t" in jsonLoc:
-                    locCoorTest.append(jsonLoc["t"])
-                    worldCoorTest.append(mapNameLocTest[imgLocName])
-                    countLocTest = countLocTest + 1
+        # if file exist in map, add to matrix
+        if imgLocName in mapNameLocTest:
+            locCoorTest.append(locResult.t[i].tolist())
+            worldCoorTest.append(mapNameLocTest[imgLocName])
+            countLocTest = countLocTest + 1
             
     # transform loc coordinate to world coordinate
     print "From " + str(len(mapNameLocTest)) + " test images, " + str(countLocTest) + " images has been localized."
     if countLocTest == 0:
         return
-    locCoorTest1 = np.hstack((locCoorTest,np.ones((len(locCoorTest),1),dtype=np.float)))
-    locCoorTestWorld = np.dot(Amat,locCoorTest1.T).T
+    locCoorTestWorld = TransformUtils.transformPoints(Amat, locCoorTest)
     
     # calculate error
     normDiff = np.linalg.norm(worldCoorTest - locCoorTestWorld,axis=1)
@@ -410,27 +376,15 @@ def main():
     # convert all localization results to world coordinate and merge to one json file
     locGlobalJsonObj = {}
     locGlobalJsonObj["locGlobal"] = []
-    locGlobalPoints = []
-    for filename in sorted(os.listdir(TEST_FOLDER_LOC)):
-        if filename[-4:]!="json":
-            continue
-        with open(os.path.join(TEST_FOLDER_LOC,filename)) as jsonfile:
-            jsonLoc = json.load(jsonfile)
-            
-            imgLocName = os.path.basename(jsonLoc["filename"])
-            
-            # if file exist in map
-            if imgLocName in mapNameLocTest:
-                if "t" in jsonLoc:
-                    jsonLoc["t_relative"] = jsonLoc["t"]
-                    jsonLoc["R_relative"] = jsonLoc["R"]
-                    jsonLoc["t"] = np.dot(Amat,np.concatenate([jsonLoc["t"],[1]])).tolist()
-                    jsonLoc["R"] = np.dot(jsonLoc["R"],Amat[:, 0:3].T).tolist()
-                    
-                    locGlobalPoints.append(jsonLoc["t"])
-                
-                jsonLoc["groundtruth"] = mapNameLocTest[imgLocName]
-                locGlobalJsonObj["locGlobal"].append(jsonLoc)
+    for i in range(0, locResult.getImageCount()):
+        imgLocName = os.path.basename(locResult.filename[i])
+        
+        # if file exist in map
+        if imgLocName in mapNameLocTest:
+            jsonLoc = locResult.toJson(i)
+            jsonLoc["groundtruth"] = mapNameLocTest[imgLocName]
+            locGlobalJsonObj["locGlobal"].append(jsonLoc)
+    locGlobalPoints = TransformUtils.transformLocJson(Amat, locGlobalJsonObj["locGlobal"])
     with open(os.path.join(TEST_FOLDER_LOC,"loc_global.json"),"w") as jsonfile:
         json.dump(locGlobalJsonObj, jsonfile)
     
@@ -44,6 +44,7 @@ import hulo_file.FileUtils as FileUtils
 import hulo_file.SfmDataUtils as SfMDataUtils
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_bow.ReconstructBOWParam as ReconstructBOWParam
+import hulo_bow.BOWStore as BOWStore
 
 def main():
     # set default parameter
@@ -264,6 +265,9 @@ def main():
                   os.path.join(outputBowPath, "BOWfile.yml") + " -p=" + os.path.join(outputBowPath, "PCAfile.yml")
         os.system(reconstructParam.WORKSPACE_DIR + "/TrainBoW/Release/TrainBoW " + outputPath + " " + \
                   os.path.join(outputBowPath, "BOWfile.yml") + " -p=" + os.path.join(outputBowPath, "PCAfile.yml"))
+        
+        # pack bag of words features written by TrainBoW to memory-mapped stores
+        BOWStore.buildFolders(outputPath)
     
     # load graph structure from "mergeGraph.txt" if it exists
     # create new graph structure if it does not exist
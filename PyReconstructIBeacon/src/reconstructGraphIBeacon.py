@@ -43,6 +43,7 @@ import hulo_file.SfmDataUtils as SfMDataUtils
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_ibeacon.ReconstructIBeaconParam as ReconstructIBeaconParam
 import hulo_bow.ReconstructBOWParam as ReconstructBOWParam
+import hulo_bow.BOWStore as BOWStore
 import hulo_ibeacon.sfmMergeGraphIBeacon as sfmMergeGraphIBeacon
 import hulo_ibeacon.IBeaconUtils as IBeaconUtils
 
@@ -270,6 +271,9 @@ def main():
                   os.path.join(outputBowPath, "BOWfile.yml") + " -p=" + os.path.join(outputBowPath, "PCAfile.yml")
         os.system(reconstructParam.WORKSPACE_DIR + "/TrainBoW/Release/TrainBoW " + outputPath + " " + \
                   os.path.join(outputBowPath, "BOWfile.yml") + " -p=" + os.path.join(outputBowPath, "PCAfile.yml"))
+        
+        # pack bag of words features written by TrainBoW to memory-mapped stores
+        BOWStore.buildFolders(outputPath)
     
     # load graph structure from "mergeGraph.txt" if it exists
     # create new graph structure if it does not exist
@@ -42,6 +42,8 @@ import numpy as np
 from scipy.spatial import cKDTree
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_sfm.mergeSfM as mergeSfM
+from hulo_file.SfmData import SfmData
+import hulo_bow.BOWStore as BOWStore
 import hulo_ibeacon.ReconstructIBeaconParam as ReconstructIBeaconParam
 import hulo_ibeacon.IBeaconUtils as iBeaconUtils
 
@@ -78,13 +80,11 @@ def findInliersByKnownTransform(pointIdA, pointIdB, A, B, M, thres):
     Btmp = np.dot(M, B)
     
     # find inliers by KD tree
-    inliers = []
     kdtree = cKDTree(A.T)
     dist, indexes = kdtree.query(Btmp.T)
     
-    for idx, val in enumerate(dist):                        
-        if val < thres:
-            inliers.append([pointIdB[idx], pointIdA[indexes[idx]]])
+    isInlier = dist < thres
+    inliers = np.vstack((np.asarray(pointIdB)[isInlier], np.asarray(pointIdA)[indexes[isInlier]])).T.tolist()
     
     return inliers
 
@@ -154,8 +154,7 @@ def main():
         if not os.path.exists(project["sfm_data"]):
             print "cannot find sfm data : " + project["sfm_data"]
             sys.exit()
-        with open(project["sfm_data"]) as jsonFile:
-            sfmDataList.append(json.load(jsonFile))
+        sfmDataList.append(SfmData.load(project["sfm_data"]))
     
     AList = []
     for project in projectList:
@@ -200,11 +199,10 @@ def main():
     invA = np.c_[_invA, -np.dot(_invA,AList[0][:,3])]
     mergeSfM.transform_sfm_data(mergeSfmData, invA)
     
-    mergeSfmData["root_path"] = os.path.join(output_dir,"Input","inputImg")
+    mergeSfmData.header["root_path"] = os.path.join(output_dir,"Input","inputImg")
     
     resultSfMDataFile = os.path.join(output_dir,"Output","SfM","reconstruction","global","sfm_data.json")
-    with open(resultSfMDataFile,"w") as jsonfile:
-        json.dump(mergeSfmData, jsonfile)
+    mergeSfmData.save(resultSfMDataFile)
     
     # write new beacon file
     if mergeBeaconmap is not None:
@@ -237,6 +235,7 @@ def main():
               os.path.join(output_dir,"Output", "matches", "BOWfile.yml") + " -p=" + os.path.join(output_dir,"Output", "matches", "PCAfile.yml")
     os.system(reconstructParam.WORKSPACE_DIR + "/TrainBoW/Release/TrainBoW " + os.path.join(output_dir,"Output") + " " + \
               os.path.join(output_dir,"Output", "matches", "BOWfile.yml") + " -p=" + os.path.join(output_dir,"Output", "matches", "PCAfile.yml"))
+    BOWStore.buildFolders(os.path.join(output_dir,"Output"))
     
     os.system("openMVG_main_ComputeSfM_DataColor -i " + resultSfMDataFile + \
               " -o " + os.path.join(output_dir,"Output","SfM","reconstruction","global","colorized.ply"))
@@ -0,0 +1,199 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+################################################################################
+# Inverted index of beacon fingerprints
+#
+# Beacon signals of views are stored as inverted lists from each beacon to views 
+# which observed the beacon with the rssi as weight. Query fingerprint is compared 
+# only with views in inverted lists of beacons observed in the query, so that cost 
+# of lookup grows with number of views sharing beacons with the query instead of 
+# number of all views. The index is saved next to beacon.txt (beacon.txt.index.npz), 
+# and it is valid while it is newer than beacon file.
+################################################################################
+
+import os
+import numpy as np
+import scipy.sparse
+import hulo_ibeacon.IBeaconUtils as IBeaconUtils
+
+# suffix of index file written next to beacon file
+BEACON_INDEX_SUFFIX = ".index.npz"
+
+# inverted index of beacon fingerprints
+#
+# viewID : (N,) viewID of views
+# rssi : (N,B) rssi vector of each view, dense or scipy sparse matrix
+# beaconmap : (major,minor) -> beacon index in rssi vector
+class BeaconIndex:
+    
+    def __init__(self, viewID, rssi, beaconmap):
+        self.viewID = np.asarray(viewID, dtype=np.int64)
+        self.beaconmap = beaconmap
+        
+        # CSC matrix whose column is inverted list from beacon to views
+        self.invertedList = scipy.sparse.csc_matrix(rssi, dtype=np.float32, copy=True)
+        self.invertedList.sum_duplicates()
+        self.invertedList.eliminate_zeros()
+        IBeaconUtils.checkNonNegativeSparse(self.invertedList)
+        self.rssiSum = np.asarray(self.invertedList.sum(axis=1), dtype=np.float32).ravel()
+    
+    # get number of views
+    def getViewCount(self):
+        return len(self.viewID)
+    
+    # get number of views which observed each beacon
+    def getBeaconViewCount(self):
+        return np.diff(self.invertedList.indptr)
+    
+    # calculate cooccurence and distance between rows of sigQ and views sharing beacons with them
+    # sigQ is (nQ,B) dense or sparse matrix whose columns are same as index
+    # returns row of sigQ, index of view, cooccurence and distance, same as IBeaconUtils.calBeaconSimilaritySparse
+    # rows and views of all zero rssi share no beacon, so that they are not returned
+    def calSimilarity(self, sigQ, maxMemory=IBeaconUtils.BEACON_COOCUR_BLOCK_MAX_MEMORY):
+        return IBeaconUtils.calBeaconSimilarityInverted(sigQ, self.invertedList, self.rssiSum, maxMemory)
+    
+    # find top k views by cooccurence for each row of sigQ
+    # only views whose cooccurence is larger than cooccur are returned
+    # views sharing no beacon with query have cooccurence 0 and follow in order of index if cooccur is negative,
+    # except views of all zero rssi for query of all zero rssi, which have no cooccurence as dense signals
+    # returns (nQ,k) index of views padded by -1, and (nQ,k) cooccurence sorted in descending order
+    def queryMatrix(self, sigQ, k, cooccur=0.0, maxMemory=IBeaconUtils.BEACON_COOCUR_BLOCK_MAX_MEMORY):
+        nQ = sigQ.shape[0]
+        topView = -np.ones((nQ,k), dtype=np.int64)
+        topCoocur = np.zeros((nQ,k), dtype=np.float32)
+        
+        pairQ, pairView, pairCoocur, pairDist = self.calSimilarity(sigQ, maxMemory)
+        isValid = pairCoocur > cooccur
+        pairQ = pairQ[isValid]
+        pairView = pairView[isValid]
+        pairCoocur = pairCoocur[isValid]
+        
+        # sort pairs by query, cooccurence and index of view, and take first k pairs of each query
+        order = np.lexsort((pairView, -pairCoocur, pairQ))
+        pairQ = pairQ[order]
+        rank = np.arange(len(pairQ)) - np.searchsorted(pairQ, pairQ)
+        isTop = rank < k
+        topView[pairQ[isTop],rank[isTop]] = pairView[order][isTop]
+        topCoocur[pairQ[isTop],rank[isTop]] = pairCoocur[order][isTop]
+        
+        if cooccur < 0:
+            sumQ = np.asarray(sigQ.sum(axis=1)).ravel()
+            nTop = np.sum(topView>=0, axis=1)
+            firstView = np.arange(min(k, self.getViewCount()))
+            firstNonZeroView = np.nonzero(self.rssiSum>0)[0][:k]
+            for q in np.nonzero(nTop<k)[0]:
+                view = firstView if sumQ[q]>0 else firstNonZeroView
+                view = view[np.logical_not(np.in1d(view, topView[q,:nTop[q]]))][:k-nTop[q]]
+                topView[q,nTop[q]:nTop[q]+len(view)] = view
+        return topView, topCoocur
+    
+    # find top k views by cooccurence for fingerprint sig, which is (B,) vector
+    # returns viewIDs and cooccurence sorted in descending order
+    def query(self, sig, k, cooccur=0.0):
+        if not scipy.sparse.issparse(sig):
+            sig = np.asarray(sig, dtype=np.float32).reshape(1,-1)
+        topView, topCoocur = self.queryMatrix(sig, k, cooccur)
+        isValid = topView[0] >= 0
+        return self.viewID[topView[0][isValid]], topCoocur[0][isValid]
+    
+    # count number of views of query whose cooccurence with any view of index is larger than cooccur
+    # only beacons observed in both query and index are compared as IBeaconUtils.countImgByBeaconIntersect
+    # beaconDataQuery is given as returned by IBeaconUtils.loadBeaconMatrix
+    # VALQ and VALB are lists of viewIDs from query and index, empty means all views
+    def countCoocur(self, beaconDataQuery, cooccur, valQ=[], valB=[], minIntersect=3):
+        viewIdQ, rssiQ, beaconmapQ = beaconDataQuery
+        
+        # get matching indices
+        indexMatches = IBeaconUtils.intersectBeaconmap(beaconmapQ, self.beaconmap)
+        if len(indexMatches) < minIntersect:
+            return 0
+        indexQ = [x[0] for x in indexMatches]
+        indexB = [x[1] for x in indexMatches]
+        
+        # reduce inverted lists to intersected beacons and views in valB
+        invertedList = self.invertedList[:,indexB]
+        if len(valB)>0:
+            isValB = np.in1d(self.viewID, valB)
+            invertedList = invertedList.tocoo()
+            isValid = isValB[invertedList.row]
+            invertedList = scipy.sparse.csc_matrix((invertedList.data[isValid], 
+                                                    (invertedList.row[isValid], invertedList.col[isValid])),
+                                                   shape=invertedList.shape)
+        rssiSum = np.bincount(invertedList.indices, weights=invertedList.data, 
+                              minlength=self.getViewCount()).astype(np.float32)
+        sumB = rssiSum[isValB] if len(valB)>0 else rssiSum
+        
+        if len(valQ)>0:
+            sigQ = rssiQ[np.nonzero(np.in1d(viewIdQ, valQ))[0]][:,indexQ]
+        else:
+            sigQ = rssiQ[:,indexQ]
+        
+        pairQ, pairView, pairCoocur, pairDist = IBeaconUtils.calBeaconSimilarityInverted(sigQ, invertedList, rssiSum)
+        return IBeaconUtils.countCoocurPair(pairQ, pairCoocur, np.asarray(sigQ.sum(axis=1)).ravel(), sumB, cooccur)
+    
+    # save index to file
+    def save(self, filename):
+        beaconKey = np.zeros((len(self.beaconmap),2), dtype=np.int64)
+        for key in self.beaconmap:
+            beaconKey[self.beaconmap[key],:] = key
+        filenameTmp = filename + ".tmp" + str(os.getpid())
+        with open(filenameTmp, "wb") as fp:
+            np.savez(fp, viewID=self.viewID, beaconKey=beaconKey, data=self.invertedList.data,
+                     indices=self.invertedList.indices, indptr=self.invertedList.indptr,
+                     shape=np.array(self.invertedList.shape, dtype=np.int64))
+        os.rename(filenameTmp, filename)
+    
+    # load index from file
+    @staticmethod
+    def loadFile(filename):
+        with np.load(filename) as npz:
+            invertedList = scipy.sparse.csc_matrix((npz["data"], npz["indices"], npz["indptr"]), 
+                                                   shape=tuple(npz["shape"].tolist()))
+            beaconmap = dict(((int(key[0]),int(key[1])),i) for i,key in enumerate(npz["beaconKey"].tolist()))
+            return BeaconIndex(npz["viewID"], invertedList, beaconmap)
+    
+    # load index of beacon file
+    # index file next to beacon file is used while it is newer than beacon file, otherwise
+    # index is made from beacon file and saved
+    @staticmethod
+    def load(beaconFile):
+        indexFile = beaconFile + BEACON_INDEX_SUFFIX
+        if os.path.isfile(beaconFile):
+            mtime = os.path.getmtime(beaconFile)
+        else:
+            mtime = os.path.getmtime(beaconFile + IBeaconUtils.BEACON_BINARY_SUFFIX)
+        if os.path.isfile(indexFile) and os.path.getmtime(indexFile) >= mtime:
+            try:
+                return BeaconIndex.loadFile(indexFile)
+            except (IOError, ValueError, KeyError):
+                pass
+        
+        viewID, rssi, beaconmap = IBeaconUtils.loadBeaconMatrix(beaconFile, True)
+        index = BeaconIndex(viewID, rssi, beaconmap)
+        try:
+            index.save(indexFile)
+        except (IOError, OSError) as e:
+            print "Cannot write beacon index of " + beaconFile + " : " + str(e)
+        return index
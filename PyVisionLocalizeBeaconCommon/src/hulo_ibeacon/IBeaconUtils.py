@@ -24,10 +24,14 @@
 
 import sys
 import numpy as np
+import scipy.sparse
+from scipy.spatial import cKDTree
 import matplotlib.pyplot as plt
 import time
+import itertools
 import os
 import json
+import hulo_file.FileUtils as FileUtils
 
 # parse beacon setting file and extract information, which is
 # number of beacon, and beacon map from (major,minor) to index
@@ -54,6 +58,7 @@ def parseBeaconSetting(beaconfile):
 # parse beacon list with beacon map and return numpy array
 # e.g. [3 100 10 -65 100 30 0 120 60 -79] with map {((100,10),1),((100,20),0),((100,30),2)} 
 # returns [0 35 0] i.e. rssi in map that is not zero will be sum by 100
+# rssi weaker than -100 is set to 0 as not observed
 def parseBeaconList(line,beaconmap):
     
     rssi = np.zeros(len(beaconmap),dtype=np.float32)
@@ -66,7 +71,7 @@ def parseBeaconList(line,beaconmap):
          
         # convert value             
         if strength != 0:
-            strength = strength + 100
+            strength = max(strength + 100, 0)
         
         # add rssi to vector
         if (major,minor) in beaconmap:
@@ -75,36 +80,198 @@ def parseBeaconList(line,beaconmap):
     
     return rssi
 
-# parse CSV file and extract beacon list and photo list
-def parseCSVfile(infilename,beaconmap,approach=0):
+# number of lines of CSV file parsed at once by iterCSVfileChunks
+CSV_CHUNK_LINES = 1 << 16
+
+# convert (major,minor) of beacons to integer code
+def encodeBeaconKey(major,minor):
+    return np.asarray(major, dtype=np.int64) * (1 << 32) + np.asarray(minor, dtype=np.int64)
+
+# normalize rssi matrix of beacon signals, each row is normalized as parseCSVfile
+# approach 0 : rows are divided by max value and multiplied by 100
+# approach 1 : rows are divided by median of nonzero values and multiplied by 100
+# negative values (rssi weaker than -100) are set to 0 as not observed, so that normalized rssi is not negative
+# rssi can be dense matrix or scipy sparse matrix
+def normalizeRssiMatrix(rssi,approach=0):
     approach = int(approach)
+    if rssi.shape[0]==0 or rssi.shape[1]==0:
+        return rssi
+    if scipy.sparse.issparse(rssi):
+        return normalizeRssiSparse(rssi, approach)
+    
+    rssi = np.maximum(rssi, 0).astype(rssi.dtype)
+    if approach == 0: # max
+        rssiNorm = np.max(rssi, axis=1)
+    elif approach == 1: # median
+        # median of values larger than 0, non positive values are moved to the end by sorting
+        nPositive = np.sum(rssi>0, axis=1)
+        sortedRssi = np.sort(np.where(rssi>0, rssi, np.inf).astype(rssi.dtype), axis=1)
+        rows = np.arange(rssi.shape[0])
+        lower = sortedRssi[rows, np.maximum((nPositive-1)//2, 0)]
+        upper = sortedRssi[rows, np.maximum(nPositive//2, 0)]
+        rssiNorm = np.where(nPositive%2==1, lower, (lower+upper)/rssi.dtype.type(2))
+        rssiNorm[nPositive==0] = 0
+    else:
+        return rssi
+    
+    isNorm = rssiNorm>0
+    rssi[isNorm] = rssi[isNorm]/rssiNorm[isNorm,np.newaxis]*100
+    return rssi
+
+# same as normalizeRssiMatrix for scipy sparse rssi matrix, returns CSR matrix
+# only stored values are sorted to find median, so that cost grows with number of observed beacons
+def normalizeRssiSparse(rssi,approach=0):
+    rssi = scipy.sparse.csr_matrix(rssi, copy=True)
+    rssi.sum_duplicates()
+    rssi.data[rssi.data<0] = 0
+    rssi.eliminate_zeros()
+    nRow = rssi.shape[0]
+    rows = np.repeat(np.arange(nRow), np.diff(rssi.indptr))
+    
+    if approach == 0: # max
+        rssiNorm = np.asarray(rssi.max(axis=1).todense(), dtype=rssi.dtype).ravel()
+    elif approach == 1: # median
+        isPositive = rssi.data>0
+        positiveRows = rows[isPositive]
+        positiveData = rssi.data[isPositive]
+        order = np.lexsort((positiveData, positiveRows))
+        sortedData = positiveData[order]
+        nPositive = np.bincount(positiveRows, minlength=nRow)
+        rowStart = np.cumsum(nPositive) - nPositive
+        hasPositive = nPositive>0
+        lower = sortedData[(rowStart + (nPositive-1)//2)[hasPositive]]
+        upper = sortedData[(rowStart + nPositive//2)[hasPositive]]
+        rssiNorm = np.zeros(nRow, dtype=rssi.dtype)
+        rssiNorm[hasPositive] = np.where(nPositive[hasPositive]%2==1, lower, (lower+upper)/rssi.dtype.type(2))
+    else:
+        return rssi
     
-    beaconList = {}
-    photoList = {}
+    isNorm = rssiNorm[rows]>0
+    rssi.data[isNorm] = rssi.data[isNorm]/rssiNorm[rows[isNorm]]*100
+    return rssi
+
+# parse lines of CSV file at once
+# returns timestamps and (N,len(beaconmap)) rssi matrix of beacon signals, 
+# and timestamps and filenames of photos
+# rssi matrix is CSR sparse matrix if sparse is True
+def parseCSVlines(lines,beaconmap,approach=0,sparse=False):
+    beaconmapKey = encodeBeaconKey([key[0] for key in beaconmap], [key[1] for key in beaconmap])
+    beaconmapIndex = np.array(beaconmap.values(), dtype=np.int64)
+    beaconmapOrder = np.argsort(beaconmapKey)
+    beaconmapKey = beaconmapKey[beaconmapOrder]
+    beaconmapIndex = beaconmapIndex[beaconmapOrder]
+    
+    # split lines, and collect (major,minor,strength) of all beacon signals
+    beaconTime = []
+    beaconCount = []
+    beaconTokens = []
+    photoTime = []
+    photoName = []
+    for line in lines:
+        splitline = line.strip().split(",")
+        if len(splitline) < 2:
+            continue
+        if splitline[1] == "Beacon":
+            nSignal = int(splitline[6])
+            beaconTime.append(int(splitline[0]))
+            beaconCount.append(nSignal)
+            beaconTokens.extend(splitline[7:7+3*nSignal])
+        elif splitline[1] == "Misc" and splitline[2] == "Photo":
+            photoTime.append(int(splitline[0]))
+            photoName.append(splitline[3])
+    
+    # set signals to rssi matrix
+    signalRow = np.zeros(0, dtype=np.int64)
+    signalCol = np.zeros(0, dtype=np.int64)
+    strength = np.zeros(0, dtype=np.int64)
+    if len(beaconTokens) > 0 and len(beaconmap) > 0:
+        signal = np.fromstring(",".join(beaconTokens), dtype=np.int64, sep=",").reshape(-1,3)
+        signalRow = np.repeat(np.arange(len(beaconTime)), beaconCount)
+        signalKey = encodeBeaconKey(signal[:,0], signal[:,1])
+        signalMapPos = np.minimum(np.searchsorted(beaconmapKey, signalKey), len(beaconmapKey)-1)
+        isInMap = beaconmapKey[signalMapPos]==signalKey
+        signalRow = signalRow[isInMap]
+        signalCol = beaconmapIndex[signalMapPos[isInMap]]
+        
+        # convert value
+        strength = signal[isInMap,2]
+        strength = np.where(strength!=0, strength+100, 0)
+    
+    if sparse:
+        # keep last signal of the same beacon in a line as dense matrix
+        signalKey = signalRow * len(beaconmap) + signalCol
+        _, lastIdx = np.unique(signalKey[::-1], return_index=True)
+        lastIdx = len(signalKey) - 1 - lastIdx
+        rssi = scipy.sparse.csr_matrix((strength[lastIdx].astype(np.float32), (signalRow[lastIdx], signalCol[lastIdx])),
+                                       shape=(len(beaconTime),len(beaconmap)))
+    else:
+        rssi = np.zeros((len(beaconTime),len(beaconmap)), dtype=np.float32)
+        rssi[signalRow, signalCol] = strength
     
+    rssi = normalizeRssiMatrix(rssi, approach)
+    return np.array(beaconTime, dtype=np.int64), rssi, np.array(photoTime, dtype=np.int64), photoName
+
+# parse CSV file by chunks of chunkLines lines to bound memory used for parsing
+# yields results of parseCSVlines for each chunk
+def iterCSVfileChunks(infilename,beaconmap,approach=0,chunkLines=CSV_CHUNK_LINES,sparse=False):
     with open(infilename) as fclrz:
+        lines = []
         for line in fclrz:
-            line = line.strip()
-            splitline = line.split(",")
+            lines.append(line)
+            if len(lines) >= chunkLines:
+                yield parseCSVlines(lines, beaconmap, approach, sparse)
+                lines = []
+        if len(lines) > 0:
+            yield parseCSVlines(lines, beaconmap, approach, sparse)
 
-            timestamp = int(splitline[0])
+# parse CSV file and extract arrays of beacon signals and photos
+# returns timestamps and rssi matrix of beacon signals, and timestamps and filenames of photos
+# rssi matrix is CSR sparse matrix if sparse is True
+# only temporary arrays used for parsing are bounded by chunkLines, returned arrays have all 
+# beacon signals in the file, use associateBeaconToImgCSVfile to keep only signals associated to images
+def parseCSVfileArrays(infilename,beaconmap,approach=0,chunkLines=CSV_CHUNK_LINES,sparse=False):
+    chunks = list(iterCSVfileChunks(infilename, beaconmap, approach, chunkLines, sparse))
+    if len(chunks)==0:
+        rssi = np.zeros((0,len(beaconmap)), dtype=np.float32)
+        if sparse:
+            rssi = scipy.sparse.csr_matrix(rssi)
+        return np.zeros(0, dtype=np.int64), rssi, np.zeros(0, dtype=np.int64), []
+    beaconTime = np.concatenate([chunk[0] for chunk in chunks])
+    if sparse:
+        rssi = scipy.sparse.vstack([chunk[1] for chunk in chunks], format="csr")
+    else:
+        rssi = np.vstack([chunk[1] for chunk in chunks])
+    photoTime = np.concatenate([chunk[2] for chunk in chunks])
+    photoName = [name for chunk in chunks for name in chunk[3]]
+    return beaconTime, rssi, photoTime, photoName
 
-            # parse by type
+# read timestamps of beacon signals, and timestamps and filenames of photos in CSV file
+# only first fields of each line are split, beacon signals are not parsed
+# returns timestamps of beacon signals in the same order as rows of parseCSVfileArrays, 
+# and timestamps and filenames of photos
+def parseCSVfileTimestamps(infilename):
+    beaconTime = []
+    photoTime = []
+    photoName = []
+    with open(infilename) as fclrz:
+        for line in fclrz:
+            splitline = line.strip().split(",",4)
+            if len(splitline) < 2:
+                continue
             if splitline[1] == "Beacon":
-                rssi = parseBeaconList(splitline[6:],beaconmap)
-                if approach == 0: # max
-                    rssiMax = np.max(rssi)
-                    if rssiMax>0:
-                        rssi = rssi/rssiMax*100
-                elif approach == 1: #median
-                    if np.shape(np.where(rssi>0))[1]>0:
-                        rssiMed = np.median(rssi[np.where(rssi>0)[0]])
-                        if rssiMed > 0:
-                            rssi = rssi/rssiMed*100
-                beaconList[timestamp] = rssi
+                beaconTime.append(int(splitline[0]))
             elif splitline[1] == "Misc" and splitline[2] == "Photo":
-                photoList[timestamp] = splitline[3]
+                photoTime.append(int(splitline[0]))
+                photoName.append(splitline[3])
+    return np.array(beaconTime, dtype=np.int64), np.array(photoTime, dtype=np.int64), photoName
 
+# parse CSV file and extract beacon list and photo list
+# beacon list is mapping int (timestamp) -> np.array (rssi), and photo list is 
+# mapping int (timestamp) -> string (filename)
+def parseCSVfile(infilename,beaconmap,approach=0,chunkLines=CSV_CHUNK_LINES):
+    beaconTime, rssi, photoTime, photoName = parseCSVfileArrays(infilename, beaconmap, approach, chunkLines)
+    beaconList = dict(zip(beaconTime.tolist(), rssi))
+    photoList = dict(zip(photoTime.tolist(), photoName))
     return beaconList, photoList
 
 # extract image name to view ID mapping from sfm_data
@@ -126,27 +293,146 @@ def removeImgNotInSfmData(photoList, viewIDMap):
         if photoList[key] not in viewIDMap:
             del photoList[key]
             
+# align query timestamps to sorted reference timestamps
+# mode "nearest" : nearest reference, earlier one is used if two references are equally near
+# mode "previous" : latest reference which is not later than query
+# reference whose time difference is not smaller than maxTimeDiff is not associated, if maxTimeDiff is given
+# returns index of reference for each query, -1 if query is not associated
+def alignTimestamps(queryTime, refTime, mode="nearest", maxTimeDiff=None):
+    queryTime = np.asarray(queryTime, dtype=np.int64)
+    refTime = np.asarray(refTime, dtype=np.int64)
+    if len(refTime)==0:
+        return -np.ones(len(queryTime), dtype=np.int64)
+    
+    # index of latest reference which is not later than query
+    prevIndex = np.searchsorted(refTime, queryTime, side="right") - 1
+    if mode=="previous":
+        refIndex = prevIndex
+    elif mode=="nearest":
+        nextIndex = np.minimum(prevIndex+1, len(refTime)-1)
+        prevIndexValid = np.maximum(prevIndex, 0)
+        useNext = np.logical_or(prevIndex<0, 
+                                np.abs(refTime[nextIndex]-queryTime) < np.abs(queryTime-refTime[prevIndexValid]))
+        refIndex = np.where(useNext, nextIndex, prevIndex)
+    else:
+        raise ValueError("Unknown align mode : " + str(mode))
+    
+    if maxTimeDiff is not None:
+        isFar = np.abs(refTime[np.maximum(refIndex,0)]-queryTime) >= maxTimeDiff
+        refIndex[isFar] = -1
+    refIndex[refIndex<0] = -1
+    return refIndex
+
+# find two references before and after each query in sorted reference timestamps, and
+# weight of later reference for linear interpolation at query time
+# queries before first or after last reference use the first or last reference
+# returns index of earlier reference, index of later reference, and weight of later reference
+def interpolateTimestamps(queryTime, refTime):
+    queryTime = np.asarray(queryTime, dtype=np.int64)
+    refTime = np.asarray(refTime, dtype=np.int64)
+    
+    prevIndex = np.clip(np.searchsorted(refTime, queryTime, side="right") - 1, 0, len(refTime)-1)
+    nextIndex = np.minimum(prevIndex+1, len(refTime)-1)
+    interval = (refTime[nextIndex]-refTime[prevIndex]).astype(np.float64)
+    weight = np.zeros(len(queryTime), dtype=np.float64)
+    hasInterval = interval>0
+    weight[hasInterval] = (queryTime[hasInterval]-refTime[prevIndex[hasInterval]]) / interval[hasInterval]
+    weight = np.clip(weight, 0.0, 1.0)
+    return prevIndex, nextIndex, weight
+
 # associate beacon to image
 # photoTmp is mapping int (timestamp) -> string (filename)
 # beaconTmp is mapping int (timestamp) -> np.array (rssi)
 # returns a mapping of int (viewID) ->  {"time" : int , "rssi" : np.array}
-def associateBeaconToImg(photoTmp, beaconTmp, viewIDMap):   
+# images whose nearest beacon is not within maxTimeDiff are not associated, if maxTimeDiff is given
+# if interpolate is True, rssi is interpolated between two beacon scans before and after the image
+def associateBeaconToImg(photoTmp, beaconTmp, viewIDMap, maxTimeDiff=None, interpolate=False):   
     imgBeaconMap = {}
+    if len(photoTmp)==0 or len(beaconTmp)==0:
+        return imgBeaconMap
+    
+    photoTime = np.array(sorted(photoTmp.keys()), dtype=np.int64)
+    beaconTime = np.array(sorted(beaconTmp.keys()), dtype=np.int64)
     
-    for key in sorted(photoTmp.keys()):
+    # get closest RSSI in time
+    beaconInd = alignTimestamps(photoTime, beaconTime, "nearest", maxTimeDiff)
+    if interpolate:
+        beaconRssi = np.vstack([beaconTmp[key] for key in beaconTime.tolist()])
+        prevInd, nextInd, weight = interpolateTimestamps(photoTime, beaconTime)
+        rssiInterp = (beaconRssi[prevInd] * (1.0-weight)[:,np.newaxis] + 
+                      beaconRssi[nextInd] * weight[:,np.newaxis]).astype(beaconRssi.dtype)
+    
+    for i, key in enumerate(photoTime.tolist()):
+        if beaconInd[i] < 0:
+            continue
+        
         # get image info
         imgName = photoTmp[key]
         viewID = viewIDMap[imgName]
         
-        # get closest RSSI in time
-        beaconInd = np.argmin(abs(key-np.array(beaconTmp.keys())))
-        rssi = beaconTmp[beaconTmp.keys()[beaconInd]]
+        if interpolate:
+            rssi = rssiInterp[i]
+        else:
+            rssi = beaconTmp[int(beaconTime[beaconInd[i]])]
         
         # save data
         imgBeaconMap[viewID] = {"time" : key , "rssi" : rssi}
 
     return imgBeaconMap
 
+# associate beacon to image in CSV file, result is the same as associateBeaconToImg with parseCSVfile
+# CSV file is read twice. Timestamps are read first to find beacon signals associated to images,
+# then only rssi of the associated signals are kept while the file is parsed by chunks of chunkLines lines,
+# so that rssi matrix of all beacon signals in the file is not made
+# returns a mapping of int (viewID) ->  {"time" : int , "rssi" : np.array}
+def associateBeaconToImgCSVfile(infilename, beaconmap, approach, viewIDMap, maxTimeDiff=None, interpolate=False, 
+                                chunkLines=CSV_CHUNK_LINES):
+    imgBeaconMap = {}
+    beaconTime, photoTime, photoName = parseCSVfileTimestamps(infilename)
+    
+    # last signal and photo of the same timestamp are used, and photos not in viewIDMap are removed
+    nBeacon = len(beaconTime)
+    beaconTime, beaconRow = np.unique(beaconTime[::-1], return_index=True)
+    beaconRow = nBeacon - 1 - beaconRow
+    photoTime, photoRow = np.unique(photoTime[::-1], return_index=True)
+    photoRow = len(photoName) - 1 - photoRow
+    isInSfmData = np.array([photoName[i] in viewIDMap for i in photoRow.tolist()], dtype=np.bool)
+    photoTime = photoTime[isInSfmData]
+    photoRow = photoRow[isInSfmData]
+    if len(photoTime)==0 or len(beaconTime)==0:
+        return imgBeaconMap
+    
+    # find beacon signals associated to images
+    beaconInd = alignTimestamps(photoTime, beaconTime, "nearest", maxTimeDiff)
+    isAssociated = beaconInd >= 0
+    if interpolate:
+        prevInd, nextInd, weight = interpolateTimestamps(photoTime, beaconTime)
+        usedRow = np.concatenate((beaconRow[prevInd[isAssociated]], beaconRow[nextInd[isAssociated]]))
+    else:
+        usedRow = beaconRow[beaconInd[isAssociated]]
+    usedRow = np.unique(usedRow)
+    
+    # keep rssi of associated beacon signals
+    usedRssi = np.zeros((len(usedRow),len(beaconmap)), dtype=np.float32)
+    rowOffset = 0
+    for chunk in iterCSVfileChunks(infilename, beaconmap, approach, chunkLines):
+        chunkRssi = chunk[1]
+        usedStart, usedEnd = np.searchsorted(usedRow, [rowOffset, rowOffset+len(chunkRssi)])
+        usedRssi[usedStart:usedEnd] = chunkRssi[usedRow[usedStart:usedEnd]-rowOffset]
+        rowOffset = rowOffset + len(chunkRssi)
+    
+    for i in np.flatnonzero(isAssociated).tolist():
+        if interpolate:
+            rssiPrev = usedRssi[np.searchsorted(usedRow, beaconRow[prevInd[i]])].astype(np.float64)
+            rssiNext = usedRssi[np.searchsorted(usedRow, beaconRow[nextInd[i]])].astype(np.float64)
+            rssi = (rssiPrev * (1.0-weight[i]) + rssiNext * weight[i]).astype(usedRssi.dtype)
+        else:
+            rssi = usedRssi[np.searchsorted(usedRow, beaconRow[beaconInd[i]])]
+        
+        imgBeaconMap[viewIDMap[photoName[photoRow[i]]]] = {"time" : int(photoTime[i]) , "rssi" : rssi}
+    
+    return imgBeaconMap
+
 # generate consecutive pair list from list of numbers
 def genPair(listID,frame):
     pairs = []
@@ -169,11 +455,226 @@ def genVidPair(imgBeaconMap,frameCont):
     return pairs
 
 # calculate cooccurence between two beacon numpy vector
+# vectors can also be given as scipy sparse row vectors
 def calBeaconCoocur(vec1,vec2):
+    if scipy.sparse.issparse(vec1) or scipy.sparse.issparse(vec2):
+        pairQ, pairB, coocur, dist = calBeaconSimilaritySparse(vec1, vec2)
+        return coocur[0] if len(coocur)>0 else 0.0
     return np.sum(np.minimum(vec1,vec2))/np.sum(np.maximum(vec1,vec2))
 
+# calculate distance between all rows of sigQ and sigB, same as calBeaconDistance
+# returns (nQ,nB) distance
+# temporary arrays are one (nQ,nB,B) array of values and one (nQ,nB,B) boolean array
+def calBeaconDistanceBlock(sigQ,sigB):
+    isObservedQ = sigQ > 0
+    isObservedB = sigB > 0
+    isCoObserved = isObservedQ[:,np.newaxis,:] * isObservedB[np.newaxis,:,:]
+    denom = np.sum(isCoObserved, axis=2)
+    diff = np.subtract(sigQ[:,np.newaxis,:], sigB[np.newaxis,:,:])
+    np.abs(diff, out=diff)
+    diff *= isCoObserved
+    sumDiff = np.sum(diff, axis=2)
+    del diff, isCoObserved
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = (sumDiff / denom).astype(np.float32)
+    dist[denom < 2] = 500
+    return dist
+
+# maximum bytes of temporary arrays used by calBeaconCoocurBlock and genBeaconSimKnnPair
+BEACON_COOCUR_BLOCK_MAX_MEMORY = 1 << 26
+
+# bytes of temporary arrays for each element of (nBlock,nB,B) array of dense signals 
+# calBeaconDistanceBlock has one float32 array and one boolean array at once, and other 
+# dense block functions reuse one float32 array
+_BEACON_DENSE_BLOCK_BYTES = np.dtype(np.float32).itemsize + np.dtype(np.bool).itemsize
+
+# get number of rows of dense signals compared with nB rows of nBeacon beacons at once,
+# so that temporary arrays do not exceed maxMemory bytes
+def getBeaconDenseBlockSize(nB, nBeacon, maxMemory):
+    return max(1, int(maxMemory / (max(1,nB) * max(1,nBeacon) * _BEACON_DENSE_BLOCK_BYTES)))
+
+# calculate cooccurence (generalized Jaccard similarity) between all rows of sigQ and sigB
+# rows of sigQ are processed in blocks so that temporary array does not exceed maxMemory bytes
+# sum of maximum is calculated as sum(q)+sum(b)-sum(min), which is exact for integer rssi
+# returns
+# count : number of rows of sigQ whose cooccurence with any row of sigB is larger than cooccur
+# bestMatch : (nQ,) index of row of sigB with largest cooccurence, -1 if sigB is empty
+# bestCoocur : (nQ,) largest cooccurence, 0 if sigB is empty
+# coocur : (nQ,nB) cooccurence of all pairs, only if returnCoocur is True
+# if sigQ or sigB is scipy sparse matrix, calBeaconSimilaritySparse is used and coocur is CSR matrix
+def calBeaconCoocurBlock(sigQ,sigB,cooccur,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY,returnCoocur=False):
+    if scipy.sparse.issparse(sigQ) or scipy.sparse.issparse(sigB):
+        return calBeaconCoocurSparse(sigQ, sigB, cooccur, maxMemory, returnCoocur)
+    
+    sigQ = np.asarray(sigQ, dtype=np.float32)
+    sigB = np.asarray(sigB, dtype=np.float32)
+    nQ = sigQ.shape[0]
+    nB = sigB.shape[0]
+    
+    count = 0
+    bestMatch = -np.ones(nQ, dtype=np.int64)
+    bestCoocur = np.zeros(nQ, dtype=np.float32)
+    if returnCoocur:
+        coocur = np.zeros((nQ,nB), dtype=np.float32)
+    if nQ==0 or nB==0:
+        if returnCoocur:
+            return count, bestMatch, bestCoocur, coocur
+        return count, bestMatch, bestCoocur
+    
+    sumB = np.sum(sigB, axis=1)
+    blockSize = getBeaconDenseBlockSize(nB, sigB.shape[1], maxMemory)
+    blockMin = np.empty((min(blockSize,nQ),nB,sigB.shape[1]), dtype=np.float32)
+    for start in range(0,nQ,blockSize):
+        blockQ = sigQ[start:start+blockSize]
+        np.minimum(blockQ[:,np.newaxis,:], sigB[np.newaxis,:,:], out=blockMin[:len(blockQ)])
+        sumMin = np.sum(blockMin[:len(blockQ)], axis=2)
+        sumMax = np.sum(blockQ, axis=1)[:,np.newaxis] + sumB[np.newaxis,:] - sumMin
+        with np.errstate(divide="ignore", invalid="ignore"):
+            blockCoocur = sumMin / sumMax
+            
+            # pairs of signals which are all zero are not counted
+            count += int(np.sum(np.any(blockCoocur>cooccur, axis=1)))
+        blockCoocur[np.isnan(blockCoocur)] = 0
+        bestMatch[start:start+len(blockQ)] = np.argmax(blockCoocur, axis=1)
+        bestCoocur[start:start+len(blockQ)] = np.max(blockCoocur, axis=1)
+        if returnCoocur:
+            coocur[start:start+len(blockQ)] = blockCoocur
+    
+    if returnCoocur:
+        return count, bestMatch, bestCoocur, coocur
+    return count, bestMatch, bestCoocur
+
+# calculate cooccurence between all rows of sparse sigQ and sigB, same as calBeaconCoocurBlock
+# pairs of rows without commonly observed beacon have cooccurence 0, and are not stored in coocur
+# pairs of rows which are both all zero have no cooccurence as calBeaconCoocurBlock, and are not counted
+def calBeaconCoocurSparse(sigQ,sigB,cooccur,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY,returnCoocur=False):
+    nQ = sigQ.shape[0]
+    nB = sigB.shape[0]
+    pairQ, pairB, pairCoocur, pairDist = calBeaconSimilaritySparse(sigQ, sigB, maxMemory)
+    count = countCoocurPair(pairQ, pairCoocur, np.asarray(sigQ.sum(axis=1)).ravel(), 
+                            np.asarray(sigB.sum(axis=1)).ravel(), cooccur)
+    
+    # pair with largest cooccurence for each row of sigQ, smaller index of sigB is selected for tie
+    # as np.argmax, and rows without commonly observed beacon match first row of sigB
+    bestMatch = -np.ones(nQ, dtype=np.int64)
+    bestCoocur = np.zeros(nQ, dtype=np.float32)
+    if nB>0:
+        bestMatch[:] = 0
+        order = np.lexsort((pairB, -pairCoocur, pairQ))
+        isFirst = np.ones(len(order), dtype=bool)
+        isFirst[1:] = pairQ[order][1:]!=pairQ[order][:-1]
+        best = order[isFirst]
+        isPositive = pairCoocur[best]>0
+        bestMatch[pairQ[best[isPositive]]] = pairB[best[isPositive]]
+        bestCoocur[pairQ[best]] = pairCoocur[best]
+    
+    if returnCoocur:
+        coocur = scipy.sparse.csr_matrix((pairCoocur,(pairQ,pairB)), shape=(nQ,nB))
+        return count, bestMatch, bestCoocur, coocur
+    return count, bestMatch, bestCoocur
+
+# count rows of sigQ whose cooccurence with any row of sigB is larger than cooccur from pairs returned by 
+# calBeaconSimilaritySparse, sumQ and sumB are sum of each row of sigQ and sigB
+# pairs not returned have cooccurence 0, except pairs of all zero rows which have no cooccurence,
+# so that they are counted only if cooccur is negative
+def countCoocurPair(pairQ,pairCoocur,sumQ,sumB,cooccur):
+    if cooccur >= 0:
+        return len(np.unique(pairQ[pairCoocur>cooccur]))
+    if len(sumB)==0:
+        return 0
+    if np.any(sumB>0):
+        return len(sumQ)
+    return int(np.sum(sumQ>0))
+
+# check that rssi values of scipy sparse matrix are not negative
+# sparse functions treat values which are not stored as 0, which is smallest rssi only if rssi is not negative
+def checkNonNegativeSparse(sig):
+    if sig.nnz > 0 and np.min(sig.data) < 0:
+        raise ValueError("Sparse rssi matrix has negative values")
+
+# number of bytes of temporary arrays used for each pair of commonly observed beacon in calBeaconSimilaritySparse
+_BEACON_SPARSE_PAIR_BYTES = 64
+
+# calculate cooccurence and distance between rows of sigQ and sigB given as scipy sparse matrix
+# only values of commonly observed beacons are compared, so that cost grows with number of observed 
+# beacons per signal instead of total number of beacons, ValueError is raised if rssi is negative
+# rows of sigQ are processed in blocks so that temporary arrays do not exceed maxMemory bytes
+# returns pairs of row of sigQ and row of sigB which observe at least one common beacon, and
+# cooccurence and distance of the pairs same as calBeaconCoocur and calBeaconDistance
+def calBeaconSimilaritySparse(sigQ,sigB,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY):
+    sigB = scipy.sparse.csc_matrix(sigB, dtype=np.float32, copy=True)
+    sigB.sum_duplicates()
+    sigB.eliminate_zeros()
+    checkNonNegativeSparse(sigB)
+    sumB = np.asarray(sigB.sum(axis=1), dtype=np.float32).ravel()
+    return calBeaconSimilarityInverted(sigQ, sigB, sumB, maxMemory)
+
+# same as calBeaconSimilaritySparse, but sigB is given as inverted lists from beacon to rows of sigB, 
+# which is CSC matrix without zero values, and sumB is sum of each row of sigB
+# only inverted lists of beacons observed in sigQ are read
+def calBeaconSimilarityInverted(sigQ,sigB,sumB,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY):
+    sigQ = scipy.sparse.csr_matrix(sigQ, dtype=np.float32, copy=True)
+    sigQ.sum_duplicates()
+    sigQ.eliminate_zeros()
+    checkNonNegativeSparse(sigQ)
+    nB = sigB.shape[0]
+    sumQ = np.asarray(sigQ.sum(axis=1), dtype=np.float32).ravel()
+    countB = np.diff(sigB.indptr)
+    
+    # number of pairs of commonly observed beacons for each row of sigQ decides block size
+    nRowPair = np.bincount(np.repeat(np.arange(sigQ.shape[0]), np.diff(sigQ.indptr)),
+                           weights=countB[sigQ.indices], minlength=sigQ.shape[0])
+    maxBlockPair = max(1, int(maxMemory / _BEACON_SPARSE_PAIR_BYTES))
+    
+    listPairQ = []
+    listPairB = []
+    listSumMin = []
+    listSumDiff = []
+    listCount = []
+    start = 0
+    while start < sigQ.shape[0]:
+        end = start + max(1, int(np.searchsorted(np.cumsum(nRowPair[start:]), maxBlockPair, side="right")))
+        blockQ = sigQ[start:end].tocsc()
+        
+        # enumerate all pairs of entries of blockQ and sigB in the same column
+        colQ = np.repeat(np.arange(blockQ.shape[1]), np.diff(blockQ.indptr))
+        nEntryPair = countB[colQ]
+        entryQ = np.repeat(np.arange(blockQ.nnz), nEntryPair)
+        entryStart = np.cumsum(nEntryPair) - nEntryPair
+        entryB = sigB.indptr[colQ[entryQ]] + np.arange(len(entryQ)) - np.repeat(entryStart, nEntryPair)
+        valQ = blockQ.data[entryQ]
+        valB = sigB.data[entryB]
+        
+        # sum values of entry pairs for each pair of rows
+        pairKey, pairIdx = np.unique(blockQ.indices[entryQ].astype(np.int64) * nB + sigB.indices[entryB], return_inverse=True)
+        listPairQ.append(pairKey // nB + start)
+        listPairB.append(pairKey % nB)
+        listSumMin.append(np.bincount(pairIdx, weights=np.minimum(valQ,valB), minlength=len(pairKey)))
+        listSumDiff.append(np.bincount(pairIdx, weights=np.abs(valQ-valB), minlength=len(pairKey)))
+        listCount.append(np.bincount(pairIdx, minlength=len(pairKey)))
+        start = end
+    
+    if len(listPairQ)==0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+            np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    pairQ = np.concatenate(listPairQ)
+    pairB = np.concatenate(listPairB)
+    sumMin = np.concatenate(listSumMin).astype(np.float32)
+    sumDiff = np.concatenate(listSumDiff).astype(np.float32)
+    count = np.concatenate(listCount)
+    
+    coocur = (sumMin / (sumQ[pairQ] + sumB[pairB] - sumMin)).astype(np.float32)
+    dist = np.empty(len(pairQ), dtype=np.float32)
+    dist[count<2] = 500
+    dist[count>=2] = sumDiff[count>=2] / count[count>=2]
+    return pairQ, pairB, coocur, dist
+
 # calculate distance between two beacon numpy vector
+# vectors can also be given as scipy sparse row vectors
 def calBeaconDistance(vec1,vec2):
+    if scipy.sparse.issparse(vec1) or scipy.sparse.issparse(vec2):
+        pairQ, pairB, coocur, dist = calBeaconSimilaritySparse(vec1, vec2)
+        return dist[0] if len(dist)>0 else 500
     denom = np.sum((vec1 > 0) * (vec2 > 0))
     
     if denom < 2:
@@ -223,125 +724,179 @@ def genBeaconSimPair(imgBeaconMap,knn,distance,cooccur):
     return pairs
 
 #generate pair via beacon similarity
-def genBeaconSimKnnPair(imgBeaconMap,knn,cooccur):
+#distances between views are calculated for blocks of views so that temporary arrays 
+#do not exceed maxMemory bytes
+#if returnSparse is True, also returns sparse matrix of beacon distance of selected pairs
+#whose rows and cols are indexes of returned list of view IDs
+#if sparse is True, rssi vectors are compared with BeaconIndex of all views, so that cost grows
+#with number of views sharing beacons instead of number of all views and beacons
+def genBeaconSimKnnPair(imgBeaconMap,knn,cooccur,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY,returnSparse=False,sparse=False):
     print "start find beacon similarity knn view..."
     if knn>len(imgBeaconMap):
         print "Error : knn is larger than number of image views"
         sys.exit()
     
-    # calculate dist
-    print "start calculating beacon distance for all views..."        
+    # import here to avoid circular import
+    from hulo_ibeacon.BeaconIndex import BeaconIndex
+    
     viewIDs = imgBeaconMap.keys()
-    distMat = np.zeros([len(viewIDs),len(viewIDs)],dtype=np.float32)
-    for i in range(0,len(viewIDs)-1):
-        for j in range(i+1,len(viewIDs)):
-            viewID1 = viewIDs[i]
-            viewID2 = viewIDs[j]
-            
-            distTmp = calBeaconDistance(imgBeaconMap[viewID1]["rssi"],imgBeaconMap[viewID2]["rssi"])
-            
-            distMat[i,j] = distTmp
-            distMat[j,i] = distTmp
-
-    distListMap = {}
-    for i in range(0,len(viewIDs)):
-        viewID1 = viewIDs[i]
-        distances = []
-        for j in range(0,len(viewIDs)):
-            viewID2 = viewIDs[j]
-            distances.append(distMat[i][j])
-        distances.sort()
-        distListMap[viewID1] = distances
+    index = None
+    if sparse:
+        sig = scipy.sparse.vstack([scipy.sparse.csr_matrix(imgBeaconMap[viewID]["rssi"], dtype=np.float32) for viewID in viewIDs],
+                                  format="csr") if len(viewIDs)>0 else scipy.sparse.csr_matrix((0,0), dtype=np.float32)
+        nView = sig.shape[0]
+        blockSize = max(1, int(maxMemory / (max(1,nView) * 4 * np.dtype(np.float32).itemsize)))
+        index = BeaconIndex(np.arange(nView), sig, {})
+    else:
+        sig = np.vstack([imgBeaconMap[viewID]["rssi"] for viewID in viewIDs]).astype(np.float32) \
+            if len(viewIDs)>0 else np.zeros((0,0), dtype=np.float32)
+        nView = sig.shape[0]
+        blockSize = getBeaconDenseBlockSize(nView, sig.shape[1], maxMemory)
+    
+    # calculate distance to (knn+1)-th nearest view except itself for all views
+    print "start calculating beacon distance for all views..."
+    distKnn = np.zeros(nView, dtype=np.float32)
+    for start in range(0,nView,blockSize):
+        dist = calBeaconSimKnnBlock(sig[start:start+blockSize], sig, maxMemory, index)[0]
+        dist[np.arange(dist.shape[0]),np.arange(start,start+dist.shape[0])] = 0
+        if knn+1 < nView:
+            distKnn[start:start+dist.shape[0]] = np.partition(dist, knn+1, axis=1)[:,knn+1]
+        else:
+            distKnn[start:start+dist.shape[0]] = np.max(dist, axis=1)
     print "finish calculating beacon distance for all views."
     
     # calculate coocur and select pairs
-    print "start calculating beacon cooccurance and select knn views..."    
+    print "start calculating beacon cooccurance and select knn views..."
     pairs = []
-    for i in range(0,len(viewIDs)-1):
-        for j in range(i+1,len(viewIDs)):
-            viewID1 = viewIDs[i]
-            viewID2 = viewIDs[j]
-            
-            cooccurTmp = calBeaconCoocur(imgBeaconMap[viewID1]["rssi"],imgBeaconMap[viewID2]["rssi"])                    
-            if cooccurTmp >= cooccur:
-                dist = distMat[i, j]                        
-                if (dist<=distListMap[viewID1][knn+1] or dist<=distListMap[viewID2][knn+1]):
-                    pairs = pairs + [(viewID1,viewID2)]
+    listPairI = []
+    listPairJ = []
+    listPairDist = []
+    for start in range(0,nView,blockSize):
+        blockSig = sig[start:start+blockSize]
+        dist, coocurTmp = calBeaconSimKnnBlock(blockSig, sig, maxMemory, index)
+        with np.errstate(invalid="ignore"):
+            isPair = coocurTmp >= cooccur
+        isPair &= np.logical_or(dist <= distKnn[start:start+blockSig.shape[0],np.newaxis], dist <= distKnn[np.newaxis,:])
+        isPair &= np.arange(start,start+blockSig.shape[0])[:,np.newaxis] < np.arange(nView)[np.newaxis,:]
+        
+        pairI, pairJ = np.nonzero(isPair)
+        pairs.extend([(viewIDs[i],viewIDs[j]) for i,j in zip((pairI+start).tolist(), pairJ.tolist())])
+        if returnSparse:
+            listPairI.append(pairI+start)
+            listPairJ.append(pairJ)
+            listPairDist.append(dist[pairI,pairJ])
     
     print "finish finding beacon similarity knn view."
+    if returnSparse:
+        pairI = np.concatenate(listPairI) if len(listPairI)>0 else np.zeros(0, dtype=np.int64)
+        pairJ = np.concatenate(listPairJ) if len(listPairJ)>0 else np.zeros(0, dtype=np.int64)
+        pairDist = np.concatenate(listPairDist) if len(listPairDist)>0 else np.zeros(0, dtype=np.float32)
+        knnGraph = scipy.sparse.csr_matrix((pairDist,(pairI,pairJ)), shape=(nView,nView))
+        return pairs, knnGraph, viewIDs
     return pairs
 
-# gen pair based on location in sfm_data (1 nearest neighbor)   
-# also perform cut off if nesrest neighbor is farther than 1.5*distance to nearest neighbor in same video  
-def genNNLocPair(imgBeaconMap,sfm_data):
-    pairs = [] 
+# calculate distance and cooccurence between all rows of blockSig and sig for genBeaconSimKnnPair
+# returns (nBlock,nView) distance and cooccurence, sparse signals are compared with BeaconIndex of sig
+# if it is given, otherwise by calBeaconSimilaritySparse
+# cooccurence of pairs of all zero rows is NaN as dense signals
+def calBeaconSimKnnBlock(blockSig,sig,maxMemory=BEACON_COOCUR_BLOCK_MAX_MEMORY,index=None):
+    if index is not None or scipy.sparse.issparse(sig):
+        if index is not None:
+            pairQ, pairB, pairCoocur, pairDist = index.calSimilarity(blockSig, maxMemory)
+            sumB = index.rssiSum
+        else:
+            pairQ, pairB, pairCoocur, pairDist = calBeaconSimilaritySparse(blockSig, sig, maxMemory)
+            sumB = np.asarray(sig.sum(axis=1)).ravel()
+        dist = np.empty((blockSig.shape[0],sig.shape[0]), dtype=np.float32)
+        dist[:] = 500
+        dist[pairQ,pairB] = pairDist
+        coocur = np.zeros((blockSig.shape[0],sig.shape[0]), dtype=np.float32)
+        coocur[pairQ,pairB] = pairCoocur
+        coocur[np.ix_(np.asarray(blockSig.sum(axis=1)).ravel()==0, sumB==0)] = np.nan
+        return dist, coocur
     
-    # gen map between extrinsic ID to extrinsic index
-    extMap = {}
-    for ext in range(0,len(sfm_data["extrinsics"])):
-        extMap[sfm_data["extrinsics"][ext]["key"]] = ext
+    dist = calBeaconDistanceBlock(blockSig, sig)
+    blockMinMax = np.minimum(blockSig[:,np.newaxis,:], sig[np.newaxis,:,:])
+    sumMin = np.sum(blockMinMax, axis=2)
+    np.maximum(blockSig[:,np.newaxis,:], sig[np.newaxis,:,:], out=blockMinMax)
+    sumMax = np.sum(blockMinMax, axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coocur = sumMin / sumMax
+    return dist, coocur
+
+# ratio of maximum and minimum radius of views queried at once in genNNLocPair
+NN_LOC_RADIUS_GROUP_RATIO = 1.25
+
+# maximum number of views queried at once in genNNLocPair
+NN_LOC_QUERY_BATCH = 4096
+
+# gen pair based on location in sfm_data
+# each view is paired with views in other videos closer than 3 times distance to the nearest view in its video
+# camera centers of all posed views are searched in one KD-tree, views whose radius is similar are queried
+# in batches, and candidates are filtered by exact radius and video
+def genNNLocPair(imgBeaconMap,sfm_data):
+    # gen map between extrinsic ID to camera center
+    centerMap = {}
+    for ext in sfm_data["extrinsics"]:
+        centerMap[ext["key"]] = ext["value"]["center"]
     
-    # in each video
+    # collect posed views in order of videos and frames
+    listVideo = []
+    listViewID = []
+    listCenter = []
     for i in range(0,len(imgBeaconMap)):
-                
-        # look thru the frames
         for viewI in imgBeaconMap[i].keys():
-            
-            # get extrinsic
-            # if it exists, find closest point in its video and other videos    
             extrinsicID = sfm_data["views"][viewI]["value"]["ptr_wrapper"]["data"]["id_pose"]
-            if extrinsicID in extMap.keys():
-                
-                locI = np.array(sfm_data["extrinsics"][extMap[extrinsicID]]["value"]["center"])
-         
-                # find closest distance in video
-                distSelf = sys.float_info.max
-                for viewI2 in imgBeaconMap[i].keys():
-                    
-                    if viewI2 == viewI:
-                        continue
-                    
-                    # read thru other framse
-                    extrinsicID2 = sfm_data["views"][viewI2]["value"]["ptr_wrapper"]["data"]["id_pose"]
-                    if extrinsicID2 in extMap.keys():
-                        
-                        # read location and calculate distance
-                        locI2 = np.array(sfm_data["extrinsics"][extMap[extrinsicID2]]["value"]["center"])
-                        distTmp = np.linalg.norm(locI-locI2)
-                        
-                        if distTmp < distSelf:
-                            distSelf = distTmp
-
-
-                # find closest distance in other videos
-                distMin = sys.float_info.max
-                minID = -1
-                for j in range(0,len(imgBeaconMap)):
-        
-                    # no match in same video
-                    if i == j: 
-                        continue 
-                    
-                    # read thru frames    
-                    for viewJ in imgBeaconMap[j].keys():
-
-                        extrinsicIDJ = sfm_data["views"][viewJ]["value"]["ptr_wrapper"]["data"]["id_pose"]
-                        if extrinsicIDJ in extMap.keys():
-                        
-                            # read location and calculate distance
-                            locJ = np.array(sfm_data["extrinsics"][extMap[extrinsicIDJ]]["value"]["center"])
-                            distTmp = np.linalg.norm(locI-locJ)
-                            
-                            if distTmp < 3*distSelf:
-                                pairs = pairs + [(viewI,viewJ)]
-#                             if distTmp < distMin:
-#                                 minID = viewJ
-#                                 distMin = distTmp
-#                 
-#                 if distMin < 1.5*distSelf:
-#                     pairs = pairs + [(viewI,minID)]
+            if extrinsicID in centerMap:
+                listVideo.append(i)
+                listViewID.append(viewI)
+                listCenter.append(centerMap[extrinsicID])
+    if len(listViewID)==0:
+        return []
+    video = np.array(listVideo, dtype=np.int64)
+    center = np.array(listCenter, dtype=np.float64).reshape(-1,3)
     
-    return pairs
+    # find closest distance in video, infinite if there is no other posed view in video
+    distSelf = np.empty(len(video), dtype=np.float64)
+    distSelf[:] = np.inf
+    for i in np.unique(video):
+        idx = np.nonzero(video==i)[0]
+        if len(idx)>1:
+            distSelf[idx] = cKDTree(center[idx]).query(center[idx], 2)[0][:,1]
+    radius = 3*distSelf
+    
+    # group views by radius, views with infinite radius are paired with all views in other videos
+    kdtree = cKDTree(center)
+    listPairI = []
+    listPairJ = []
+    isFinite = np.isfinite(radius) & (radius>0)
+    group = np.zeros(len(video), dtype=np.int64)
+    group[isFinite] = np.floor(np.log(radius[isFinite]) / np.log(NN_LOC_RADIUS_GROUP_RATIO)).astype(np.int64)
+    for g in np.unique(group[isFinite]):
+        idxGroup = np.nonzero(isFinite & (group==g))[0]
+        rMax = np.max(radius[idxGroup])
+        for start in range(0,len(idxGroup),NN_LOC_QUERY_BATCH):
+            idxBatch = idxGroup[start:start+NN_LOC_QUERY_BATCH]
+            candidates = kdtree.query_ball_point(center[idxBatch], rMax)
+            nCandidate = np.array([len(x) for x in candidates], dtype=np.int64)
+            candI = np.repeat(idxBatch, nCandidate)
+            candJ = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.int64, count=int(np.sum(nCandidate)))
+            dist = np.sqrt(np.sum((center[candI]-center[candJ])**2, axis=1))
+            isPair = (video[candI]!=video[candJ]) & (dist < radius[candI])
+            listPairI.append(candI[isPair])
+            listPairJ.append(candJ[isPair])
+    for i in np.nonzero(np.isinf(radius))[0]:
+        candJ = np.nonzero(video!=video[i])[0]
+        listPairI.append(np.repeat(i, len(candJ)))
+        listPairJ.append(candJ)
+    if len(listPairI)==0:
+        return []
+    
+    # order pairs by views in order of videos and frames
+    pairI = np.concatenate(listPairI)
+    pairJ = np.concatenate(listPairJ)
+    order = np.lexsort((pairJ, pairI))
+    return zip([listViewID[i] for i in pairI[order]], [listViewID[j] for j in pairJ[order]])
 
 # intersect beaconmaps and return list of pair of indices that matches
 # the major,minor pair in each map
@@ -354,11 +909,22 @@ def intersectBeaconmap(beaconmap1,beaconmap2):
 # MININTERSECT is the minimum number of beacon that must be used in both models
 # VALQ and VALB are lists of viewIDs from query and base models whose beacon signals
 # will be intersected. Empty means all will be intersected.
-def findNumImgByBeaconIntersect(beaconfileQuery,beaconfileBase,cooccur,valQ=[],valB=[],minIntersect=3):
+# SPARSE selects sparse rssi matrices and BeaconIndex of base model for large number of beacons and views
+def findNumImgByBeaconIntersect(beaconfileQuery,beaconfileBase,cooccur,valQ=[],valB=[],minIntersect=3,sparse=False):
+    if sparse:
+        # import here to avoid circular import
+        from hulo_ibeacon.BeaconIndex import BeaconIndex
+        return BeaconIndex.load(beaconfileBase).countCoocur(loadBeaconMatrix(beaconfileQuery, sparse), cooccur, 
+                                                           valQ=valQ, valB=valB, minIntersect=minIntersect)
+    return countImgByBeaconIntersect(loadBeaconMatrix(beaconfileQuery, sparse), loadBeaconMatrix(beaconfileBase, sparse),
+                                     cooccur, valQ=valQ, valB=valB, minIntersect=minIntersect)
 
-    # read beacon files
-    imgBeaconListQ, beaconmapQ = readBeaconData(beaconfileQuery)
-    imgBeaconListB, beaconmapB = readBeaconData(beaconfileBase)
+# same as findNumImgByBeaconIntersect, but beacon data of query and base models 
+# are given as returned by loadBeaconMatrix, rssi matrices can be scipy sparse matrices
+def countImgByBeaconIntersect(beaconDataQuery,beaconDataBase,cooccur,valQ=[],valB=[],minIntersect=3):
+    
+    viewIdQ, rssiQ, beaconmapQ = beaconDataQuery
+    viewIdB, rssiB, beaconmapB = beaconDataBase
 
     # get matching indices
     indexMatches = intersectBeaconmap(beaconmapQ,beaconmapB)
@@ -370,15 +936,15 @@ def findNumImgByBeaconIntersect(beaconfileQuery,beaconfileBase,cooccur,valQ=[],v
     indexB = [x[1] for x in indexMatches]
 
     # reduce index to intersected ones and put into matrix
-    sigB = np.zeros((0,len(indexB)),dtype=np.float32)
-    for keyB in imgBeaconListB:
-        if not valB or keyB in valB:
-            sigB = np.vstack((sigB,imgBeaconListB[keyB]["rssi"][indexB]))
+    if len(valB)>0:
+        sigB = rssiB[np.nonzero(np.in1d(viewIdB, valB))[0]][:,indexB]
+    else:
+        sigB = rssiB[:,indexB]
     
-    sigQ = np.zeros((0,len(indexQ)),dtype=np.float32)
-    for keyQ in imgBeaconListQ:
-        if not valQ or keyQ in valQ:
-            sigQ = np.vstack((sigQ,imgBeaconListQ[keyQ]["rssi"][indexQ]))
+    if len(valQ)>0:
+        sigQ = rssiQ[np.nonzero(np.in1d(viewIdQ, valQ))[0]][:,indexQ]
+    else:
+        sigQ = rssiQ[:,indexQ]
 
     # calculate generalized Jaccard similarity
     countIntSig = 0
@@ -390,9 +956,12 @@ def findNumImgByBeaconIntersect(beaconfileQuery,beaconfileBase,cooccur,valQ=[],v
 #                 break
 
     # faster version of generalized Jaccard similarity
-    for i in range(0,sigQ.shape[0]):
-        if np.any(np.sum(np.minimum(sigQ[i,:],sigB),axis=1)/np.sum(np.maximum(sigQ[i,:],sigB),axis=1)>cooccur):
-            countIntSig = countIntSig + 1
+#     for i in range(0,sigQ.shape[0]):
+#         if np.any(np.sum(np.minimum(sigQ[i,:],sigB),axis=1)/np.sum(np.maximum(sigQ[i,:],sigB),axis=1)>cooccur):
+#             countIntSig = countIntSig + 1
+    
+    # fastest version of generalized Jaccard similarity, computed for blocks of query signals
+    countIntSig = calBeaconCoocurBlock(sigQ, sigB, cooccur)[0]
     
     # slowest version of generalized Jaccard similarity
 #     # check cooccurence and count number of intersecting signals
@@ -421,113 +990,184 @@ def findNumImgByBeaconIntersect(beaconfileQuery,beaconfileBase,cooccur,valQ=[],v
 # beaconmap:: (major,minor) -> beacon index in rssi vector 
 # rssi vector of each image
 def exportBeaconData(numView, beaconmap, imgBeaconMap, outfile):
-    f = open(outfile,"w")
-    
-    # write beacon list
-    f.write(str(len(beaconmap)) + "\n")
-    beaconlist = beaconmap.items()
-    beaconlist= sorted(beaconlist, key=lambda x: x[1]) # sort list based on index of rssi vector
-    for i in range(0,len(beaconmap)):
-        f.write(str(beaconlist[i][0][0])+ " " + str(beaconlist[i][0][1]) + "\n") # major and minor
-    
     # write rssi vector
     imgBeaconList = {}
-    #print len(imgBeaconMap)
     for i in range(0,len(imgBeaconMap)):
         imgBeaconList.update(imgBeaconMap[i])
-        #print len(imgBeaconMap[i])
-    #print len(imgBeaconList)
-    f.write(str(numView) + "\n")
-    for i in sorted(imgBeaconList.keys()):
-        f.write(str(i) + " ") # write viewID
-        
-        # write beacon rssi values
-        for j in range(0,len(beaconmap)):    
-            f.write(str(imgBeaconList[i]["rssi"][j]) + " ")
-        
-        f.write("\n")
+    
+    with open(outfile,"w") as f:
+        # write beacon list
+        f.write(str(len(beaconmap)) + "\n")
+        beaconlist = beaconmap.items()
+        beaconlist= sorted(beaconlist, key=lambda x: x[1]) # sort list based on index of rssi vector
+        for i in range(0,len(beaconmap)):
+            f.write(str(beaconlist[i][0][0])+ " " + str(beaconlist[i][0][1]) + "\n") # major and minor
         
-    f.close()
+        # write viewID and beacon rssi values
+        f.write(str(numView) + "\n")
+        for i in sorted(imgBeaconList.keys()):
+            f.write(str(i) + " " + "".join([str(rssi) + " " for rssi in imgBeaconList[i]["rssi"][0:len(beaconmap)]]) + "\n")
+    
+    # write binary beacon file next to text file, values are truncated as they are read from text file
+    viewID = np.array(sorted(imgBeaconList.keys()), dtype=np.int64)
+    rssi = np.zeros((len(viewID),len(beaconmap)), dtype=np.float32)
+    for i in range(0,len(viewID)):
+        rssi[i,:] = np.trunc(np.asarray(imgBeaconList[viewID[i]]["rssi"], dtype=np.float64)[0:len(beaconmap)])
+    writeBeaconBinary(outfile + BEACON_BINARY_SUFFIX, viewID, rssi, beaconmap)
+
+# read ibeacon text file as matrix
+# returns viewID, rssi matrix and beaconmap in the same way as loadBeaconMatrix
+def readBeaconMatrixText(infile):
+    with open(infile,"r") as readfile:
+        lines = readfile.read().splitlines()
+    
+    # map (major,minor) to index
+    nBeacon = int(float(lines[0].strip()))
+    beaconmap = {}
+    for i in range(0,nBeacon):
+        line = lines[1+i].strip().split(" ")
+        beaconmap[(int(float(line[0])),int(float(line[1])))] = i
     
+    # viewID and beacon signals of each line
+    if len(lines) > 1+nBeacon:
+        nBeaconSignal = int(float(lines[1+nBeacon].strip()))
+    else:
+        nBeaconSignal = 0
+    signalLines = lines[2+nBeacon:2+nBeacon+nBeaconSignal]
+    if len(signalLines)==0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0,nBeacon), dtype=np.float32), beaconmap
+    signal = np.fromstring(" ".join(signalLines), dtype=np.float64, sep=" ")
+    signal = np.trunc(signal.reshape(len(signalLines), -1))
+    
+    # later line overwrites earlier line with the same viewID
+    lineViewID = signal[:,0].astype(np.int64)
+    viewID, lastIdx = np.unique(lineViewID[::-1], return_index=True)
+    lastIdx = len(lineViewID) - 1 - lastIdx
+    rssi = signal[lastIdx,1:].astype(np.float32)
+    return viewID, rssi, beaconmap
+
 # read ibeacon data, including
 # beaconmap:: (major,minor) -> beacon index in rssi vector 
 # rssi vector of each image
 def readBeaconData(infile):
+    viewID, rssi, beaconmap = readBeaconMatrixText(infile)
+    imgBeaconList = {}
+    for i in range(0,len(viewID)):
+        imgBeaconList[int(viewID[i])] = {"rssi" : np.array(rssi[i,:])}
+    return imgBeaconList, beaconmap
+
+# binary beacon file is written next to beacon text file with this suffix
+BEACON_BINARY_SUFFIX = ".bin"
+
+# binary beacon file format
+# magic (8 bytes), then little endian int64 version, number of beacons B, number of views N
+# int64 (B,2) major and minor of beacons in order of index in rssi vector
+# int64 (N,) viewID
+# float32 (N,B) rssi vector of each view
+BEACON_BINARY_MAGIC = "HULOBCN\0"
+BEACON_BINARY_VERSION = 1
+_BEACON_BINARY_HEADER_SIZE = len(BEACON_BINARY_MAGIC) + 3*8
+
+# write ibeacon data given as matrix to binary beacon file
+def writeBeaconBinary(outfile, viewID, rssi, beaconmap):
+    beaconKey = np.zeros((len(beaconmap),2), dtype="<i8")
+    for key in beaconmap:
+        beaconKey[beaconmap[key],:] = key
+    
+    outfileTmp = outfile + ".tmp" + str(os.getpid())
+    with open(outfileTmp, "wb") as fp:
+        fp.write(BEACON_BINARY_MAGIC)
+        fp.write(np.array([BEACON_BINARY_VERSION, len(beaconmap), len(viewID)], dtype="<i8").tostring())
+        fp.write(beaconKey.tostring())
+        fp.write(np.asarray(viewID, dtype="<i8").tostring())
+        fp.write(np.asarray(rssi, dtype="<f4").reshape(len(viewID),len(beaconmap)).tostring())
+    os.rename(outfileTmp, outfile)
+
+# read binary beacon file, rssi matrix is memory mapped
+# returns viewID, rssi matrix and beaconmap in the same way as loadBeaconMatrix
+def readBeaconBinary(infile):
+    with open(infile, "rb") as fp:
+        magic = fp.read(len(BEACON_BINARY_MAGIC))
+        if magic != BEACON_BINARY_MAGIC:
+            raise ValueError("invalid binary beacon file : " + infile)
+        version, nBeacon, nView = np.fromstring(fp.read(3*8), dtype="<i8").tolist()
+        if version != BEACON_BINARY_VERSION:
+            raise ValueError("unsupported version " + str(version) + " of binary beacon file : " + infile)
+        beaconKey = np.fromstring(fp.read(nBeacon*2*8), dtype="<i8").reshape(nBeacon,2)
+        viewID = np.fromstring(fp.read(nView*8), dtype="<i8")
+    if len(beaconKey) != nBeacon or len(viewID) != nView:
+        raise ValueError("truncated binary beacon file : " + infile)
     
+    offset = _BEACON_BINARY_HEADER_SIZE + (nBeacon*2+nView)*8
+    if nView*nBeacon > 0:
+        if os.path.getsize(infile) < offset + nView*nBeacon*4:
+            raise ValueError("truncated binary beacon file : " + infile)
+        rssi = np.memmap(infile, dtype="<f4", mode="r", offset=offset, shape=(nView,nBeacon))
+    else:
+        rssi = np.zeros((nView,nBeacon), dtype=np.float32)
+    beaconmap = dict(((int(key[0]),int(key[1])),i) for i,key in enumerate(beaconKey.tolist()))
+    return viewID.astype(np.int64), rssi, beaconmap
+
+# convert beacon text file to binary beacon file
+# binary file is written next to text file if outfile is not given
+def convertBeaconTextToBinary(infile, outfile=None):
+    if outfile is None:
+        outfile = infile + BEACON_BINARY_SUFFIX
+    viewID, rssi, beaconmap = readBeaconMatrixText(infile)
+    writeBeaconBinary(outfile, viewID, rssi, beaconmap)
+    return outfile
+
+# convert binary beacon file to beacon text file
+def convertBeaconBinaryToText(infile, outfile):
+    viewID, rssi, beaconmap = readBeaconBinary(infile)
     imgBeaconList = {}
-    beaconmap = {}
+    for i in range(0,len(viewID)):
+        imgBeaconList[int(viewID[i])] = {"rssi" : np.array(rssi[i,:])}
+    exportBeaconData(len(viewID), beaconmap, [imgBeaconList], outfile)
+    return outfile
+
+# read ibeacon data as matrix, including
+# viewID : (N,) viewID of images
+# rssi : (N,B) rssi vector of each image
+# beaconmap:: (major,minor) -> beacon index in rssi vector 
+# binary beacon file next to beacon text file is memory mapped while it is newer than text file,
+# otherwise text file is parsed and binary beacon file is written
+# if sparse is True, rssi is returned as CSR sparse matrix
+def loadBeaconMatrix(infile, sparse=False):
+    binaryFile = infile + BEACON_BINARY_SUFFIX
+    if os.path.isfile(infile):
+        mtime = os.path.getmtime(infile)
+    else:
+        mtime = os.path.getmtime(binaryFile)
     
-    with open(infile,"r") as readfile:
-        
-        # mode explanation
-        # mode == 0 : number of beacons
-        # mode == 1 : major and minor
-        # mode == 2 : number of beacon signals
-        # mode == 3 : beacon signals        
-        mode = 0
-        
-        for line in readfile:
-            
-            # number of beacon
-            if mode == 0:
-                
-                nBeacon = int(float(line.strip()))
-                countLine = 0
-                
-                mode = 1
-                
-            # map (major,minor) to index
-            elif mode == 1:
-                
-                line = line.strip()
-                line = line.split(" ")
-                
-                # set major,minor pair and the index
-                beaconmap[(int(float(line[0])),int(float(line[1])))] = countLine
-                
-                countLine = countLine + 1
-                
-                if countLine == nBeacon:
-                    mode = 2
-            
-            # number of beacon signal    
-            elif mode == 2:
-                
-                nBeaconSignal = int(float(line.strip()))
-                countLine = 0
-                
-                mode = 3
-                
-            # map viewID to beacon vector    
-            elif mode == 3:
-                
-                line = line.strip()
-                line = line.split(" ")
-                
-                # read viewID
-                viewID = int(float(line[0]))
-                line.pop(0)
-                
-                # put each rssi element in list and assign to imgBeaconList
-                imgBeaconList[viewID] = {}
-                imgBeaconList[viewID]["rssi"] = np.array([int(float(rssi)) for rssi in line],dtype=np.float32)
-                
-                countLine = countLine + 1
-                
-                if countLine == nBeaconSignal:
-                    mode = 4
+    beaconData = None
+    if os.path.isfile(binaryFile) and os.path.getmtime(binaryFile) >= mtime:
+        try:
+            beaconData = readBeaconBinary(binaryFile)
+        except (IOError, ValueError) as e:
+            print "Cannot read binary beacon file " + binaryFile + " : " + str(e)
+            beaconData = None
     
-    return imgBeaconList, beaconmap
+    if beaconData is None:
+        beaconData = readBeaconMatrixText(infile)
+        try:
+            writeBeaconBinary(binaryFile, beaconData[0], beaconData[1], beaconData[2])
+        except (IOError, OSError) as e:
+            print "Cannot write binary beacon file " + binaryFile + " : " + str(e)
+    
+    if sparse:
+        rssi = scipy.sparse.csr_matrix(beaconData[1], dtype=np.float32)
+        rssi.eliminate_zeros()
+        beaconData = (beaconData[0], rssi, beaconData[2])
+    return beaconData
 
-def exportBeaconDataForSfmImageFrames(csvdir, sfm_data_file, beacon_file, output, beaconnorm):    
+def exportBeaconDataForSfmImageFrames(csvdir, sfm_data_file, beacon_file, output, beaconnorm, maxTimeDiff=None, interpolate=False):    
     # parse beacon setting file
     beaconmap = parseBeaconSetting(beacon_file)
     
     # read sfm_data.json and get map between image name and view ID
-    with open(sfm_data_file) as fp:
-        sfm_data = json.load(fp)
-    
-    sfm_data.pop("structure") # removed set of 3D points since too memory heavy
+    # load only views, since set of 3D points is too memory heavy
+    sfm_data = FileUtils.loadjson(sfm_data_file, ["views"])
     numView = len(sfm_data["views"])
     viewIDMap = getImgNameViewIDMap(sfm_data)
     
@@ -541,14 +1181,8 @@ def exportBeaconDataForSfmImageFrames(csvdir, sfm_data_file, beacon_file, output
         else:
             continue  
         
-        # parse CSV file , note that beacon is already normalized
-        beaconTmp, photoTmp = parseCSVfile(infilename,beaconmap,beaconnorm)
-        
-        # remove images not in sfm_data
-        removeImgNotInSfmData(photoTmp,viewIDMap)
-        
-        # associate beacon with each image
-        imgBeaconMap.append(associateBeaconToImg(photoTmp,beaconTmp,viewIDMap))
+        # parse CSV file and associate beacon with each image in sfm_data, note that beacon is already normalized
+        imgBeaconMap.append(associateBeaconToImgCSVfile(infilename,beaconmap,beaconnorm,viewIDMap,maxTimeDiff,interpolate))
     
     # export
     exportBeaconData(numView, beaconmap, imgBeaconMap, output)
\ No newline at end of file
@@ -49,6 +49,13 @@ class ReconstructIBeaconParam:
     # to each other. Must be in range [0,1].
     coocThres = 0.1
     
+    # Number of processes to calculate beacon cooccurence between pairs of models
+    coocProcessNum = 1
+    
+    # Use sparse rssi matrices and beacon index (beacon.txt.index.npz) to calculate beacon cooccurence,
+    # which is faster and uses less memory when each image observes small part of many beacons
+    sparseBeacon = False
+    
     ########################################################################################################
     # sfmMergeGraphIBeacon.mergeOneModel
     
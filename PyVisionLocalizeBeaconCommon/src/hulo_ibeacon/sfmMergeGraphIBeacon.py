@@ -26,14 +26,31 @@ import os
 import json
 import numpy as np
 import scipy.sparse.csgraph
+import multiprocessing
 import hulo_file.FileUtils as FileUtils
+import hulo_file.SfmDataCache as SfmDataCache
 import hulo_ibeacon.IBeaconUtils as IBeaconUtils
+from hulo_ibeacon.BeaconIndex import BeaconIndex
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_ibeacon.ReconstructIBeaconParam as ReconstructIBeaconParam
 import hulo_bow.ReconstructBOWParam as ReconstructBOWParam
 import hulo_sfm.mergeSfM as mergeSfM
+from hulo_file.SfmData import SfmData
+from hulo_file.LocResult import LocResult
 import hulo_sfm.sfmMergeGraph as sfmMergeGraph
 
+# beacon cooccurence tasks calculated by worker processes, set before the pool is forked
+# so that parsed beacon data is not pickled for each task
+_cooccurenceTasks = []
+
+# calculate beacon cooccurence of k-th task in worker process
+# beacon index of base model is used if it is given
+def cooccurenceWorker(k):
+    beaconDataQuery, beaconDataBase, beaconIndexBase, coocThres, valQ = _cooccurenceTasks[k]
+    if beaconIndexBase is not None:
+        return beaconIndexBase.countCoocur(beaconDataQuery, coocThres, valQ=valQ)
+    return IBeaconUtils.countImgByBeaconIntersect(beaconDataQuery, beaconDataBase, coocThres, valQ=valQ)
+
 class sfmModelIBeacon(sfmMergeGraph.sfmModel):
     
     def __init__(self, name, imgFolLoc, csvFolLoc, beaconfileLoc, matchesFolLoc, locFolLoc, sfm_dataLoc, 
@@ -44,11 +61,51 @@ class sfmModelIBeacon(sfmMergeGraph.sfmModel):
                                         ransacStructureThres=ransacStructureThres, ransacStructureThresK=ransacStructureThresK,
                                         mergeStructureThres=mergeStructureThres, mergeStructureThresK=mergeStructureThresK)
         self.beaconFileLoc = beaconfileLoc # file dir of beacon.txt
+        self.beaconData = {} # beacon data loaded from beacon file for each sparse flag, loaded when it is used
+        self.beaconIndex = None # beacon index of beacon file, loaded when it is used
+    
+    # get beacon data of beacon file as IBeaconUtils.loadBeaconMatrix
+    # beacon data is kept in the model while beacon file is not changed, and freed with the model
+    def getBeaconData(self, sparse=False):
+        mtime = os.path.getmtime(self.beaconFileLoc)
+        if getattr(self, "beaconData", None) is None:
+            self.beaconData = {}
+        if bool(sparse) not in self.beaconData or self.beaconData[bool(sparse)][0] != (self.beaconFileLoc, mtime):
+            self.beaconData[bool(sparse)] = ((self.beaconFileLoc, mtime), IBeaconUtils.loadBeaconMatrix(self.beaconFileLoc, sparse))
+        return self.beaconData[bool(sparse)][1]
+    
+    # get beacon index of beacon file, kept in the model in the same way as beacon data
+    def getBeaconIndex(self):
+        mtime = os.path.getmtime(self.beaconFileLoc)
+        if getattr(self, "beaconIndex", None) is None or self.beaconIndex[0] != (self.beaconFileLoc, mtime):
+            self.beaconIndex = ((self.beaconFileLoc, mtime), BeaconIndex.load(self.beaconFileLoc))
+        return self.beaconIndex[1]
+    
+    # write files read when the model is merged, binary beacon file and beacon index are also made
+    def prepareMergeFiles(self):
+        sfmMergeGraph.sfmModel.prepareMergeFiles(self)
+        if os.path.isfile(self.beaconFileLoc):
+            self.getBeaconIndex()
     
     # update information in self with information from newInfo
     def update(self, newInfo):
         sfmMergeGraph.sfmModel.update(self, newInfo)
         self.beaconFileLoc = newInfo.beaconFileLoc
+        self.beaconData = {}
+        self.beaconIndex = None
+    
+    # change paths of output files of this model to sfmOutPath, 
+    # beacon file of merged model is also in output folder
+    def setOutputFolder(self, sfmOutPath):
+        sfmMergeGraph.sfmModel.setOutputFolder(self, sfmOutPath)
+        self.beaconFileLoc = os.path.join(sfmOutPath,"beacon.txt")
+    
+    # beacon data and index are not saved with merge graph
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["beaconData"] = {}
+        state["beaconIndex"] = None
+        return state
     
 class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
     
@@ -123,41 +180,74 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
         
         return True
     
+    # calculate number of images with beacon cooccurence for list of model index pairs
+    # count is calculated for images of smaller model, and beacon files are parsed once for each model
+    # pairs are calculated by nProcess worker processes
+    # if sparse is True, rssi matrices are sparse and images are compared with beacon index of larger model
+    # returns list of number of images, and list of number of reconstructed frames of smaller model
+    def calCooccurence(self,listPair,coocThres,nProcess=1,sparse=False):
+        global _cooccurenceTasks
+        
+        # parse beacon files before worker processes are forked so that workers share parsed data
+        # parsed data is kept in each model until the model is merged to other model
+        beaconData = [x.getBeaconData(sparse) for x in self.sfmModel]
+        if sparse:
+            beaconIndex = [x.getBeaconIndex() for x in self.sfmModel]
+        else:
+            beaconIndex = [None for x in self.sfmModel]
+        
+        _cooccurenceTasks = []
+        listSmallerReconFrame = []
+        for i,j in listPair:
+            # find smaller and larger model
+            if len(self.sfmModel[i].reconFrame) < len(self.sfmModel[j].reconFrame):
+                smaller = i
+                larger = j
+            else: 
+                smaller = j
+                larger = i
+            _cooccurenceTasks.append((beaconData[smaller], beaconData[larger], beaconIndex[larger], coocThres, self.sfmModel[smaller].reconFrame))
+            listSmallerReconFrame.append(len(self.sfmModel[smaller].reconFrame))
+        
+        try:
+            if nProcess<=1 or len(listPair)<=1:
+                listCooc = map(cooccurenceWorker, range(len(listPair)))
+            else:
+                pool = multiprocessing.Pool(nProcess)
+                try:
+                    listCooc = pool.map(cooccurenceWorker, range(len(listPair)))
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _cooccurenceTasks = []
+        
+        return listCooc, listSmallerReconFrame
+    
+    # set beacon cooccurence of model index pairs to matrices
+    def setCooccurence(self,beaconCoocMatRat,beaconCoocMatFrame,listPair,coocThres,nProcess=1,sparse=False):
+        listCooc, listSmallerReconFrame = self.calCooccurence(listPair, coocThres, nProcess, sparse)
+        for (i,j), beaconCooc, nSmallerReconFrame in zip(listPair, listCooc, listSmallerReconFrame):
+            # save value frame
+            beaconCoocMatFrame[i,j] = beaconCooc
+            beaconCoocMatFrame[j,i] = beaconCooc
+            
+            beaconCooc = (beaconCooc+0.0)/nSmallerReconFrame
+            
+            # save values ratio
+            beaconCoocMatRat[i,j] = beaconCooc
+            beaconCoocMatRat[j,i] = beaconCooc
+    
     # calculate beacon cooccurence between all pairs of video
-    def calCooccurenceGraph(self,coocThres=0.5):
+    def calCooccurenceGraph(self,coocThres=0.5,nProcess=1,sparse=False):
         
         print "Calculating beacon cooccurence between videos"
         nModel = len(self.sfmModel)
         beaconCoocMatRat = np.zeros((nModel,nModel),dtype=np.float32)
         beaconCoocMatFrame = np.zeros((nModel,nModel),dtype=np.int16)
         
-        for i in range(0,nModel-1):
-            for j in range(i+1,nModel):
-                
-                # find smaller and larger model
-                if len(self.sfmModel[i].reconFrame) < len(self.sfmModel[j].reconFrame):
-                    smallerModel = self.sfmModel[i]
-                    largerModel = self.sfmModel[j]
-                else: 
-                    smallerModel = self.sfmModel[j]
-                    largerModel = self.sfmModel[i]
-                
-                # calculate beacon cooccurence
-                beaconCooc = IBeaconUtils.findNumImgByBeaconIntersect(
-                    smallerModel.beaconFileLoc,
-                    largerModel.beaconFileLoc,
-                    coocThres, # minimum beacon signal cooccurence
-                    valQ=smallerModel.reconFrame)
-                
-                # save value frame
-                beaconCoocMatFrame[i,j] = beaconCooc
-                beaconCoocMatFrame[j,i] = beaconCooc
-                
-                beaconCooc = (beaconCooc+0.0)/len(smallerModel.reconFrame)
-                
-                # save values ratio
-                beaconCoocMatRat[i,j] = beaconCooc
-                beaconCoocMatRat[j,i] = beaconCooc
+        listPair = [(i,j) for i in range(0,nModel-1) for j in range(i+1,nModel)]
+        self.setCooccurence(beaconCoocMatRat, beaconCoocMatFrame, listPair, coocThres, nProcess, sparse)
         
         print "Complete calculating beacon cooccurrence"
         return beaconCoocMatRat,beaconCoocMatFrame
@@ -165,44 +255,19 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
     # update beacon cooccurrence matrix
     # note that listToUpdate must be list of indices of each model in self.sfmModel
     # and correpondond to order of rows and cols in beaconCoocMatRat and beaconCoocMatFrame
-    def updateCooccurenceGraph(self,beaconCoocMatRat,beaconCoocMatFrame,listToUpdate,coocThres=0.75):
+    def updateCooccurenceGraph(self,beaconCoocMatRat,beaconCoocMatFrame,listToUpdate,coocThres=0.75,nProcess=1,sparse=False):
         
         print "Update beacon cooccurence between videos"
         nModel = len(self.sfmModel)
         
-        listDone = []
+        listPair = []
+        setDone = set()
         for i in listToUpdate:
             for j in range(0,nModel):
-                
-                if [i,j] in listDone or [j,i] in listDone:
-                    continue
-                else:
-                    listDone.append([i,j])
-                
-                # find smaller and larger model
-                if len(self.sfmModel[i].reconFrame) < len(self.sfmModel[j].reconFrame):
-                    smallerModel = self.sfmModel[i]
-                    largerModel = self.sfmModel[j]
-                else: 
-                    smallerModel = self.sfmModel[j]
-                    largerModel = self.sfmModel[i]
-                
-                # calculate beacon cooccurence
-                beaconCooc = IBeaconUtils.findNumImgByBeaconIntersect(
-                    smallerModel.beaconFileLoc,
-                    largerModel.beaconFileLoc,
-                    coocThres, # minimum beacon signal cooccurence
-                    valQ=smallerModel.reconFrame)
-                
-                # save value frame
-                beaconCoocMatFrame[i,j] = beaconCooc
-                beaconCoocMatFrame[j,i] = beaconCooc
-                
-                beaconCooc = (beaconCooc+0.0)/len(smallerModel.reconFrame)
-                
-                # save values ratio
-                beaconCoocMatRat[i,j] = beaconCooc
-                beaconCoocMatRat[j,i] = beaconCooc
+                if (min(i,j),max(i,j)) not in setDone:
+                    setDone.add((min(i,j),max(i,j)))
+                    listPair.append((i,j))
+        self.setCooccurence(beaconCoocMatRat, beaconCoocMatFrame, listPair, coocThres, nProcess, sparse)
         
         print "Update calculating beacon cooccurrence"
         return beaconCoocMatRat,beaconCoocMatFrame
@@ -210,89 +275,33 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
     # merge one sfmModel to other (specifically, model 2 to model 1)
     # all required folder will be created
     # returns whether the merge is success, and merged sfmModel    
-    def mergeOneModel(self, model1, model2, reconParam, reconIBeaconParam, reconBOWParam):
+    # pairSuffix is added to names of output, localization and temporary image folders of this pair
+    def mergeOneModel(self, model1, model2, reconParam, reconIBeaconParam, reconBOWParam, pairSuffix=""):
         
-        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel))
+        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel)+pairSuffix)
         
         # modified by T. IShihara 2016.06.14
         # fix file name too long issue
         # 
         # create a temporary folder for reconstructed image of model2
         #inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmp"+model2.name)        
-        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2")
-        if os.path.isdir(inputImgTmpFolder):
-            FileUtils.removedir(inputImgTmpFolder)
-        
-        # copy reconstructed image fom model2 to tmp folder
-        sfm_data2 = FileUtils.loadjson(model2.sfm_dataLoc)
-        if not os.path.isdir(inputImgTmpFolder):
-            listReconFrameName = [sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["filename"] for x in range(0,len(sfm_data2["views"])) if sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["id_view"] in model2.reconFrame]
-            FileUtils.makedir(inputImgTmpFolder)
-            for reconFrameName in listReconFrameName:
-                os.system("cp -s " + os.path.join(model2.imgFolLoc,reconFrameName) + " " + inputImgTmpFolder)
-        
-        
-        # remove all old localization result
-        FileUtils.removedir(model2.locFolLoc) 
-        FileUtils.makedir(model2.locFolLoc)
-
+        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2"+pairSuffix)
+        
         # localize the images from model2 on model1
-        guideMatchOption = ""
-        if reconParam.bGuidedMatchingLocalize:
-            guideMatchOption = " -gm"
-        if self.useBow:
-            os.system(reconIBeaconParam.LOCALIZE_PROJECT_PATH + \
-                      " " + inputImgTmpFolder + \
-                      " " + os.path.dirname(model1.sfm_dataLoc) + \
-                      " " + self.mMatchesPath + \
-                      " " + model2.locFolLoc + \
-                      " -f=" + str(reconParam.locFeatDistRatio) + \
-                      " -r=" + str(reconParam.locRansacRound) + \
-                      " -b=" + model1.beaconFileLoc + \
-                      " -e=" + model2.csvFolLoc + \
-                      " -k=" + str(reconIBeaconParam.locKNNnum) + \
-                      " -c=" + str(reconIBeaconParam.coocThres) + \
-                      " -i=" + str(reconParam.locSkipFrame) + \
-                      " -v=" + str(reconIBeaconParam.locSkipSelKNN) + \
-                      " -n=" + str(reconIBeaconParam.normApproach) + \
-                      " -kb=" + str(reconBOWParam.locKNNnum) + \
-                      " -a=" + os.path.join(self.mMatchesPath, "BOWfile.yml") + \
-                      " -p=" + os.path.join(self.mMatchesPath, "PCAfile.yml") + \
-                      guideMatchOption)                                  
-        else:
-            os.system(reconIBeaconParam.LOCALIZE_PROJECT_PATH + \
-                      " " + inputImgTmpFolder + \
-                      " " + os.path.dirname(model1.sfm_dataLoc) + \
-                      " " + self.mMatchesPath + \
-                      " " + model2.locFolLoc + \
-                      " -f=" + str(reconParam.locFeatDistRatio) + \
-                      " -r=" + str(reconParam.locRansacRound) + \
-                      " -b=" + model1.beaconFileLoc + \
-                      " -e=" + model2.csvFolLoc + \
-                      " -k=" + str(reconIBeaconParam.locKNNnum) + \
-                      " -c=" + str(reconIBeaconParam.coocThres) + \
-                      " -i=" + str(reconParam.locSkipFrame) + \
-                      " -v=" + str(reconIBeaconParam.locSkipSelKNN) + \
-                      " -n=" + str(reconIBeaconParam.normApproach) + \
-                      guideMatchOption)
+        # in progressive mode, merge is rejected if localization of sample frames is not promising
+        locFolLoc = model2.locFolLoc + pairSuffix
+        if not self.localizeReconFrames(model1, model2, sfmOutPath, locFolLoc, inputImgTmpFolder, reconParam, reconIBeaconParam, reconBOWParam):
+            return False, sfmModelIBeacon("","","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
+                                          ransacStructureThres=0, ransacStructureThresK=0, 
+                                          mergeStructureThres=0, mergeStructureThresK=0)
                   
         # remove temporary image folder
         # removedir(inputImgTmpFolder)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(model2.locFolLoc,"center.txt"),"w")
-        countLocFrame = 0
-        for filename in sorted(os.listdir(model2.locFolLoc)):
-            if filename[-4:]!="json":
-                continue
-            
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(model2.locFolLoc,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )   
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(locFolLoc)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(locFolLoc,"center.txt"))
         
         # get inlier matches
         FileUtils.makedir(sfmOutPath)
@@ -302,13 +311,18 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
         # TODO : revisit ransacRound parameter, use number of reconstruction frame to determine structure points transform seems small
         nMatchPointsTmp, nInlierTmp, M = mergeSfM.mergeModel(model1.sfm_dataLoc,
                             model2.sfm_dataLoc,
-                            model2.locFolLoc,
+                            locFolLoc,
                             resultSfMDataFile,
                             ransacThres=model1.ransacStructureThres,
                             mergePointThres=model1.mergeStructureThres,
                             ransacRoundMul=reconParam.ransacRoundMul,
                             inputImgDir=self.mInputImgPath,
-                            minLimit=reconParam.min3DnInliers)
+                            minLimit=reconParam.min3DnInliers,
+                            ransacMethod=reconParam.ransacMethod,
+                            ransacConfidence=reconParam.ransacConfidence,
+                            ransacProsac=reconParam.ransacProsac,
+                            ransacProcessNum=reconParam.ransacProcessNum,
+                            ransacSeed=reconParam.ransacSeed)
         
         ratioInlierMatchPoints = 0.0
         if nMatchPointsTmp>0:
@@ -320,7 +334,7 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
         countFileLoc = 1
         if os.path.isfile(resultSfMDataFile):
             os.system(reconParam.BUNDLE_ADJUSTMENT_PROJECT_PATH + " " + resultSfMDataFile + " " + resultSfMDataFile)
-            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, model2.locFolLoc, model1.validMergeRansacThres)
+            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, locFolLoc, model1.validMergeRansacThres)
         else:
             sfm_merge_generated = False
         
@@ -332,7 +346,7 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
             ratioAgreeFrameLocFrame = float(countFileAgree)/countFileLoc
         
         # write log file
-        with open(os.path.join(self.mSfMPath,"global"+str(self.nMergedModel),"log.txt"),"a") as filelog:
+        with open(os.path.join(sfmOutPath,"log.txt"),"a") as filelog:
             filelog.write(("M1: " + model1.name + "\n" + \
                           "M2: " + model2.name + "\n" + \
                           "nMatchedPoints: " + str(nMatchPointsTmp) + "\n" + \
@@ -412,6 +426,8 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
             if os.path.isfile(os.path.join(sfmOutPath,"sfm_data.json")):
                 os.rename(os.path.join(sfmOutPath,"sfm_data.json"), \
                           os.path.join(sfmOutPath,"sfm_data_fail_merge.json"))
+                # remove cache of sfm_data.json so that it is not used for other sfm_data.json in this folder
+                SfmDataCache.removeCache(os.path.join(sfmOutPath,"sfm_data.json"))
             
             # move to next video
             return False, sfmModelIBeacon("","","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
@@ -450,6 +466,47 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
                                      ransacStructureThres=model1.ransacStructureThres, 
                                      mergeStructureThres=model1.mergeStructureThres)
     
+    # localize images in inputImgTmpFolder on model1, and write results to locFolLoc
+    def localizeFrames(self, model1, model2, inputImgTmpFolder, locFolLoc, reconParam, reconIBeaconParam, reconBOWParam):
+        guideMatchOption = ""
+        if reconParam.bGuidedMatchingLocalize:
+            guideMatchOption = " -gm"
+        if self.useBow:
+            os.system(reconIBeaconParam.LOCALIZE_PROJECT_PATH + \
+                      " " + inputImgTmpFolder + \
+                      " " + os.path.dirname(model1.sfm_dataLoc) + \
+                      " " + self.mMatchesPath + \
+                      " " + locFolLoc + \
+                      " -f=" + str(reconParam.locFeatDistRatio) + \
+                      " -r=" + str(reconParam.locRansacRound) + \
+                      " -b=" + model1.beaconFileLoc + \
+                      " -e=" + model2.csvFolLoc + \
+                      " -k=" + str(reconIBeaconParam.locKNNnum) + \
+                      " -c=" + str(reconIBeaconParam.coocThres) + \
+                      " -i=" + str(reconParam.locSkipFrame) + \
+                      " -v=" + str(reconIBeaconParam.locSkipSelKNN) + \
+                      " -n=" + str(reconIBeaconParam.normApproach) + \
+                      " -kb=" + str(reconBOWParam.locKNNnum) + \
+                      " -a=" + os.path.join(self.mMatchesPath, "BOWfile.yml") + \
+                      " -p=" + os.path.join(self.mMatchesPath, "PCAfile.yml") + \
+                      guideMatchOption)                                  
+        else:
+            os.system(reconIBeaconParam.LOCALIZE_PROJECT_PATH + \
+                      " " + inputImgTmpFolder + \
+                      " " + os.path.dirname(model1.sfm_dataLoc) + \
+                      " " + self.mMatchesPath + \
+                      " " + locFolLoc + \
+                      " -f=" + str(reconParam.locFeatDistRatio) + \
+                      " -r=" + str(reconParam.locRansacRound) + \
+                      " -b=" + model1.beaconFileLoc + \
+                      " -e=" + model2.csvFolLoc + \
+                      " -k=" + str(reconIBeaconParam.locKNNnum) + \
+                      " -c=" + str(reconIBeaconParam.coocThres) + \
+                      " -i=" + str(reconParam.locSkipFrame) + \
+                      " -v=" + str(reconIBeaconParam.locSkipSelKNN) + \
+                      " -n=" + str(reconIBeaconParam.normApproach) + \
+                      guideMatchOption)
+    
     # perform merging model
     # Input
     # listbeacon : path to a listbeacon.txt file
@@ -489,6 +546,30 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
         os.system("cp --remove-destination " + listbeacon + " " + self.mInputPath)
         os.system("cp --remove-destination " + image_descFile + " " + self.mMatchesPath)
          
+        # merge disjoint pairs of models at once in each round
+        if reconParam.mergeStrategy=="tree":
+            beaconCoocRat, beaconCoocFrame = self.calCooccurenceGraph(coocThres=reconIBeaconParam.coocThres, nProcess=reconIBeaconParam.coocProcessNum,
+                                                                      sparse=reconIBeaconParam.sparseBeacon)
+            while True:
+                print "graph edges : " + str(beaconCoocRat)
+                print "SfM model names : " + str([x.name for x in self.sfmModel])
+                connectionGraph = np.logical_or(beaconCoocRat > mergeCoocThresRat,beaconCoocFrame > mergeCoocThresFrame)
+                
+                mergePairs = self.selectMergePairs(connectionGraph)
+                if len(mergePairs)==0:
+                    print "No more mergable pairs. Exiting."
+                    return
+                
+                mergedIdx, listUpdate = self.mergeRound(mergePairs, (reconParam, reconIBeaconParam, reconBOWParam,), reconParam.mergeProcessNum)
+                
+                # update beacon
+                beaconCoocRat = sfmMergeGraph.mergeGraphMatrix(beaconCoocRat, mergedIdx)
+                beaconCoocFrame = sfmMergeGraph.mergeGraphMatrix(beaconCoocFrame, mergedIdx)
+                if len(listUpdate)>0:
+                    beaconCoocRat, beaconCoocFrame = self.updateCooccurenceGraph(beaconCoocRat, beaconCoocFrame, listUpdate, coocThres=reconIBeaconParam.coocThres,
+                                                                                 nProcess=reconIBeaconParam.coocProcessNum,
+                                                                                 sparse=reconIBeaconParam.sparseBeacon)
+        
         listLead = range(0,len(self.sfmModel)) # list of model indexes which can initiate merge (list of model indexes which did not fail merge yet)
         listBye = [] # list of model indexes which will not be used to initiate merge (list of model indexes which already failed merge)
         baseVideo = -1
@@ -507,7 +588,8 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
             if mergeCandidatesRemainsForBaseVideo:
                 # calculate cooccurence graph
                 if not calBeaconSim:
-                    beaconCoocRat, beaconCoocFrame = self.calCooccurenceGraph(coocThres=reconIBeaconParam.coocThres)
+                    beaconCoocRat, beaconCoocFrame = self.calCooccurenceGraph(coocThres=reconIBeaconParam.coocThres, nProcess=reconIBeaconParam.coocProcessNum,
+                                                                              sparse=reconIBeaconParam.sparseBeacon)
                     calBeaconSim = True
                     
                 print "graph edges : " + str(beaconCoocRat)
@@ -556,6 +638,8 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
             print "Based model: " + mergedModel.name
             print "To merge with: " + str([x.name for x in mergeCandidateModel])
             mergeCandidatesRemainsForBaseVideo = False            
+            # list pairs to attempt merge
+            mergePairs = []
             for video in mergeCandidateModel:
                 
                 # check if failed localization has been performed on this pair before
@@ -564,15 +648,14 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
                     continue
                 
                 # swap order so small model is merged to larger model
-                swap = False
                 if len(mergedModel.reconFrame) < len(video.reconFrame):
-                    tmp = mergedModel
-                    mergedModel = video
-                    video = tmp
-                    swap = True
-                
-                # attempt merge
-                mergeResult, mergedModelTmp = self.mergeOneModel(mergedModel,video,reconParam,reconIBeaconParam,reconBOWParam)
+                    mergePairs.append((video,mergedModel))
+                else:
+                    mergePairs.append((mergedModel,video))
+            
+            # attempt merge, pairs are evaluated at once if reconParam.mergeProcessNum is larger than 1
+            for mergedModel, video, mergeResult, mergedModelTmp in self.mergeCandidates(mergePairs, 
+                    (reconParam, reconIBeaconParam, reconBOWParam,), reconParam.mergeProcessNum):
                 
                 if mergeResult:
                     mergedModel.update(mergedModelTmp)
@@ -584,7 +667,9 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
                     beaconCoocRat = np.delete(beaconCoocRat,videoIdx,1)
                     beaconCoocFrame = np.delete(beaconCoocFrame,videoIdx,0)
                     beaconCoocFrame = np.delete(beaconCoocFrame,videoIdx,1)
-                    beaconCoocRat, beaconCoocFrame = self.updateCooccurenceGraph(beaconCoocRat, beaconCoocFrame, [self.sfmModel.index(mergedModel)], coocThres=reconIBeaconParam.coocThres)
+                    beaconCoocRat, beaconCoocFrame = self.updateCooccurenceGraph(beaconCoocRat, beaconCoocFrame, [self.sfmModel.index(mergedModel)], coocThres=reconIBeaconParam.coocThres,
+                                                                                 nProcess=reconIBeaconParam.coocProcessNum,
+                                                                                 sparse=reconIBeaconParam.sparseBeacon)
                     
                     self.nMergedModel = self.nMergedModel+1
                     self.save(os.path.join(self.mSfMPath,"global" + str(self.nMergedModel-1),"mergeGraph.txt"))
@@ -606,7 +691,3 @@ class sfmGraphIBeacon(sfmMergeGraph.sfmGraph):
                 
                     # save
                     self.save(os.path.join(self.mSfMPath,"mergeGraph.txt"))
-                
-                    if swap:
-                        # swap back if not merged
-                        mergedModel = video
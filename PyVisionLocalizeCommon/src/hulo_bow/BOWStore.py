@@ -0,0 +1,165 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+################################################################################
+# Packed BOW vector store
+#
+# TrainBoW writes BOW vector of each image to one .bow file in matches folder.
+# All .bow files in a matches folder are packed to one (N,dim) matrix (bow_store.npy)
+# with index of image names (bow_store_index.npz), and the matrix is memory-mapped 
+# when it is loaded, so that callers read BOW vectors of all images without opening
+# each .bow file. The index also has name and modified time of the newest .bow file when 
+# the store is built. The store is valid while the list of .bow files in the folder is not 
+# changed and the newest .bow file is not modified, so that the store is rebuilt when TrainBoW 
+# is run again in the same folder without accessing .bow files one by one.
+################################################################################
+
+import os
+import numpy as np
+import hulo_file.FileUtils as FileUtils
+
+# name of packed BOW matrix and index of image names in matches folder
+BOW_STORE_FILENAME = "bow_store.npy"
+BOW_STORE_INDEX_FILENAME = "bow_store_index.npz"
+
+# get list of .bow files in matches folder
+def listBowFile(matchesFolder):
+    return sorted([filename for filename in os.listdir(matchesFolder) if filename[-4:]==".bow"])
+
+# BOW vectors of images in a matches folder
+#
+# names : (N,) list of image name without extension
+# vectors : (N,dim) BOW vectors, memory-mapped if the store is loaded from file
+# newestBowFile, newestBowMtime : name and modified time of the newest .bow file when the store is built
+class BOWStore:
+    
+    def __init__(self, names, vectors, newestBowFile="", newestBowMtime=0.0):
+        self.names = names
+        self.vectors = vectors
+        self.index = dict((name,i) for i,name in enumerate(names))
+        self.newestBowFile = newestBowFile
+        self.newestBowMtime = newestBowMtime
+    
+    # get number of images
+    def getImageCount(self):
+        return len(self.names)
+    
+    # check if BOW vector of image name exists
+    def hasVector(self, name):
+        return name in self.index
+    
+    # get (dim,) BOW vector of image name
+    def getVector(self, name):
+        return np.asarray(self.vectors[self.index[name]])
+    
+    # get (len(names),dim) BOW vectors of image names
+    def getVectors(self, names):
+        rows = np.array([self.index[name] for name in names], dtype=np.int64)
+        return np.asarray(self.vectors[rows])
+    
+    # check if the store is made from current .bow files in matches folder
+    # only list of .bow files and modified time of the newest .bow file are checked
+    def isUpToDate(self, matchesFolder):
+        if self.names != [os.path.splitext(filename)[0] for filename in listBowFile(matchesFolder)]:
+            return False
+        if len(self.names)==0:
+            return True
+        newestBowFile = os.path.join(matchesFolder, self.newestBowFile)
+        return os.path.isfile(newestBowFile) and os.path.getmtime(newestBowFile)==self.newestBowMtime
+    
+    # save as store in matches folder
+    def save(self, matchesFolder):
+        for filename, save in [(BOW_STORE_FILENAME, lambda fp: np.save(fp, np.asarray(self.vectors))), 
+                               (BOW_STORE_INDEX_FILENAME, lambda fp: np.savez(fp, names=np.array(self.names, dtype=np.str_), 
+                                                                              newestBowFile=np.array(self.newestBowFile, dtype=np.str_),
+                                                                              newestBowMtime=np.float64(self.newestBowMtime)))]:
+            filename = os.path.join(matchesFolder, filename)
+            filenameTmp = filename + ".tmp" + str(os.getpid())
+            with open(filenameTmp, "wb") as fp:
+                save(fp)
+            if os.path.isfile(filename):
+                os.remove(filename)
+            os.rename(filenameTmp, filename)
+    
+    # pack all .bow files in matches folder, and save as store
+    # the saved store is memory-mapped and returned
+    @staticmethod
+    def build(matchesFolder):
+        bowFiles = listBowFile(matchesFolder)
+        if len(bowFiles)==0:
+            return BOWStore([], np.zeros((0,0), dtype=np.float32))
+        
+        # modified time is read before .bow files so that .bow file modified while building is detected
+        bowMtime = [os.path.getmtime(os.path.join(matchesFolder, filename)) for filename in bowFiles]
+        newest = int(np.argmax(bowMtime))
+        vectors = np.vstack([FileUtils.loadBinMat(os.path.join(matchesFolder, filename)).ravel() for filename in bowFiles])
+        data = BOWStore([os.path.splitext(filename)[0] for filename in bowFiles], vectors, bowFiles[newest], bowMtime[newest])
+        try:
+            data.save(matchesFolder)
+        except (IOError, OSError) as e:
+            print "Cannot write BOW store of " + matchesFolder + " : " + str(e)
+            return data
+        return BOWStore.loadFile(matchesFolder)
+    
+    # load store in matches folder, BOW matrix is memory-mapped
+    @staticmethod
+    def loadFile(matchesFolder):
+        with np.load(os.path.join(matchesFolder, BOW_STORE_INDEX_FILENAME)) as npz:
+            names = npz["names"].tolist()
+            newestBowFile = str(npz["newestBowFile"])
+            newestBowMtime = float(npz["newestBowMtime"])
+        vectors = np.load(os.path.join(matchesFolder, BOW_STORE_FILENAME), mmap_mode="r")
+        if vectors.ndim!=2 or vectors.shape[0]!=len(names):
+            raise ValueError("Invalid BOW store in " + matchesFolder)
+        return BOWStore(names, vectors, newestBowFile, newestBowMtime)
+    
+    # check if store in matches folder exists and is made from current .bow files
+    @staticmethod
+    def isValid(matchesFolder):
+        if not os.path.isfile(os.path.join(matchesFolder, BOW_STORE_INDEX_FILENAME)):
+            return False
+        try:
+            return BOWStore.loadFile(matchesFolder).isUpToDate(matchesFolder)
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+    
+    # load BOW vectors of matches folder
+    # store is used if it is made from current .bow files, otherwise it is made from .bow files
+    @staticmethod
+    def load(matchesFolder):
+        if os.path.isfile(os.path.join(matchesFolder, BOW_STORE_INDEX_FILENAME)):
+            try:
+                data = BOWStore.loadFile(matchesFolder)
+                if data.isUpToDate(matchesFolder):
+                    return data
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        return BOWStore.build(matchesFolder)
+
+# build stores of all matches folders under root folder, which TrainBoW writes .bow files
+def buildFolders(rootFolder):
+    for dirpath, dirnames, filenames in os.walk(rootFolder, followlinks=True):
+        if os.path.basename(dirpath)=="matches" and any(filename[-4:]==".bow" for filename in filenames):
+            print "Build BOW store of " + dirpath
+            BOWStore.build(dirpath)
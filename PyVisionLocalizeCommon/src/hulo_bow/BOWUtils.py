@@ -23,21 +23,50 @@
 # -*- coding: utf-8 -*-
 
 import os
-import hulo_file.FileUtils as FileUtils
+import numpy as np
+from hulo_file.SfmData import SfmData
+from hulo_bow.BOWStore import BOWStore, BOW_STORE_FILENAME
+
+# file name of average BOW vector cached in the folder of sfm_data.json
+AVERAGE_BOW_FILENAME = "avgBow.npz"
+
+# calculate average BOW vector for all views associated with sfm_data
+# returns average BOW vector and number of views
+def calculateAverageBOWWithCount(sfmDataFile, matchesFolLoc):
+    viewImages = SfmData.load(sfmDataFile, ["views"]).getViewFilenames()
+    
+    if len(viewImages)==0:
+        return None, 0
+    
+    # BOW vectors of all views are read from memory-mapped store
+    bowStore = BOWStore.load(matchesFolLoc)
+    bows = bowStore.getVectors([os.path.splitext(viewImage)[0] for viewImage in viewImages])
+    return np.mean(bows, axis=0, dtype=np.float64).reshape(1,-1), len(viewImages)
 
 # calculate average BOW vector for all views associated with sfm_data
 def calculateAverageBOW(sfmDataFile, matchesFolLoc):
-    sfmData = FileUtils.loadjson(sfmDataFile)
-                
-    avgBow = None
-    for view in sfmData["views"]:
-        viewImage = view["value"]["ptr_wrapper"]["data"]["filename"]
-        viewBow = os.path.join(matchesFolLoc, os.path.splitext(viewImage)[0] + ".bow")
-        bowvec = FileUtils.loadBinMat(viewBow)
-        if avgBow is None:
-            avgBow = bowvec
-        else:
-            avgBow += bowvec
-        avgBow /= len(sfmData["views"])
+    return calculateAverageBOWWithCount(sfmDataFile, matchesFolLoc)[0]
+
+# load average BOW vector and number of views cached for sfm_data
+# cache is used only if it is newer than sfm_data and BOW store made from current .bow files,
+# otherwise average is calculated and cached
+def loadAverageBOW(sfmDataFile, matchesFolLoc):
+    cacheFile = os.path.join(os.path.dirname(sfmDataFile), AVERAGE_BOW_FILENAME)
+    if os.path.isfile(cacheFile) and os.path.getmtime(cacheFile) >= os.path.getmtime(sfmDataFile) and \
+        BOWStore.isValid(matchesFolLoc) and \
+        os.path.getmtime(cacheFile) >= os.path.getmtime(os.path.join(matchesFolLoc, BOW_STORE_FILENAME)):
+        cache = np.load(cacheFile)
+        return cache["avgBow"], int(cache["nView"])
     
-    return avgBow
\ No newline at end of file
+    avgBow, nView = calculateAverageBOWWithCount(sfmDataFile, matchesFolLoc)
+    if avgBow is not None:
+        saveAverageBOW(sfmDataFile, avgBow, nView)
+    return avgBow, nView
+
+# save average BOW vector and number of views as cache for sfm_data
+def saveAverageBOW(sfmDataFile, avgBow, nView):
+    np.savez(os.path.join(os.path.dirname(sfmDataFile), AVERAGE_BOW_FILENAME), avgBow=avgBow, nView=nView)
+
+# average BOW vector of merged views from average BOW vectors of two view sets
+def mergeAverageBOW(avgBow1, nView1, avgBow2, nView2):
+    return (avgBow1 * nView1 + avgBow2 * nView2) / (nView1 + nView2), nView1 + nView2
@@ -26,11 +26,15 @@ import os
 import json
 import numpy as np
 import scipy.sparse.csgraph
+import scipy.spatial.distance
 import hulo_file.FileUtils as FileUtils
+import hulo_file.SfmDataCache as SfmDataCache
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_bow.ReconstructBOWParam as ReconstructBOWParam
 import hulo_bow.BOWUtils as BOWUtils
 import hulo_sfm.mergeSfM as mergeSfM
+from hulo_file.SfmData import SfmData
+from hulo_file.LocResult import LocResult
 import hulo_sfm.sfmMergeGraph as sfmMergeGraph
 
 class sfmModelBOW(sfmMergeGraph.sfmModel):
@@ -42,6 +46,33 @@ class sfmModelBOW(sfmMergeGraph.sfmModel):
                                         validMergeRansacThres=validMergeRansacThres, validMergeRansacThresK=validMergeRansacThresK,
                                         ransacStructureThres=ransacStructureThres, ransacStructureThresK=ransacStructureThresK,
                                         mergeStructureThres=mergeStructureThres, mergeStructureThresK=mergeStructureThresK)        
+        self.avgBow = None # average BOW vector of views, loaded when it is used
+        self.nBowView = 0 # number of views used for average BOW vector
+    
+    # get average BOW vector of views, calculated once and cached in the folder of sfm_data.json
+    def getAverageBOW(self):
+        if getattr(self, "avgBow", None) is None:
+            self.avgBow, self.nBowView = BOWUtils.loadAverageBOW(self.sfm_dataLoc, self.matchesFolLoc)
+        return self.avgBow
+    
+    # set average BOW vector of merged model from average BOW vectors of merged models
+    def setMergedAverageBOW(self, model1, model2):
+        model1.getAverageBOW()
+        model2.getAverageBOW()
+        self.avgBow, self.nBowView = BOWUtils.mergeAverageBOW(model1.avgBow, model1.nBowView, 
+                                                              model2.avgBow, model2.nBowView)
+        BOWUtils.saveAverageBOW(self.sfm_dataLoc, self.avgBow, self.nBowView)
+    
+    # write files read when the model is merged, average BOW vector is also made
+    def prepareMergeFiles(self):
+        sfmMergeGraph.sfmModel.prepareMergeFiles(self)
+        self.getAverageBOW()
+    
+    # update information in self with information from newInfo
+    def update(self, newInfo):
+        sfmMergeGraph.sfmModel.update(self, newInfo)
+        self.avgBow = getattr(newInfo, "avgBow", None)
+        self.nBowView = getattr(newInfo, "nBowView", 0)
 
 class sfmGraphBOW(sfmMergeGraph.sfmGraph):
     
@@ -119,84 +150,60 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
         nModel = len(self.sfmModel)
         graphEdges = np.zeros((nModel,nModel),dtype=np.float32)
         
-        for i in range(0,nModel-1):
-            for j in range(i+1,nModel):
-                sfmModel1 = self.sfmModel[i]
-                sfmModel2 = self.sfmModel[j]
-                
-                avgBow1 = BOWUtils.calculateAverageBOW(sfmModel1.sfm_dataLoc, sfmModel1.matchesFolLoc)
-                avgBow2 = BOWUtils.calculateAverageBOW(sfmModel2.sfm_dataLoc, sfmModel2.matchesFolLoc)                                
-                avgBowSim = np.linalg.norm(avgBow1-avgBow2)
-                
-                graphEdges[i,j] = avgBowSim
-                graphEdges[j,i] = avgBowSim
+        if nModel > 1:
+            avgBows = np.vstack([x.getAverageBOW().ravel() for x in self.sfmModel])
+            graphEdges[:,:] = scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(avgBows))
         
         print "Complete calculating graph edges between videos"
         return graphEdges
+    
+    # update graph edges of models from current average BOW vectors
+    # note that listToUpdate must be list of indices of each model in self.sfmModel
+    # and correpondond to order of rows and cols in graphEdges
+    def updateGraph(self, graphEdges, listToUpdate):
+        
+        if len(listToUpdate)==0 or len(self.sfmModel) < 2:
+            return graphEdges
+        
+        print "Update graph edges between videos"
+        avgBows = np.vstack([x.getAverageBOW().ravel() for x in self.sfmModel])
+        distUpdate = scipy.spatial.distance.cdist(avgBows[listToUpdate], avgBows)
+        graphEdges[listToUpdate,:] = distUpdate
+        graphEdges[:,listToUpdate] = distUpdate.T
+        
+        print "Complete updating graph edges between videos"
+        return graphEdges
         
     # merge one sfmModel to other (specifically, model 2 to model 1)
     # all required folder will be created
     # returns whether the merge is success, and merged sfmModel    
-    def mergeOneModel(self, model1, model2, reconParam, reconBOWParam):
+    # pairSuffix is added to names of output, localization and temporary image folders of this pair
+    def mergeOneModel(self, model1, model2, reconParam, reconBOWParam, pairSuffix=""):
         
-        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel))
+        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel)+pairSuffix)
         
         # modified by T. IShihara 2016.06.14
         # fix file name too long issue
         # 
         # create a temporary folder for reconstructed image of model2
         #inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmp"+model2.name)        
-        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2")
-        if os.path.isdir(inputImgTmpFolder):
-            FileUtils.removedir(inputImgTmpFolder)
-        
-        # copy reconstructed image fom model2 to tmp folder
-        sfm_data2 = FileUtils.loadjson(model2.sfm_dataLoc)
-        if not os.path.isdir(inputImgTmpFolder):
-            listReconFrameName = [sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["filename"] for x in range(0,len(sfm_data2["views"])) if sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["id_view"] in model2.reconFrame]
-            FileUtils.makedir(inputImgTmpFolder)
-            for reconFrameName in listReconFrameName:
-                os.system("cp -s " + os.path.join(model2.imgFolLoc,reconFrameName) + " " + inputImgTmpFolder)
-        
-        
-        # remove all old localization result
-        FileUtils.removedir(model2.locFolLoc) 
-        FileUtils.makedir(model2.locFolLoc)
-
+        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2"+pairSuffix)
+        
         # localize the images from model2 on model1
-        guideMatchOption = ""
-        if reconParam.bGuidedMatchingLocalize:
-            guideMatchOption = " -gm"
-        os.system(reconParam.LOCALIZE_PROJECT_PATH + \
-                  " " + inputImgTmpFolder + \
-                  " " + os.path.dirname(model1.sfm_dataLoc) + \
-                  " " + self.mMatchesPath + \
-                  " " + model2.locFolLoc + \
-                  " -f=" + str(reconParam.locFeatDistRatio) + \
-                  " -r=" + str(reconParam.locRansacRound) + \
-                  " -i=" + str(reconParam.locSkipFrame) + \
-                  " -k=" + str(reconBOWParam.locKNNnum) + \
-                  " -a=" + os.path.join(self.mMatchesPath, "BOWfile.yml") + \
-                  " -p=" + os.path.join(self.mMatchesPath, "PCAfile.yml") + \
-                  guideMatchOption)
+        # in progressive mode, merge is rejected if localization of sample frames is not promising
+        locFolLoc = model2.locFolLoc + pairSuffix
+        if not self.localizeReconFrames(model1, model2, sfmOutPath, locFolLoc, inputImgTmpFolder, reconParam, reconBOWParam):
+            return False, sfmModelBOW("","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
+                                      ransacStructureThres=0, ransacStructureThresK=0, 
+                                      mergeStructureThres=0, mergeStructureThresK=0)
                   
         # remove temporary image folder
         # removedir(inputImgTmpFolder)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(model2.locFolLoc,"center.txt"),"w")
-        countLocFrame = 0
-        for filename in sorted(os.listdir(model2.locFolLoc)):
-            if filename[-4:]!="json":
-                continue
-            
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(model2.locFolLoc,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )   
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(locFolLoc)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(locFolLoc,"center.txt"))
         
         # get inlier matches
         FileUtils.makedir(sfmOutPath)
@@ -206,13 +213,18 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
         # TODO : revisit ransacRound parameter, use number of reconstruction frame to determine structure points transform seems small
         nMatchPointsTmp, nInlierTmp, M = mergeSfM.mergeModel(model1.sfm_dataLoc,
                             model2.sfm_dataLoc,
-                            model2.locFolLoc,
+                            locFolLoc,
                             resultSfMDataFile,
                             ransacThres=model1.ransacStructureThres,
                             mergePointThres=model1.mergeStructureThres,
                             ransacRoundMul=reconParam.ransacRoundMul,
                             inputImgDir=self.mInputImgPath,
-                            minLimit=reconParam.min3DnInliers)
+                            minLimit=reconParam.min3DnInliers,
+                            ransacMethod=reconParam.ransacMethod,
+                            ransacConfidence=reconParam.ransacConfidence,
+                            ransacProsac=reconParam.ransacProsac,
+                            ransacProcessNum=reconParam.ransacProcessNum,
+                            ransacSeed=reconParam.ransacSeed)
         
         ratioInlierMatchPoints = 0.0
         if nMatchPointsTmp>0:
@@ -224,7 +236,7 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
         countFileLoc = 1
         if os.path.isfile(resultSfMDataFile):
             os.system(reconParam.BUNDLE_ADJUSTMENT_PROJECT_PATH + " " + resultSfMDataFile + " " + resultSfMDataFile)
-            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, model2.locFolLoc, model1.validMergeRansacThres)
+            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, locFolLoc, model1.validMergeRansacThres)
         else:
             sfm_merge_generated = False
         
@@ -236,7 +248,7 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
             ratioAgreeFrameLocFrame = float(countFileAgree)/countFileLoc
         
         # write log file
-        with open(os.path.join(self.mSfMPath,"global"+str(self.nMergedModel),"log.txt"),"a") as filelog:
+        with open(os.path.join(sfmOutPath,"log.txt"),"a") as filelog:
             filelog.write(("M1: " + model1.name + "\n" + \
                           "M2: " + model2.name + "\n" + \
                           "nMatchedPoints: " + str(nMatchPointsTmp) + "\n" + \
@@ -316,6 +328,8 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
             if os.path.isfile(os.path.join(sfmOutPath,"sfm_data.json")):
                 os.rename(os.path.join(sfmOutPath,"sfm_data.json"), \
                           os.path.join(sfmOutPath,"sfm_data_fail_merge.json"))
+                # remove cache of sfm_data.json so that it is not used for other sfm_data.json in this folder
+                SfmDataCache.removeCache(os.path.join(sfmOutPath,"sfm_data.json"))
             
             # move to next video
             return False, sfmModelBOW("","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
@@ -344,11 +358,34 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
             " -i " + os.path.join(sfmOutPath,"sfm_data.json") +
             " -o " + os.path.join(sfmOutPath,"colorized.ply"))
         
-        return True, sfmModelBOW("A" + model1.name + "," + model2.name +"Z", self.mInputImgPath, self.mCsvPath, 
-                                 self.mMatchesPath, os.path.join(sfmOutPath,"loc"), resultSfMDataFile, 
-                                 validMergeRansacThres=model1.validMergeRansacThres,
-                                 ransacStructureThres=model1.ransacStructureThres, 
-                                 mergeStructureThres=model1.mergeStructureThres)
+        mergedModel = sfmModelBOW("A" + model1.name + "," + model2.name +"Z", self.mInputImgPath, self.mCsvPath, 
+                                  self.mMatchesPath, os.path.join(sfmOutPath,"loc"), resultSfMDataFile, 
+                                  validMergeRansacThres=model1.validMergeRansacThres,
+                                  ransacStructureThres=model1.ransacStructureThres, 
+                                  mergeStructureThres=model1.mergeStructureThres)
+        
+        # merged model has views of both models, so average BOW vector is updated from both models
+        mergedModel.setMergedAverageBOW(model1, model2)
+        
+        return True, mergedModel
+    
+    # localize images in inputImgTmpFolder on model1, and write results to locFolLoc
+    def localizeFrames(self, model1, model2, inputImgTmpFolder, locFolLoc, reconParam, reconBOWParam):
+        guideMatchOption = ""
+        if reconParam.bGuidedMatchingLocalize:
+            guideMatchOption = " -gm"
+        os.system(reconParam.LOCALIZE_PROJECT_PATH + \
+                  " " + inputImgTmpFolder + \
+                  " " + os.path.dirname(model1.sfm_dataLoc) + \
+                  " " + self.mMatchesPath + \
+                  " " + locFolLoc + \
+                  " -f=" + str(reconParam.locFeatDistRatio) + \
+                  " -r=" + str(reconParam.locRansacRound) + \
+                  " -i=" + str(reconParam.locSkipFrame) + \
+                  " -k=" + str(reconBOWParam.locKNNnum) + \
+                  " -a=" + os.path.join(self.mMatchesPath, "BOWfile.yml") + \
+                  " -p=" + os.path.join(self.mMatchesPath, "PCAfile.yml") + \
+                  guideMatchOption)
     
     # perform merging model
     # Input
@@ -371,6 +408,22 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
         # copy image_describer.txt
         os.system("cp --remove-destination " + image_descFile + " " + self.mMatchesPath)
          
+        # merge disjoint pairs of models at once in each round
+        if reconParam.mergeStrategy=="tree":
+            graphEdges = self.calcGraph()
+            while True:
+                print "graph edges : " + str(graphEdges)
+                print "SfM model names : " + str([x.name for x in self.sfmModel])
+                
+                mergePairs = self.selectMergePairs(graphEdges > 0.0)
+                if len(mergePairs)==0:
+                    print "No more mergable pairs. Exiting."
+                    return
+                
+                mergedIdx, listUpdate = self.mergeRound(mergePairs, (reconParam, reconBOWParam,), reconParam.mergeProcessNum)
+                graphEdges = sfmMergeGraph.mergeGraphMatrix(graphEdges, mergedIdx)
+                graphEdges = self.updateGraph(graphEdges, listUpdate)
+        
         listLead = range(0,len(self.sfmModel)) # list of model indexes which can initiate merge (list of model indexes which did not fail merge yet)
         listBye = [] # list of model indexes which will not be used to initiate merge (list of model indexes which already failed merge)
         baseVideo = -1
@@ -438,6 +491,8 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
             print "Based model: " + mergedModel.name
             print "To merge with: " + str([x.name for x in mergeCandidateModel])
             mergeCandidatesRemainsForBaseVideo = False            
+            # list pairs to attempt merge
+            mergePairs = []
             for video in mergeCandidateModel:
                 
                 # check if failed localization has been performed on this pair before
@@ -446,15 +501,14 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
                     continue
                 
                 # swap order so small model is merged to larger model
-                swap = False
                 if len(mergedModel.reconFrame) < len(video.reconFrame):
-                    tmp = mergedModel
-                    mergedModel = video
-                    video = tmp
-                    swap = True
-                
-                # attempt merge
-                mergeResult, mergedModelTmp = self.mergeOneModel(mergedModel,video,reconParam,reconBOWParam)
+                    mergePairs.append((video,mergedModel))
+                else:
+                    mergePairs.append((mergedModel,video))
+            
+            # attempt merge, pairs are evaluated at once if reconParam.mergeProcessNum is larger than 1
+            for mergedModel, video, mergeResult, mergedModelTmp in self.mergeCandidates(mergePairs, 
+                    (reconParam, reconBOWParam,), reconParam.mergeProcessNum):
                 
                 if mergeResult:
                     mergedModel.update(mergedModelTmp)
@@ -464,6 +518,7 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
                     # update graph
                     graphEdges = np.delete(graphEdges,videoIdx,0)
                     graphEdges = np.delete(graphEdges,videoIdx,1)
+                    graphEdges = self.updateGraph(graphEdges, [self.sfmModel.index(mergedModel)])
                                         
                     self.nMergedModel = self.nMergedModel+1
                     self.save(os.path.join(self.mSfMPath,"global" + str(self.nMergedModel-1),"mergeGraph.txt"))
@@ -485,7 +540,3 @@ class sfmGraphBOW(sfmMergeGraph.sfmGraph):
                 
                     # save
                     self.save(os.path.join(self.mSfMPath,"mergeGraph.txt"))
-                
-                    if swap:
-                        # swap back if not merged
-                        mergedModel = video
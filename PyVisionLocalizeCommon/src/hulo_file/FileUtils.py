@@ -26,6 +26,7 @@ import shutil
 import json
 import numpy as np
 import struct
+import re
 
 def makedir(s):
     if not os.path.isdir(s):
@@ -35,10 +36,168 @@ def removedir(s):
     if os.path.isdir(s):
         shutil.rmtree(s)
 
+# size of chunk read at once when json file is loaded by sections
+JSON_READ_CHUNK_SIZE = 1 << 22
+
+# incremental reader of top level json object
+# value of each top level key can be decoded or skipped without decoding,
+# skipped values are scanned chunk by chunk by finding brackets outside strings
+class jsonSectionReader:
+    
+    def __init__(self, filejson, chunkSize=JSON_READ_CHUNK_SIZE):
+        self.filejson = filejson
+        self.chunkSize = chunkSize
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+    
+    # read next chunk and drop part of buffer already read
+    # return False if end of file is reached
+    def fill(self):
+        if self.eof:
+            return False
+        data = self.filejson.read(self.chunkSize)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+    
+    # return next character which is not white space, or empty string at end of file
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos = self.pos + 1
+            if self.pos < len(self.buf) or not self.fill():
+                break
+        return self.buf[self.pos:self.pos+1]
+    
+    # read next character which should be one of chars
+    def expect(self, chars):
+        c = self.peek()
+        if c == "" or c not in chars:
+            raise ValueError("Expected one of '" + chars + "' but found '" + c + "' in json file")
+        self.pos = self.pos + 1
+        return c
+    
+    # decode string, number, true, false or null
+    def readScalar(self):
+        self.peek()
+        isString = self.buf[self.pos] == '"'
+        while True:
+            # make sure number or literal is not cut at the end of buffer
+            if isString or self.eof or re.search(r'[,\]\}\s]', self.buf[self.pos:]):
+                try:
+                    value, end = self.decoder.raw_decode(self.buf, self.pos)
+                    self.pos = end
+                    return value
+                except ValueError:
+                    if self.eof:
+                        raise
+            self.fill()
+    
+    # read array or object
+    # if collect is True, return the json text of the value, otherwise skip it and return None
+    def readContainer(self, collect):
+        self.peek()
+        pieces = []
+        depth = 0
+        inString = False
+        escapeFirst = False
+        while True:
+            end, depth, inString, escapeFirst = findContainerEnd(self.buf, self.pos, depth, inString, escapeFirst)
+            if end >= 0:
+                if collect:
+                    pieces.append(self.buf[self.pos:end+1])
+                self.pos = end + 1
+                break
+            if collect:
+                pieces.append(self.buf[self.pos:])
+            self.pos = len(self.buf)
+            if not self.fill():
+                raise ValueError("Unexpected end of json file")
+        if collect:
+            return "".join(pieces)
+        return None
+    
+    # read value of top level key, decoded if collect is True
+    def readValue(self, collect):
+        if self.peek() in "[{":
+            text = self.readContainer(collect)
+            if collect:
+                return json.loads(text)
+            return None
+        return self.readScalar()
+
+# find index of bracket closing array or object in buf[pos:]
+# depth, inString and escapeFirst are state of scanning carried from previous buffer
+# return -1 as index if the end is not found in the buffer
+def findContainerEnd(buf, pos, depth, inString, escapeFirst):
+    chars = np.frombuffer(buf, dtype=np.uint8, offset=pos)
+    
+    # find quotes which are not escaped
+    quotes = np.flatnonzero(chars == ord('"'))
+    backslashes = np.flatnonzero(chars == ord('\\'))
+    escaped = set()
+    if escapeFirst:
+        escaped.add(0)
+    for i in backslashes.tolist():
+        if i not in escaped:
+            escaped.add(i+1)
+    escapeLast = len(chars) in escaped
+    if len(escaped) > 0:
+        quotes = np.asarray([q for q in quotes.tolist() if q not in escaped], dtype=np.int64)
+    
+    # find brackets which are not in strings
+    isOpen = (chars == ord('[')) | (chars == ord('{'))
+    brackets = np.flatnonzero(isOpen | (chars == ord(']')) | (chars == ord('}')))
+    if inString:
+        outString = (np.searchsorted(quotes, brackets) % 2) == 1
+    else:
+        outString = (np.searchsorted(quotes, brackets) % 2) == 0
+    brackets = brackets[outString]
+    
+    # find first bracket where depth goes back to 0
+    bracketDepth = depth + np.cumsum(np.where(isOpen[brackets], 1, -1))
+    closed = np.flatnonzero(bracketDepth == 0)
+    if len(closed) > 0:
+        return pos + brackets[closed[0]], 0, False, False
+    
+    if len(bracketDepth) > 0:
+        depth = int(bracketDepth[-1])
+    inString = inString != (len(quotes) % 2 == 1)
+    return -1, depth, inString, escapeLast
+
 # load json file
-def loadjson(filename):
-    with open(filename) as filejson:
-        jsondata = json.load(filejson)
+# if list of top level keys is specified as sections, only values of those keys are decoded,
+# and other values are skipped without decoding to save memory and time
+def loadjson(filename, sections=None):
+    if sections is None:
+        with open(filename) as filejson:
+            jsondata = json.load(filejson)
+        return jsondata
+    
+    jsondata = {}
+    with open(filename, "rb") as filejson:
+        reader = jsonSectionReader(filejson)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return jsondata
+        while True:
+            key = reader.readScalar()
+            reader.expect(":")
+            if key in sections:
+                jsondata[key] = reader.readValue(True)
+            else:
+                reader.readValue(False)
+            
+            # stop reading if all sections are found
+            if all([section in jsondata for section in sections]):
+                break
+            if reader.expect(",}") == "}":
+                break
     return jsondata
  
 # save json file
@@ -0,0 +1,210 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+################################################################################
+# Consolidated localization result
+#
+# Localization writes one json file for each query image to a loc folder. 
+# All json files in a loc folder are converted to one file (loc_result.npz) which has
+# arrays of pose of all images, and 2D-3D match pairs of all images packed in one 
+# array with offset of each image, so that callers read one file instead of all json files.
+# The consolidated file is valid while the list, modified time and size of json files in 
+# the folder are not changed, so that it is made again if localization is run again in the same folder.
+################################################################################
+
+import os
+import zipfile
+import numpy as np
+import hulo_file.FileUtils as FileUtils
+
+# name of consolidated localization result in loc folder
+LOC_RESULT_FILENAME = "loc_result.npz"
+
+# get list of localization json files in loc folder
+def listLocJson(locFolder):
+    return sorted([filename for filename in os.listdir(locFolder) if filename[-4:]=="json"])
+
+# get (N,) modified time and (N,) size of json files in loc folder
+def getJsonFileStat(locFolder, jsonFiles):
+    stats = [os.stat(os.path.join(locFolder, filename)) for filename in jsonFiles]
+    return np.array([stat.st_mtime for stat in stats], dtype=np.float64), \
+        np.array([stat.st_size for stat in stats], dtype=np.int64)
+
+# Localization results of images in a loc folder
+#
+# filename : (N,) list of query image filename
+# sfmData, matchesDir : (N,) list of sfm_data and matches dir used for localization
+# isLocalized : (N,) True if image is localized
+# K, R : (N,3,3) intrinsic and rotation, NaN if image is not localized
+# t : (N,3) camera location, NaN if image is not localized
+# pairOffset : (N+1,) match pairs of i-th image are in range pairOffset[i]:pairOffset[i+1]
+# pair : (P,2) match pair of 2D feature ID of query image and 3D point ID
+class LocResult:
+    
+    def __init__(self):
+        self.filename = []
+        self.sfmData = []
+        self.matchesDir = []
+        self.isLocalized = np.zeros(0, dtype=np.bool)
+        self.K = np.zeros((0,3,3), dtype=np.float64)
+        self.R = np.zeros((0,3,3), dtype=np.float64)
+        self.t = np.zeros((0,3), dtype=np.float64)
+        self.pairOffset = np.zeros(1, dtype=np.int64)
+        self.pair = np.zeros((0,2), dtype=np.int64)
+        self.jsonFiles = [] # json files used to make this result
+        self.jsonMtime = np.zeros(0, dtype=np.float64) # modified time of json files
+        self.jsonSize = np.zeros(0, dtype=np.int64) # size of json files
+    
+    # convert list of json objects of localization result
+    @staticmethod
+    def fromJsonList(jsonList):
+        data = LocResult()
+        data.filename = [jsonLoc["filename"] for jsonLoc in jsonList]
+        data.sfmData = [jsonLoc.get("sfm_data", "") for jsonLoc in jsonList]
+        data.matchesDir = [jsonLoc.get("matches_dir", "") for jsonLoc in jsonList]
+        data.isLocalized = np.array(["t" in jsonLoc for jsonLoc in jsonList], dtype=np.bool)
+        
+        nImage = len(jsonList)
+        data.K = np.empty((nImage,3,3), dtype=np.float64)
+        data.R = np.empty((nImage,3,3), dtype=np.float64)
+        data.t = np.empty((nImage,3), dtype=np.float64)
+        for array in [data.K, data.R, data.t]:
+            array.fill(float("nan"))
+        localized = [jsonLoc for jsonLoc in jsonList if "t" in jsonLoc]
+        if len(localized) > 0:
+            data.K[data.isLocalized] = np.array([jsonLoc["K"] for jsonLoc in localized], dtype=np.float64).reshape(-1,3,3)
+            data.R[data.isLocalized] = np.array([jsonLoc["R"] for jsonLoc in localized], dtype=np.float64).reshape(-1,3,3)
+            data.t[data.isLocalized] = np.array([jsonLoc["t"] for jsonLoc in localized], dtype=np.float64).reshape(-1,3)
+        
+        nPair = np.array([len(jsonLoc.get("pair", [])) for jsonLoc in jsonList], dtype=np.int64)
+        data.pairOffset = np.concatenate(([0], np.cumsum(nPair))).astype(np.int64)
+        data.pair = np.array([pair[0:2] for jsonLoc in jsonList for pair in jsonLoc.get("pair", [])], dtype=np.int64).reshape(-1,2)
+        
+        return data
+    
+    # convert i-th result to json object, same as json file written by localization
+    def toJson(self, i):
+        jsonLoc = {"filename" : self.filename[i], "sfm_data" : self.sfmData[i], "matches_dir" : self.matchesDir[i]}
+        if self.isLocalized[i]:
+            jsonLoc["K"] = self.K[i].tolist()
+            jsonLoc["R"] = self.R[i].tolist()
+            jsonLoc["t"] = self.t[i].tolist()
+            jsonLoc["pair"] = self.getPairs(i).tolist()
+        return jsonLoc
+    
+    # get number of images
+    def getImageCount(self):
+        return len(self.filename)
+    
+    # get index of localized images
+    def getLocalizedIndex(self):
+        return np.flatnonzero(self.isLocalized)
+    
+    # get list of image name (basename of filename) of each image
+    def getImageNames(self):
+        return [os.path.basename(filename) for filename in self.filename]
+    
+    # get match pairs of i-th image as P x 2 array
+    def getPairs(self, i):
+        return self.pair[self.pairOffset[i]:self.pairOffset[i+1]]
+    
+    # write camera location of localized images to center.txt
+    def saveCenterTxt(self, filename):
+        with open(filename, "w") as fileLoc:
+            for loc in self.t[self.isLocalized].tolist():
+                fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )
+    
+    # save as consolidated file
+    def save(self, filename):
+        # strings are saved as utf-8 so that file can be loaded without pickle
+        def encode(strings):
+            return np.array([s.encode("utf-8") if isinstance(s, unicode) else s for s in strings], dtype=np.str_)
+        
+        filenameTmp = filename + ".tmp" + str(os.getpid())
+        with open(filenameTmp, "wb") as fp:
+            np.savez(fp, filename=encode(self.filename), sfmData=encode(self.sfmData), matchesDir=encode(self.matchesDir),
+                     isLocalized=self.isLocalized, K=self.K, R=self.R, t=self.t, 
+                     pairOffset=self.pairOffset, pair=self.pair, jsonFiles=encode(self.jsonFiles),
+                     jsonMtime=self.jsonMtime, jsonSize=self.jsonSize)
+        if os.path.isfile(filename):
+            os.remove(filename)
+        os.rename(filenameTmp, filename)
+    
+    # load consolidated file
+    @staticmethod
+    def loadFile(filename):
+        data = LocResult()
+        with np.load(filename) as npz:
+            data.filename = [s.decode("utf-8") for s in npz["filename"].tolist()]
+            data.sfmData = [s.decode("utf-8") for s in npz["sfmData"].tolist()]
+            data.matchesDir = [s.decode("utf-8") for s in npz["matchesDir"].tolist()]
+            data.jsonFiles = [s.decode("utf-8") for s in npz["jsonFiles"].tolist()]
+            data.jsonMtime = npz["jsonMtime"]
+            data.jsonSize = npz["jsonSize"]
+            data.isLocalized = npz["isLocalized"]
+            data.K = npz["K"].reshape(-1,3,3)
+            data.R = npz["R"].reshape(-1,3,3)
+            data.t = npz["t"].reshape(-1,3)
+            data.pairOffset = npz["pairOffset"]
+            data.pair = npz["pair"].reshape(-1,2)
+        return data
+    
+    # load localization result of loc folder
+    # consolidated file is used if json files are not changed, otherwise it is made from json files
+    @staticmethod
+    def load(locFolder):
+        resultFile = os.path.join(locFolder, LOC_RESULT_FILENAME)
+        if os.path.isfile(resultFile):
+            try:
+                data = LocResult.loadFile(resultFile)
+                jsonFiles = listLocJson(locFolder)
+                if data.jsonFiles == jsonFiles:
+                    jsonMtime, jsonSize = getJsonFileStat(locFolder, jsonFiles)
+                    if np.array_equal(data.jsonMtime, jsonMtime) and np.array_equal(data.jsonSize, jsonSize):
+                        return data
+            except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+                pass
+        return LocResult.convertFolder(locFolder)
+    
+    # read all localization json files in loc folder and save as consolidated file
+    # json files which are not localization result (e.g. loc_global.json) are skipped
+    @staticmethod
+    def convertFolder(locFolder):
+        jsonFiles = listLocJson(locFolder)
+        jsonMtime, jsonSize = getJsonFileStat(locFolder, jsonFiles)
+        jsonList = []
+        for filename in jsonFiles:
+            jsonLoc = FileUtils.loadjson(os.path.join(locFolder, filename))
+            if isinstance(jsonLoc, dict) and "filename" in jsonLoc:
+                jsonList.append(jsonLoc)
+        
+        data = LocResult.fromJsonList(jsonList)
+        data.jsonFiles = jsonFiles
+        data.jsonMtime = jsonMtime
+        data.jsonSize = jsonSize
+        try:
+            data.save(os.path.join(locFolder, LOC_RESULT_FILENAME))
+        except (IOError, OSError) as e:
+            print "Cannot write consolidated localization result of " + locFolder + " : " + str(e)
+        return data
@@ -24,11 +24,11 @@
 import os
 import json
 import numpy as np
+import hulo_file.FileUtils as FileUtils
 
 def saveStructurePly(inSfmFile, outPlyFile):
-    with open(os.path.join(inSfmFile)) as filejson:
-        data = json.load(filejson)
-        data['extrinsics'] = []
+    data = FileUtils.loadjson(inSfmFile, ["sfm_data_version","root_path","views","intrinsics","structure","control_points"])
+    data['extrinsics'] = []
     with open(os.path.join(os.path.dirname(outPlyFile),"tmp.json"),"w") as filejson:
         json.dump(data, filejson)
     
@@ -36,9 +36,8 @@ def saveStructurePly(inSfmFile, outPlyFile):
     os.remove(os.path.join(os.path.dirname(outPlyFile),"tmp.json"));
 
 def saveCameraPly(inSfmFile, outPlyFile):
-    with open(os.path.join(inSfmFile)) as filejson:
-        data = json.load(filejson)
-        data['structure'] = []
+    data = FileUtils.loadjson(inSfmFile, ["sfm_data_version","root_path","views","intrinsics","extrinsics","control_points"])
+    data['structure'] = []
     with open(os.path.join(os.path.dirname(outPlyFile),"tmp.json"),"w") as filejson:
         json.dump(data, filejson)
     
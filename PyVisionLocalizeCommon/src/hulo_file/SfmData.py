@@ -0,0 +1,257 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+import hashlib
+import numpy as np
+import hulo_file.FileUtils as FileUtils
+import hulo_file.SfmDataCache as SfmDataCache
+import hulo_transform.TransformUtils as TransformUtils
+
+# find index of each value of query in keys, -1 is returned if the value is not found
+# if keys has duplicated values, index of the last one is returned (same as filling dictionary)
+# order is result of np.argsort(keys, kind="mergesort"), pass it if it is already calculated
+def findKeyIndex(keys, query, order=None):
+    keys = np.asarray(keys)
+    query = np.asarray(query, dtype=keys.dtype)
+    index = np.empty(query.shape, dtype=np.int64)
+    index.fill(-1)
+    if len(keys)==0 or query.size==0:
+        return index
+    
+    if order is None:
+        order = np.argsort(keys, kind="mergesort")
+    sortedKeys = keys[order]
+    
+    pos = np.searchsorted(sortedKeys, query, side="right") - 1
+    found = pos >= 0
+    found[found] = sortedKeys[pos[found]] == query[found]
+    index[found] = order[pos[found]]
+    return index
+
+# Column oriented representation of OpenMVG sfm_data.json
+#
+# views, intrinsics and other small items are kept as json objects, while extrinsics
+# and structure are kept in numpy arrays so that all cameras or all 3D points can be
+# processed at once.
+#
+# viewId, viewPoseId, viewIntrinsicId : (V,) IDs of each view, written back to views when saved
+# extrinsicKey : (E,) pose ID of each extrinsic
+# extrinsicCenter : (E,3) camera center of each extrinsic
+# extrinsicRotation : (E,3,3) rotation of each extrinsic
+# structureKey : (P,) ID of each 3D point
+# structureX : (P,3) location of each 3D point
+# obsOffset : (P+1,) observations of i-th 3D point are in range obsOffset[i]:obsOffset[i+1]
+# obsViewId, obsFeatId : (K,) view ID and feature ID of each observation
+# obsX : (K,2) 2D location of each observation
+#
+# note that arrays should be replaced instead of modified in place,
+# because ID to index maps are cached for each array
+class SfmData:
+    
+    def __init__(self):
+        self.header = {} # top level items except views, extrinsics and structure
+        self.views = [] # list of view json objects
+        self.viewId = np.zeros(0, dtype=np.int64)
+        self.viewPoseId = np.zeros(0, dtype=np.int64)
+        self.viewIntrinsicId = np.zeros(0, dtype=np.int64)
+        self.extrinsicKey = np.zeros(0, dtype=np.int64)
+        self.extrinsicCenter = np.zeros((0,3), dtype=np.float64)
+        self.extrinsicRotation = np.zeros((0,3,3), dtype=np.float64)
+        self.structureKey = np.zeros(0, dtype=np.int64)
+        self.structureX = np.zeros((0,3), dtype=np.float64)
+        self.obsOffset = np.zeros(1, dtype=np.int64)
+        self.obsViewId = np.zeros(0, dtype=np.int64)
+        self.obsFeatId = np.zeros(0, dtype=np.int64)
+        self.obsX = np.zeros((0,2), dtype=np.float64)
+        self._keyOrderCache = {}
+        self._resultCache = {}
+    
+    # convert json object loaded from sfm_data.json
+    @staticmethod
+    def fromJson(sfm_data):
+        data = SfmData()
+        data.header = dict([(key, sfm_data[key]) for key in sfm_data if key not in ("views","extrinsics","structure")])
+        
+        # views
+        data.views = sfm_data.get("views", [])
+        viewData = [view["value"]["ptr_wrapper"]["data"] for view in data.views]
+        data.viewId = np.array([x["id_view"] for x in viewData], dtype=np.int64)
+        data.viewPoseId = np.array([x["id_pose"] for x in viewData], dtype=np.int64)
+        data.viewIntrinsicId = np.array([x["id_intrinsic"] for x in viewData], dtype=np.int64)
+        
+        # extrinsics
+        extrinsics = sfm_data.get("extrinsics", [])
+        data.extrinsicKey = np.array([x["key"] for x in extrinsics], dtype=np.int64)
+        data.extrinsicCenter = np.array([x["value"]["center"] for x in extrinsics], dtype=np.float64).reshape(-1,3)
+        data.extrinsicRotation = np.array([x["value"]["rotation"] for x in extrinsics], dtype=np.float64).reshape(-1,3,3)
+        
+        # structure
+        structure = sfm_data.get("structure", [])
+        data.structureKey = np.array([x["key"] for x in structure], dtype=np.int64)
+        data.structureX = np.array([x["value"]["X"] for x in structure], dtype=np.float64).reshape(-1,3)
+        
+        nObs = np.array([len(x["value"]["observations"]) for x in structure], dtype=np.int64)
+        data.obsOffset = np.concatenate(([0], np.cumsum(nObs))).astype(np.int64)
+        observations = [obs for x in structure for obs in x["value"]["observations"]]
+        data.obsViewId = np.array([obs["key"] for obs in observations], dtype=np.int64)
+        data.obsFeatId = np.array([obs["value"]["id_feat"] for obs in observations], dtype=np.int64)
+        data.obsX = np.array([obs["value"]["x"] for obs in observations], dtype=np.float64).reshape(-1,2)
+        
+        return data
+    
+    # convert to json object which can be saved as sfm_data.json
+    def toJson(self):
+        sfm_data = dict(self.header)
+        
+        # write back IDs to views
+        for view, viewId, poseId, intrinsicId in zip(self.views, self.viewId.tolist(), 
+                                                     self.viewPoseId.tolist(), self.viewIntrinsicId.tolist()):
+            view["key"] = viewId
+            view["value"]["ptr_wrapper"]["data"]["id_view"] = viewId
+            view["value"]["ptr_wrapper"]["data"]["id_pose"] = poseId
+            view["value"]["ptr_wrapper"]["data"]["id_intrinsic"] = intrinsicId
+        sfm_data["views"] = self.views
+        
+        sfm_data["extrinsics"] = [{"key" : key, "value" : {"rotation" : rotation, "center" : center}} 
+                                  for key, rotation, center in zip(self.extrinsicKey.tolist(), 
+                                                                   self.extrinsicRotation.tolist(), 
+                                                                   self.extrinsicCenter.tolist())]
+        
+        observations = [{"key" : viewId, "value" : {"id_feat" : featId, "x" : x}} 
+                        for viewId, featId, x in zip(self.obsViewId.tolist(), self.obsFeatId.tolist(), self.obsX.tolist())]
+        offset = self.obsOffset.tolist()
+        sfm_data["structure"] = [{"key" : key, "value" : {"X" : X, "observations" : observations[offset[i]:offset[i+1]]}} 
+                                 for i, (key, X) in enumerate(zip(self.structureKey.tolist(), self.structureX.tolist()))]
+        
+        return sfm_data
+    
+    # load sfm_data.json
+    # if list of top level keys is specified as sections, other sections are not loaded
+    # (SfmData loaded by sections is only for reading, it should not be saved)
+    # if valid binary cache exists, all sections are loaded from the cache by memory map
+    @staticmethod
+    def load(filename, sections=None):
+        data = SfmDataCache.loadCache(filename)
+        if data is not None:
+            return data
+        
+        data = SfmData.fromJson(FileUtils.loadjson(filename, sections))
+        if sections is None:
+            SfmDataCache.saveCache(data, filename)
+        return data
+    
+    # save sfm_data.json, binary cache is updated as well
+    def save(self, filename):
+        FileUtils.savejson(self.toJson(), filename)
+        SfmDataCache.saveCache(self, filename)
+    
+    # get cached order of key array to find index from ID
+    # sorting is skipped if keys are already in ascending order
+    def _getKeyOrder(self, name):
+        keys = getattr(self, name)
+        if name not in self._keyOrderCache or self._keyOrderCache[name][0] is not keys:
+            if np.all(keys[1:] >= keys[:-1]):
+                order = np.arange(len(keys), dtype=np.int64)
+            else:
+                order = np.argsort(keys, kind="mergesort")
+            self._keyOrderCache[name] = (keys, order)
+        return self._keyOrderCache[name][1]
+    
+    # get result of func calculated from arrays of names, result is cached by key with content hash 
+    # of the arrays, and calculated again only if content of the arrays is changed
+    def getCachedResult(self, key, names, func):
+        md5 = hashlib.md5()
+        for name in names:
+            md5.update(np.ascontiguousarray(getattr(self, name)).data)
+        contentHash = md5.hexdigest()
+        if key not in self._resultCache or self._resultCache[key][0] != contentHash:
+            self._resultCache[key] = (contentHash, func(*[getattr(self, name) for name in names]))
+        return self._resultCache[key][1]
+    
+    # get order of 3D point IDs, same as np.argsort(structureKey, kind="mergesort")
+    def getStructureKeyOrder(self):
+        return self._getKeyOrder("structureKey")
+    
+    # set order of 3D point IDs when it is known, to avoid sorting 3D point IDs again
+    def setStructureKeyOrder(self, order):
+        self._keyOrderCache["structureKey"] = (self.structureKey, order)
+    
+    # get index of views from view IDs, -1 for view ID which does not exist
+    def getViewIndex(self, viewIds):
+        return findKeyIndex(self.viewId, viewIds, self._getKeyOrder("viewId"))
+    
+    # get index of extrinsics from pose IDs, -1 for pose ID which does not exist
+    def getExtrinsicIndex(self, poseIds):
+        return findKeyIndex(self.extrinsicKey, poseIds, self._getKeyOrder("extrinsicKey"))
+    
+    # get index of 3D points from 3D point IDs, -1 for ID which does not exist
+    def getStructureIndex(self, keys):
+        return findKeyIndex(self.structureKey, keys, self._getKeyOrder("structureKey"))
+    
+    # get list of filename of each view
+    def getViewFilenames(self):
+        return [view["value"]["ptr_wrapper"]["data"]["filename"] for view in self.views]
+    
+    # get mask of views which have extrinsics
+    def getPosedViewMask(self):
+        return np.in1d(self.viewPoseId, self.extrinsicKey)
+    
+    # get number of observations of each 3D point
+    def getObservationCount(self):
+        return np.diff(self.obsOffset)
+    
+    # get index of 3D point for each observation
+    def getObservationPointIndex(self):
+        return np.repeat(np.arange(len(self.structureKey), dtype=np.int64), self.getObservationCount())
+    
+    # transform coordinate with 3x4 matrix M
+    def transform(self, M):
+        self.extrinsicRotation = TransformUtils.transformSfmRotations(M, self.extrinsicRotation)
+        self.extrinsicCenter = TransformUtils.transformPoints(M, self.extrinsicCenter)
+        self.structureX = TransformUtils.transformPoints(M, self.structureX)
+    
+    # keep only extrinsics selected by index or boolean mask
+    def selectExtrinsics(self, select):
+        self.extrinsicKey = self.extrinsicKey[select]
+        self.extrinsicCenter = self.extrinsicCenter[select]
+        self.extrinsicRotation = self.extrinsicRotation[select]
+    
+    # keep only observations selected by boolean mask
+    def selectObservations(self, mask):
+        count = np.bincount(self.getObservationPointIndex()[mask], minlength=len(self.structureKey))
+        self.obsOffset = np.concatenate(([0], np.cumsum(count))).astype(np.int64)
+        self.obsViewId = self.obsViewId[mask]
+        self.obsFeatId = self.obsFeatId[mask]
+        self.obsX = self.obsX[mask]
+    
+    # keep only 3D points selected by boolean mask, observations are removed together
+    def selectStructure(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        obsMask = np.repeat(mask, self.getObservationCount())
+        self.structureKey = self.structureKey[mask]
+        self.structureX = self.structureX[mask]
+        count = self.getObservationCount()[mask]
+        self.obsOffset = np.concatenate(([0], np.cumsum(count))).astype(np.int64)
+        self.obsViewId = self.obsViewId[obsMask]
+        self.obsFeatId = self.obsFeatId[obsMask]
+        self.obsX = self.obsX[obsMask]
@@ -0,0 +1,169 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+################################################################################
+# Binary cache of sfm_data.json
+#
+# Arrays of SfmData are saved as .npy files in a directory next to sfm_data.json
+# (e.g. sfm_data.json.cache), together with cache.json which has views, other
+# top level items and information of the json file used for invalidation.
+# The cache is valid only if size, modified time and hash of json file are the
+# same as when the cache is created. Valid cache is loaded by memory map.
+################################################################################
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import hulo_file.FileUtils as FileUtils
+
+# set False to disable cache
+CACHE_ENABLED = True
+
+# version of cache format, cache with different version is ignored
+CACHE_VERSION = 1
+
+# size and number of blocks read to calculate hash of json file
+# if HASH_SAMPLE_NUM is 0, whole file is used to calculate hash
+# sampled hash is faster for large file, but edit in blocks not sampled is detected only by 
+# size and modified time of file
+HASH_BLOCK_SIZE = 1 << 16
+HASH_SAMPLE_NUM = 0
+
+# name of SfmData arrays saved in cache
+CACHE_ARRAYS = ["viewId", "viewPoseId", "viewIntrinsicId", 
+                "extrinsicKey", "extrinsicCenter", "extrinsicRotation", 
+                "structureKey", "structureX", 
+                "obsOffset", "obsViewId", "obsFeatId", "obsX"]
+
+# get path to cache directory of json file
+def getCacheDir(filename):
+    return filename + ".cache"
+
+# calculate hash of json file
+# if HASH_SAMPLE_NUM is larger than 0, only blocks at beginning, end, and evenly sampled
+# positions are used, otherwise whole file is used
+def calcFileHash(filename):
+    md5 = hashlib.md5()
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as fp:
+        if HASH_SAMPLE_NUM <= 0 or size <= HASH_BLOCK_SIZE * (HASH_SAMPLE_NUM + 2):
+            while True:
+                data = fp.read(FileUtils.JSON_READ_CHUNK_SIZE)
+                if not data:
+                    break
+                md5.update(data)
+        else:
+            offsets = np.linspace(0, size - HASH_BLOCK_SIZE, HASH_SAMPLE_NUM + 2).astype(np.int64)
+            for offset in offsets.tolist():
+                fp.seek(offset)
+                md5.update(fp.read(HASH_BLOCK_SIZE))
+    return md5.hexdigest()
+
+# get information of json file used to check cache is valid
+def getFileInfo(filename, fileHash=None):
+    stat = os.stat(filename)
+    if fileHash is None:
+        fileHash = calcFileHash(filename)
+    return {"size" : stat.st_size, "mtime" : stat.st_mtime, "hash" : fileHash}
+
+# load cache.json if cache of json file exists and valid, otherwise return None
+def loadCacheInfo(filename):
+    cacheInfoFile = os.path.join(getCacheDir(filename), "cache.json")
+    if not os.path.isfile(cacheInfoFile) or not os.path.isfile(filename):
+        return None
+    
+    try:
+        cacheInfo = FileUtils.loadjson(cacheInfoFile)
+    except ValueError:
+        return None
+    if cacheInfo.get("version") != CACHE_VERSION:
+        return None
+    
+    # compare size and modified time before calculating hash
+    stat = os.stat(filename)
+    fileInfo = cacheInfo["file"]
+    if fileInfo["size"] != stat.st_size or fileInfo["mtime"] != stat.st_mtime:
+        return None
+    if fileInfo["hash"] != calcFileHash(filename):
+        return None
+    
+    return cacheInfo
+
+# load SfmData from cache of json file, arrays are loaded by copy-on-write memory map
+# return None if cache does not exist or is invalid
+def loadCache(filename):
+    if not CACHE_ENABLED:
+        return None
+    
+    cacheInfo = loadCacheInfo(filename)
+    if cacheInfo is None:
+        return None
+    
+    # import here to avoid circular import
+    from hulo_file.SfmData import SfmData
+    data = SfmData()
+    data.header = cacheInfo["header"]
+    data.views = cacheInfo["views"]
+    cacheDir = getCacheDir(filename)
+    try:
+        for name in CACHE_ARRAYS:
+            setattr(data, name, np.load(os.path.join(cacheDir, name + ".npy"), mmap_mode="c"))
+    except (IOError, ValueError):
+        return None
+    
+    return data
+
+# save SfmData as cache of json file
+# fileHash can be given if hash of json file is already known
+def saveCache(data, filename, fileHash=None):
+    if not CACHE_ENABLED:
+        return
+    
+    # write to temporary directory first, then replace old cache
+    cacheDir = getCacheDir(filename)
+    cacheDirTmp = cacheDir + ".tmp" + str(os.getpid())
+    try:
+        FileUtils.removedir(cacheDirTmp)
+        FileUtils.makedir(cacheDirTmp)
+        for name in CACHE_ARRAYS:
+            np.save(os.path.join(cacheDirTmp, name + ".npy"), np.ascontiguousarray(getattr(data, name)))
+        
+        cacheInfo = {"version" : CACHE_VERSION, 
+                     "file" : getFileInfo(filename, fileHash), 
+                     "header" : data.header, 
+                     "views" : data.views}
+        FileUtils.savejson(cacheInfo, os.path.join(cacheDirTmp, "cache.json"))
+        
+        FileUtils.removedir(cacheDir)
+        os.rename(cacheDirTmp, cacheDir)
+    except (IOError, OSError) as e:
+        # cache is optional, continue without cache if it cannot be written
+        print "Cannot write cache of " + filename + " : " + str(e)
+        FileUtils.removedir(cacheDirTmp)
+
+# remove cache of json file
+def removeCache(filename):
+    FileUtils.removedir(getCacheDir(filename))
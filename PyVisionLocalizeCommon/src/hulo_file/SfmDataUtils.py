@@ -25,23 +25,17 @@ import json
 import numpy as np
 import os
 import hulo_file.FileUtils as FileUtils
+from hulo_file.SfmData import SfmData
 
 def saveGlobalSfM(inSfmFile, inAmatFile, outSfmFile):
-    with open(inSfmFile) as filejson:
-        data = json.load(filejson)
+    data = SfmData.load(inSfmFile)
     
     with open(inAmatFile,"r") as filemat:
         Amat = np.loadtxt(filemat)
     
-    for extrinsics in data["extrinsics"]:
-        extrinsics["value"]["center"] = np.dot(Amat,np.concatenate([extrinsics["value"]["center"],[1]])).tolist()
-        extrinsics["value"]["rotation"] = np.dot(Amat[:, 0:3],extrinsics["value"]["rotation"]).tolist()
+    data.transform(Amat)
     
-    for structure in data["structure"]:
-        structure["value"]["X"] = np.dot(Amat,np.concatenate([structure["value"]["X"],[1]])).tolist()
-    
-    with open(outSfmFile,"w") as filejson:
-        json.dump(data, filejson)
+    data.save(outSfmFile)
 
 #
 # Select largest model from "Output" folder, and save to "Output/final"
@@ -76,12 +70,11 @@ def saveFinalSfM(projectDir):
         sfmDataFile = os.path.join(projectDir,"Output","merge_result","Output","SfM","reconstruction",sfmOutputDir,"sfm_data.json")
         if not os.path.exists(sfmDataFile):
             continue
-        with open(sfmDataFile) as fp:
-            sfmData = json.load(fp)
-            poseNum = len(sfmData["extrinsics"])
-            if (poseNum > maxPoseNum):
-                selectedSfmOutputDir = os.path.join(projectDir,"Output","merge_result","Output","SfM","reconstruction",sfmOutputDir)
-                maxPoseNum = poseNum
+        sfmData = SfmData.load(sfmDataFile, ["extrinsics"])
+        poseNum = len(sfmData.extrinsicKey)
+        if (poseNum > maxPoseNum):
+            selectedSfmOutputDir = os.path.join(projectDir,"Output","merge_result","Output","SfM","reconstruction",sfmOutputDir)
+            maxPoseNum = poseNum
     # select from single 3D model if merged 3D model does not exist
     if not selectedSfmOutputDir:
         outputDirs = sorted(os.listdir(os.path.join(projectDir,"Output")))
@@ -93,12 +86,11 @@ def saveFinalSfM(projectDir):
             sfmDataFile = os.path.join(sfmOutputDir,"sfm_data.json")
             if not os.path.exists(sfmDataFile):
                 continue
-            with open(sfmDataFile) as fp:
-                sfmData = json.load(fp)
-                poseNum = len(sfmData["extrinsics"])
-                if (poseNum > maxPoseNum):
-                    selectedSfmOutputDir = sfmOutputDir
-                    maxPoseNum = poseNum
+            sfmData = SfmData.load(sfmDataFile, ["extrinsics"])
+            poseNum = len(sfmData.extrinsicKey)
+            if (poseNum > maxPoseNum):
+                selectedSfmOutputDir = sfmOutputDir
+                maxPoseNum = poseNum
         
     # create symbolic links to all images, csv, and descriptor/feature files
     os.system("cp --remove-destination -s " + os.path.join(projectDir,"Input","*","inputImg","*") + " " + os.path.join(finalOutputDir,"Input","inputImg"))
@@ -125,14 +117,15 @@ def saveFinalSfM(projectDir):
         os.system("cp --remove-destination " + os.path.join(projectDir,"Output","merge_result","Output","matches","BOWfile.yml") + " " + os.path.join(finalOutputDir,"Output","matches"))
     
     # To create same directory structure before merging, create sfm_data.json without structure information in matches directory
-    with open(os.path.join(os.path.join(selectedSfmOutputDir,"sfm_data.json"))) as fpr:
-        sfmData = json.load(fpr)
-        sfmData["extrinsics"] = []
-        sfmData["control_points"] = []
-        sfmData["structure"] = []
-        with open(os.path.join(finalOutputDir,"Output","matches","sfm_data.json"),"w") as fpw:
-            json.dump(sfmData, fpw)
+    sfmData = FileUtils.loadjson(os.path.join(selectedSfmOutputDir,"sfm_data.json"), ["sfm_data_version","root_path","views","intrinsics"])
+    sfmData["extrinsics"] = []
+    sfmData["control_points"] = []
+    sfmData["structure"] = []
+    FileUtils.savejson(sfmData, os.path.join(finalOutputDir,"Output","matches","sfm_data.json"))
     
     # copy beacon.txt if exists
     if os.path.exists(os.path.join(selectedSfmOutputDir,"beacon.txt")):
         os.system("cp --remove-destination " + os.path.join(selectedSfmOutputDir,"beacon.txt") + " " + os.path.join(finalOutputDir,"Output","SfM","reconstruction","global"))
+        # copy binary beacon file after beacon.txt so that it stays newer than beacon.txt
+        if os.path.exists(os.path.join(selectedSfmOutputDir,"beacon.txt.bin")):
+            os.system("cp --remove-destination " + os.path.join(selectedSfmOutputDir,"beacon.txt.bin") + " " + os.path.join(finalOutputDir,"Output","SfM","reconstruction","global"))
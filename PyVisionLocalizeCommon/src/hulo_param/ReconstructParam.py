@@ -147,6 +147,34 @@ class ReconstructParam:
     # mergeSfM.mergeModel arg ransacRound
     ransacRoundMul = 100
     
+    # RANSAC method for merging two models, "ransac" or "loransac"
+    # if "loransac" is used, number of RANSAC round computed by ransacRoundMul is maximum,
+    # and RANSAC is terminated when enough rounds are tested with ransacConfidence
+    # if ransacProsac is True, "loransac" draws samples from matches supported by more 2D matches first (PROSAC)
+    # mergeSfM.mergeModel arg ransacMethod, ransacConfidence, ransacProsac
+    ransacMethod = "ransac"
+    ransacConfidence = 0.99
+    ransacProsac = False
+    
+    # Number of processes to test RANSAC hypotheses for merging two models, number of CPUs if None
+    # If ransacSeed is set, merging result is reproducible for any number of processes
+    # mergeSfM.mergeModel arg ransacProcessNum, ransacSeed
+    ransacProcessNum = 1
+    ransacSeed = None
+    
+    # Number of merge candidates which are localized and merged at once in worker processes
+    # Merge result is the same as merging candidates one by one
+    # sfmMergeGraph.mergeCandidates, sfmMergeGraph.mergeRound arg nProcess
+    mergeProcessNum = 1
+    
+    # Strategy to merge models, "greedy" or "tree"
+    # "greedy" merges connected models to one base model at a time
+    # "tree" pairs up disjoint connected models and merges all pairs in each round at once,
+    # and repeats rounds until no pair can be merged. Pairs in a round are merged by 
+    # mergeProcessNum worker processes
+    # sfmMergeGraph.mergeModel
+    mergeStrategy = "greedy"
+    
     # TODO : revisit this parameter, number of minimun inliers should be defined by sfm data size?
     #    modified by T.Ishihara 2016.06.09
     #    100 -> 10
@@ -215,6 +243,18 @@ class ReconstructParam:
     # new condition
     vldMergeMinLocF = 20
     
+    # Progressive localization for merge validation
+    # If progressiveLoc is True, spread-out sample of reconstructed frames of model2 is localized first, 
+    # and merge is rejected without localizing other frames if number of agrFrame, ratio between 
+    # agrFrame and locFrame, or number of 3D inliers of the sample extrapolated to all frames is below 
+    # progressiveLocRejectMargin times the thresholds of merge validation.
+    # Sample has progressiveLocSampleRatio of reconstructed frames, and at least progressiveLocMinSample frames
+    # sfmMergeGraph.localizeReconFrames
+    progressiveLoc = False
+    progressiveLocSampleRatio = 0.2
+    progressiveLocMinSample = 50
+    progressiveLocRejectMargin = 0.5
+    
     ###############################################################################################
     # localizeGlobalCoordinate
     ###############################################################################################        
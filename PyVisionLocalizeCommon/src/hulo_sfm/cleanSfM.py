@@ -26,6 +26,7 @@ import numpy as np
 import random
 import string
 import hulo_file.FileUtils as FileUtils
+from hulo_file.SfmData import SfmData
 
 # clean sfm_data.json by changing viewID and extrinsicID to start with 0 and end with last frame used for reconstruction
 # also, the indices of viewID in matches file is updated as well
@@ -33,41 +34,23 @@ import hulo_file.FileUtils as FileUtils
 # return the name of images which are not used for reconstruction
 def cleanSfM(sfm_data_path,matchesFile):
     
-    sfm_data = FileUtils.loadjson(sfm_data_path)
-    if (len(sfm_data["views"])==0):
+    sfm_data = SfmData.load(sfm_data_path)
+    if (len(sfm_data.views)==0):
         print "No views are used in reconstruction of " + sfm_data_path
         return [[],[]]
-    if (len(sfm_data["extrinsics"])==0):
+    if (len(sfm_data.extrinsicKey)==0):
         print "No extrinsics are used in reconstruction of " + sfm_data_path
         return [[],[]]
     
-    # get map from ID to index
-    viewMap = {}
-    for i in range(0,len(sfm_data["views"])):
-        viewMap[sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"]] = i
-                
-    extMap = {}
-    for i in range(0,len(sfm_data["extrinsics"])):
-        extMap[sfm_data["extrinsics"][i]["key"]] = i
-                
-    strMap = {}
-    for i in range(0,len(sfm_data["structure"])):
-        strMap[sfm_data["structure"][i]["key"]] = i
-    
     # find viewIDs of first and last frame used in reconstruction
-    firstViewID = len(sfm_data["views"])
+    firstViewID = len(sfm_data.views)
     lastViewID = 0
-    firstExtID = min(extMap.keys())
+    firstExtID = sfm_data.extrinsicKey.min()
     
-    for i in range(0,len(sfm_data["views"])):
-        viewID = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"]
-        extID = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_pose"]
-        
-        if extID in extMap:
-            if firstViewID > viewID:
-                firstViewID = viewID
-            if lastViewID < viewID:
-                lastViewID = viewID
+    posedViewID = sfm_data.viewId[sfm_data.getPosedViewMask()]
+    if len(posedViewID) > 0:
+        firstViewID = min(firstViewID, int(posedViewID.min()))
+        lastViewID = max(lastViewID, int(posedViewID.max()))
                 
     if firstViewID >= lastViewID:
         print "No views are used in reconstruction of " + sfm_data_path
@@ -75,33 +58,22 @@ def cleanSfM(sfm_data_path,matchesFile):
     
     # get list of unused view back to front
     # and change the view Index
-    unusedImgName = [[],[]]
-    for i in range(len(sfm_data["views"])-1,lastViewID,-1):
-        unusedImgName[1].append(sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["filename"])
-        sfm_data["views"].pop(i)
+    viewFilenames = sfm_data.getViewFilenames()
+    unusedImgName = [viewFilenames[0:firstViewID][::-1], viewFilenames[lastViewID+1:][::-1]]
     
-    for i in range(lastViewID,firstViewID-1,-1):
-        newViewID = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"]-firstViewID
-        sfm_data["views"][i]["key"] = newViewID
-        sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"] = newViewID
-        sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_pose"] = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_pose"] - firstExtID
-            
-    for i in range(firstViewID-1,-1,-1):
-        unusedImgName[0].append(sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["filename"])        
-        sfm_data["views"].pop(i)
+    sfm_data.views = sfm_data.views[firstViewID:lastViewID+1]
+    sfm_data.viewId = sfm_data.viewId[firstViewID:lastViewID+1] - firstViewID
+    sfm_data.viewPoseId = sfm_data.viewPoseId[firstViewID:lastViewID+1] - firstExtID
+    sfm_data.viewIntrinsicId = sfm_data.viewIntrinsicId[firstViewID:lastViewID+1]
         
     # change extrinsics ID
-    for i in range(0,len(sfm_data["extrinsics"])):
-        sfm_data["extrinsics"][i]["key"] = sfm_data["extrinsics"][i]["key"]-firstExtID
+    sfm_data.extrinsicKey = sfm_data.extrinsicKey - firstExtID
         
     # change index of refered view in structure
-    for i in range(0,len(sfm_data["structure"])):
-        for j in range(0,len(sfm_data["structure"][i]["value"]["observations"])):
-            sfm_data["structure"][i]["value"]["observations"][j]["key"] = \
-                sfm_data["structure"][i]["value"]["observations"][j]["key"]-firstViewID
+    sfm_data.obsViewId = sfm_data.obsViewId - firstViewID
     
     # save jsonfile back
-    FileUtils.savejson(sfm_data,sfm_data_path)
+    sfm_data.save(sfm_data_path)
     
     # update matches file
     for matchfile in matchesFile:
@@ -180,19 +152,13 @@ def cutSfMDataJump(sfm_data_location, thresMul=4.5, bufferFrame=5):
         return 0
     
     # load sfm_data
-    with open(sfm_data_location,"r") as jsonfile:
-        sfm_data = json.load(jsonfile)
+    sfm_data = SfmData.load(sfm_data_location)
     
-    if len(sfm_data["extrinsics"]) < 1:
+    if len(sfm_data.extrinsicKey) < 1:
         return 0
     
     # calculate distance between each frame
-    distance = np.zeros([len(sfm_data["extrinsics"])-1,1],dtype=np.float)
-    for iExt in range(0,len(sfm_data["extrinsics"])-1):
-        X = np.array(sfm_data["extrinsics"][iExt]["value"]["center"])
-        Y = np.array(sfm_data["extrinsics"][iExt+1]["value"]["center"])
-
-        distance[iExt] = np.linalg.norm(X-Y)
+    distance = np.linalg.norm(np.diff(sfm_data.extrinsicCenter, axis=0), axis=1)
     
     # find distance between distance
     #diffDist = np.abs(distance[0:-1]-distance[1:])
@@ -209,7 +175,7 @@ def cutSfMDataJump(sfm_data_location, thresMul=4.5, bufferFrame=5):
     jumpFrame = np.where(diffDistRatio > thresMul)[0] 
     
     # remove jumpframe too close to beginning or end of sequence
-    jumpFrame = [x for x in jumpFrame if x > bufferFrame-1 and x < len(sfm_data["extrinsics"])-bufferFrame]
+    jumpFrame = [x for x in jumpFrame if x > bufferFrame-1 and x < len(sfm_data.extrinsicKey)-bufferFrame]
     
     # return if no jump
     if len(jumpFrame) == 0:
@@ -217,7 +183,7 @@ def cutSfMDataJump(sfm_data_location, thresMul=4.5, bufferFrame=5):
     
     # otherwise remove all frames after the first jump
     leaveFront = True # bool indicating which part to keep; True for front, False for back
-    if jumpFrame[0] > len(sfm_data["extrinsics"]) - jumpFrame[-1]:
+    if jumpFrame[0] > len(sfm_data.extrinsicKey) - jumpFrame[-1]:
         leaveFront = True
         jumpFrame = jumpFrame[0]
     else:
@@ -228,13 +194,12 @@ def cutSfMDataJump(sfm_data_location, thresMul=4.5, bufferFrame=5):
     
     
     # get viewID of frame with extrinsic at firstFrameCut
-    extID = sfm_data["extrinsics"][firstFrameCut]["key"]
+    extID = sfm_data.extrinsicKey[firstFrameCut]
     
     viewIDtoRm = -1
-    for i in range(0,len(sfm_data["views"])):
-        if sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_pose"] == extID:
-            viewIDtoRm = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"]
-            break
+    viewIdx = np.where(sfm_data.viewPoseId == extID)[0]
+    if len(viewIdx) > 0:
+        viewIDtoRm = sfm_data.viewId[viewIdx[0]]
         
     # if cannot find such view ID then sfm_data is corrupted (?), so return   
     if viewIDtoRm == -1:
@@ -243,35 +208,24 @@ def cutSfMDataJump(sfm_data_location, thresMul=4.5, bufferFrame=5):
     
     # remove all extrinsics after that
     if leaveFront:
-        del sfm_data["extrinsics"][firstFrameCut:]
+        sfm_data.selectExtrinsics(slice(0, firstFrameCut))
     else:
-        del sfm_data["extrinsics"][0:firstFrameCut+1]
+        sfm_data.selectExtrinsics(slice(firstFrameCut+1, None))
         
     # remove points associating with viewIDtoRm and after
-    for i in range(0,len(sfm_data["structure"])):
-        point3D = sfm_data["structure"][i]
-        
-        # iterate thru observation and start removing from back to prevent index out of bound
-        for j in range(len(point3D["value"]["observations"])-1,-1,-1):
-            print str(j) + " " + str(len(point3D["value"]["observations"]))
-            if leaveFront:
-                if point3D["value"]["observations"][j]["key"] >= viewIDtoRm:
-                    del point3D["value"]["observations"][j]
-            else:
-                if point3D["value"]["observations"][j]["key"] <= viewIDtoRm:
-                    del point3D["value"]["observations"][j]
+    if leaveFront:
+        sfm_data.selectObservations(sfm_data.obsViewId < viewIDtoRm)
+    else:
+        sfm_data.selectObservations(sfm_data.obsViewId > viewIDtoRm)
                     
     # find a point has fewer than 3 views and remove them
-    sfm_data["structure"][:] = [sfm_data["structure"][i] for i in range(0,len(sfm_data["structure"])) if len(sfm_data["structure"][i]["value"]["observations"]) > 2]
+    sfm_data.selectStructure(sfm_data.getObservationCount() > 2)
     
     # change the key of the points
-    for i in range(0,len(sfm_data["structure"])):
-        sfm_data["structure"][i]["key"] = i    
+    sfm_data.structureKey = np.arange(len(sfm_data.structureKey), dtype=np.int64)
         
     # rename old sfm_data and write out new sfm_data
     os.rename(sfm_data_location, sfm_data_location[0:-5] + "_BC.json")
-    with open(sfm_data_location,"w") as jsonfile:
-        json.dump(sfm_data, jsonfile)
+    sfm_data.save(sfm_data_location)
         
     return 1
-    
\ No newline at end of file
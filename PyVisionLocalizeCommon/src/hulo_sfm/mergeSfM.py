@@ -42,45 +42,47 @@ import numpy as np
 from scipy.spatial import cKDTree
 from fileinput import filename
 import random
+from collections import Counter
 import hulo_file.FileUtils as FileUtils
+from hulo_file.SfmData import SfmData, findKeyIndex
+from hulo_file.LocResult import LocResult
+import hulo_transform.TransformUtils as TransformUtils
+import hulo_transform.batchRansacTransform as batchRansacTransform
 
 # Read localization output json file to extract matches for each image in model B.
 # Require folder of location as output
 # Return lists of image names and match pairs between 2D (model B image) and 3D (model A structure)
 def readMatch(locFolder):
     
+    print "Reading loc output: " + locFolder
+    locResult = LocResult.load(locFolder)
+    
     imgname = []
     matchlist = []
-    
-    print "Reading loc output: " + locFolder
-    for filename in sorted(os.listdir(locFolder)):
-        
-        if filename[-4:] != "json":
-            continue
-        
-        jsondata = FileUtils.loadjson(os.path.join(locFolder, filename))
-        if "t" in jsondata:
-            imgname.append(os.path.basename(jsondata["filename"]))
-            matchlist.append(jsondata["pair"])
+    for i in locResult.getLocalizedIndex().tolist():
+        imgname.append(os.path.basename(locResult.filename[i]))
+        matchlist.append(locResult.getPairs(i).tolist())
         
     return imgname, matchlist
 
 # from list of image name return list of view IDs
 def imgnameToViewID(imgname, sfm_data):
     
-    viewID = []
+    viewID = [-1] * len(imgname)
     
-    # preallocate list memory
+    # map from image name to its first position in imgname
+    imgnameIndex = {}
     for i in range(0, len(imgname)):
-        viewID.append(-1)
+        imgnameIndex.setdefault(imgname[i], i)
         
     # go thru list of views
-    for i in range(0, len(sfm_data["views"])):
-        sfm_imgname = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["filename"]
+    sfm_imgnames = sfm_data.getViewFilenames()
+    sfm_viewIDs = sfm_data.viewId.tolist()
+    for i in range(0, len(sfm_imgnames)):
         
         # compare image name and put in correct position
-        if sfm_imgname in imgname:
-            viewID[imgname.index(sfm_imgname)] = sfm_data["views"][i]["value"]["ptr_wrapper"]["data"]["id_view"]
+        if sfm_imgnames[i] in imgnameIndex:
+            viewID[imgnameIndex[sfm_imgnames[i]]] = sfm_viewIDs[i]
       
     return viewID
 
@@ -89,21 +91,17 @@ def imgnameToViewID(imgname, sfm_data):
 def getViewFeatTo3DMap(sfm_data):
     viewFeatMap = {}
     
-    structure = sfm_data["structure"]
+    # 3D point ID of each observation
+    obsPtKey = sfm_data.structureKey[sfm_data.getObservationPointIndex()]
     
-    # go thru list of 3D points
-    for i in range(0, len(structure)):
-        obsKey = structure[i]["key"]
-        obs = structure[i]["value"]["observations"]
-
-        # go thru list of view having that 3D point
-        for j in range(0, len(obs)):
-
-            # save the viewID, featID map to 3D ID
-            if obs[j]["key"] not in viewFeatMap:
-                viewFeatMap[obs[j]["key"]] = {}
-                
-            viewFeatMap[obs[j]["key"]][obs[j]["value"]["id_feat"]] = obsKey
+    # go thru list of observations in order of 3D points
+    for viewID, featID, ptKey in zip(sfm_data.obsViewId.tolist(), sfm_data.obsFeatId.tolist(), obsPtKey.tolist()):
+        
+        # save the viewID, featID map to 3D ID
+        if viewID not in viewFeatMap:
+            viewFeatMap[viewID] = {}
+            
+        viewFeatMap[viewID][featID] = ptKey
             
     return viewFeatMap
 
@@ -157,80 +155,113 @@ def getConsistent3DMatch(viewID, matchList, viewFeatMap):
             match3D.append([key, matchMap[key]])
             
     # find list of duplicate second element of pair
-    sec = [y[1] for y in match3D]
-    dup = set([y for y in sec if sec.count(y) > 1])
+    countSec = Counter([y[1] for y in match3D])
+    dup = set([y for y in countSec if countSec[y] > 1])
     
     # remove element with duplicate second element
     match3D = [x for x in match3D if x[1] not in dup]
             
     return match3D
+
+# same as getConsistent3DMatch, but calculated with arrays of sfm_data of model B
+# instead of dictionary made by getViewFeatTo3DMap
+#
+# Input
+# viewID : list of view ID 
+# matchList : list of list of matches between 2D feature ID of each view in model B
+#          to 3D point ID of model A (same as getConsistent3DMatch)
+# sfm_data : SfmData of model B
+#
+# Output
+# match3D : list of match pair between 3D pt ID of model B and 3D pt ID of model A,
+#          in the same order as getConsistent3DMatch
+# matchCount : number of 2D matches supporting each match pair, returned only if returnCount is True
+def getConsistent3DMatchFromSfmData(viewID, matchList, sfm_data, returnCount=False):
+    
+    # chech length equal
+    if(len(viewID) != len(matchList)):
+        sys.exit("lengths of viewID and matchList are not the same")
+    
+    # make arrays of view ID, feature ID and 3D pt ID of model A for all matches
+    nMatch = [len(matches) for matches in matchList]
+    matchView = np.repeat(np.asarray(viewID, dtype=np.int64), nMatch)
+    matchPair = np.asarray([pair[0:2] for matches in matchList for pair in matches], dtype=np.int64).reshape(-1,2)
+    
+    # find 3D pt ID of model B for each match by (view ID, feature ID) code
+    # if (view ID, feature ID) is observed by many points, the last point is used as getViewFeatTo3DMap
+    obsCode = (sfm_data.obsViewId << 32) | sfm_data.obsFeatId
+    matchCode = (matchView << 32) | matchPair[:,0]
+    obsIndex = findKeyIndex(obsCode, matchCode)
+    
+    isFound = obsIndex >= 0
+    ptB = sfm_data.structureKey[sfm_data.getObservationPointIndex()[obsIndex[isFound]]]
+    ptA = matchPair[isFound,1]
+    if len(ptB) == 0:
+        if returnCount:
+            return [], []
+        return []
+    
+    # 3D pt of model B is consistent if all of its matches are the same 3D pt of model A
+    # (sort matches by 3D pt of model B and model A, then compare first and last match of each group)
+    uniqB, firstB, invB = np.unique(ptB, return_index=True, return_inverse=True)
+    order = np.lexsort((ptA, invB))
+    groupStart = np.searchsorted(invB[order], np.arange(len(uniqB)))
+    groupEnd = np.append(groupStart[1:], len(order)) - 1
+    minA = ptA[order[groupStart]]
+    maxA = ptA[order[groupEnd]]
+    isConsistent = (minA == maxA) & (minA != -1)
+    
+    # remove matches whose 3D pt of model A is matched from more than one 3D pt of model B
+    uniqA, invA = np.unique(minA[isConsistent], return_inverse=True)
+    isUniqueA = np.bincount(invA, minlength=len(uniqA)) == 1
+    isConsistent[np.flatnonzero(isConsistent)[~isUniqueA[invA]]] = False
+    matchMap = dict(zip(uniqB[isConsistent].tolist(), minA[isConsistent].tolist()))
+    countMap = dict(zip(uniqB[isConsistent].tolist(), (groupEnd - groupStart + 1)[isConsistent].tolist()))
+    
+    # keep order of getConsistent3DMatch, which is iteration order of dictionary
+    # inserting 3D pt of model B in order of first appearance
+    keyOrder = dict.fromkeys(uniqB[np.argsort(firstB, kind="mergesort")].tolist())
+    match3D = [[key, matchMap[key]] for key in keyOrder if key in matchMap]
+    
+    if returnCount:
+        return match3D, [countMap[pair[0]] for pair in match3D]
+    return match3D
     
 # get 3D location given sfm_data and 3D pt ID
+# return n x 3 array, location is infinity if 3D pt ID is not found
 def get3DPointloc(sfm_data, listID):
-    list3D = []
-    
-    # generate map from 3D pt ID to structure index
-    mapID = {}
-    for j in range(0, len(sfm_data["structure"])):
-        mapID[sfm_data["structure"][j]["key"]] = j
-    
-    for id3D in listID:
-        if id3D in mapID:
-            list3D.append(sfm_data["structure"][mapID[id3D]]["value"]["X"])
-        else:
-            list3D.append([float("inf"),float("inf"),float("inf")])
+    index = sfm_data.getStructureIndex(listID)
+    
+    list3D = np.empty((len(index),3), dtype=np.float)
+    list3D.fill(float("inf"))
+    list3D[index>=0] = sfm_data.structureX[index[index>=0]]
         
     return list3D
 
 # get all 3D points location given sfm_data 
 def getAll3DPointloc(sfm_data):
-    listKey = []
-    list3D = []
-    
-    for structure in sfm_data["structure"]:
-        listKey.append(structure["key"])
-        list3D.append(structure["value"]["X"])
-    
-    return listKey, list3D
+    return sfm_data.structureKey, sfm_data.structureX
 
 # get camera location given sfm_data and list of viewIDs
+# return n x 3 array, location is infinity if viewID is not found or has no extrinsic
 def get3DViewloc(sfm_data, listID):
-    listLoc = []
-    
-    # generate map from viewID to extrinsics ID
-    mapViewID2ExtID = {}
-    for j in range(0, len(sfm_data["views"])):
-        mapViewID2ExtID[sfm_data["views"][j]["value"]["ptr_wrapper"]["data"]["id_view"]] = sfm_data["views"][j]["value"]["ptr_wrapper"]["data"]["id_pose"]
-    
-    # generate map from extrinsics ID to extrinsic index
-    mapExtID2ExtIdx = {}
-    for j in range(0, len(sfm_data["extrinsics"])):
-        mapExtID2ExtIdx[sfm_data["extrinsics"][j]["key"]] = j
+    listLoc = np.empty((len(listID),3), dtype=np.float)
+    listLoc.fill(float("inf"))
+    
+    # map from viewID to extrinsics ID, then to extrinsic index
+    viewIdx = sfm_data.getViewIndex(listID)
+    extIdx = np.empty(len(listID), dtype=np.int64)
+    extIdx.fill(-1)
+    extIdx[viewIdx>=0] = sfm_data.getExtrinsicIndex(sfm_data.viewPoseId[viewIdx[viewIdx>=0]])
         
     # get location
-    for viewID in listID:
-        if viewID in mapViewID2ExtID:
-            extID = mapViewID2ExtID[viewID]
-            
-            if extID in mapExtID2ExtIdx:
-                listLoc.append(sfm_data["extrinsics"][mapExtID2ExtIdx[extID]]["value"]["center"])
-                continue
-        
-        # if viewID is not found or no extrinsic, return infinity
-        listLoc.append([float("inf"),float("inf"),float("inf")])
+    listLoc[extIdx>=0] = sfm_data.extrinsicCenter[extIdx[extIdx>=0]]
         
     return listLoc
 
 # get all camera location given sfm_data 
 def getAll3DViewloc(sfm_data):
-    listKey = []
-    list3D = []
-    
-    for extrinsic in sfm_data["extrinsics"]:
-        listKey.append(extrinsic["key"])
-        list3D.append(extrinsic["value"]["center"])
-    
-    return listKey, list3D
+    return sfm_data.extrinsicKey, sfm_data.extrinsicCenter
 
 # find RANSAC threshold as k times the median of distance between
 # consecutive camera points from input sfm_data
@@ -254,51 +285,79 @@ def findMedianThres(sfm_data, k):
 
     return k * np.median(distance)
 '''
+# maximum number of points used to find median distance to the nearest neighbor
+# stratified subsample is used for larger point cloud, set None to use all points
+MEDIAN_THRES_MAX_SAMPLE = None
+
+# query k nearest neighbors of all points at once by all CPUs
+def queryKDTree(kdtree, points, k):
+    try:
+        return kdtree.query(points, k, n_jobs=-1)
+    except TypeError:
+        # n_jobs is not supported by old scipy, and renamed to workers by new scipy
+        try:
+            return kdtree.query(points, k, workers=-1)
+        except TypeError:
+            return kdtree.query(points, k)
+
+# find median of distance from each point to its nearest neighbor
+# points : n x 3
+# if n is larger than maxSample, points are split into maxSample strata by index, one point 
+# is sampled from each stratum, and median of sampled distances is returned. With 95% confidence,
+# true median is between sampled distances ranked maxSample/2 +- sqrt(maxSample)
+def findMedianNeighborDistance(points, maxSample=None):
+    points = np.ascontiguousarray(points, dtype=np.float)
+    kdtree = cKDTree(points)
+    
+    # sample points, random generator is fixed to get the same result for the same points
+    nPoint = points.shape[0]
+    if maxSample is not None and nPoint > maxSample:
+        strata = np.linspace(0, nPoint, maxSample + 1).astype(np.int64)
+        rng = np.random.RandomState(0)
+        sample = strata[:-1] + np.floor(rng.random_sample(maxSample) * np.diff(strata)).astype(np.int64)
+        query = points[sample]
+    else:
+        query = points
+    
+    # the nearest neighbor other than the point itself
+    dist, indexes = queryKDTree(kdtree, query, 2)
+    distance = dist[:, 1]
+    median = np.median(distance)
+    
+    if len(distance) < nPoint:
+        sortDistance = np.sort(distance)
+        margin = int(np.ceil(np.sqrt(len(distance))))
+        print "Median distance is estimated from " + str(len(distance)) + " points : " + str(median) + \
+            ", 95% interval : [" + str(sortDistance[max(0, len(distance)//2 - margin)]) + ", " + \
+            str(sortDistance[min(len(distance) - 1, len(distance)//2 + margin)]) + "]"
+    
+    return median
+
+# find median of distance from each point of array name of sfm_data to its nearest neighbor
+# result is cached in sfm_data with content hash of the array
+def findSfmDataMedianNeighborDistance(sfm_data, name, maxSample=None):
+    return sfm_data.getCachedResult(("medianNeighborDistance", name, maxSample), [name], 
+                                    lambda points: findMedianNeighborDistance(points, maxSample))
+
 #
 # new version : 
 # this function does not assume the order of views
 # T. Ishihara 2016.06.08
 #
 def findMedianThres(sfm_data, k):
-    viewId, viewLoc = getAll3DViewloc(sfm_data)
-    viewLocn = np.asarray(viewLoc, dtype=np.float)
-    
-    if viewLocn.shape[0]<2:
+    if len(sfm_data.extrinsicKey)<2:
         return 0
-
-    kdtree = cKDTree(viewLocn)
-    
-    distance = np.zeros([viewLocn.shape[0], 1], dtype=np.float)
-    for i in range(0, viewLocn.shape[0]):
-        dist, indexes = kdtree.query(viewLocn[i], 2)
-        if len(dist)<2:
-            print "Error, array of distance between cameras should be larger than 1."
-            sys.exit()
-        distance[i] = dist[1]
     
-    return k * np.median(distance)
+    return k * findSfmDataMedianNeighborDistance(sfm_data, "extrinsicCenter", MEDIAN_THRES_MAX_SAMPLE)
 
 # TODO : revisit this function
 # find RANSAC threshold as k times the median of distance between
 # structure points from input sfm_data
 def findMedianStructurePointsThres(sfm_data, k):
-    pointId, point = getAll3DPointloc(sfm_data)
-    pointn = np.asarray(point, dtype=np.float)
-    
-    if pointn.shape[0]<2:
+    if len(sfm_data.structureKey)<2:
         return 0
-
-    kdtree = cKDTree(pointn)
     
-    distance = np.zeros([pointn.shape[0], 1], dtype=np.float)
-    for i in range(0, pointn.shape[0]):
-        dist, indexes = kdtree.query(pointn[i], 2)
-        if len(dist)<2:
-            print "Error, array of distance between points should be larger than 1."
-            sys.exit()
-        distance[i] = dist[1]
-    
-    return k * np.median(distance)
+    return k * findSfmDataMedianNeighborDistance(sfm_data, "structureX", MEDIAN_THRES_MAX_SAMPLE)
 
 # find s,R,T such that || sRA + T1' - B ||_F is minimized 
 def procrustes(B, A):
@@ -342,56 +401,35 @@ def procrustes(B, A):
 # return M as 3 x 4
 # use ransac with threshold to find M
 def ransacAffineTransform(A, B, thres, ransacRound, svdRatio=sys.float_info.max):
-    
-    # stack rows of 1
-    B = np.vstack((B, np.ones((1, B.shape[1]))))
-    
-    # RANSAC
-    listInd = range(0, B.shape[1])  # list of all indices
-    inliers = np.asarray([])  # to save list of inliers
-    nInliers = 0
-
-    for rRound in range(0, ransacRound):
-        
-        # select 4 points
-        sel = random.sample(listInd, 4) 
-        
-        '''
-        # find transformation by procrustes
-        s, R, T = procrustes(A[0:3, sel], B[0:3, sel])
-        M = np.hstack((s * R, T))
-        '''
-        # find transformation by least square
-        M = np.linalg.lstsq(B[:, sel].T, A[:, sel].T)[0].T
-        
-        # count inliers
-        Btmp = np.dot(M, B)
-        
-        normVal = np.linalg.norm(Btmp - A, axis=0)
-        inliersTmp = np.where(normVal < thres)[0]  
-        nInliersTmp = len(inliersTmp)  
-    
-        # compare 
-        if nInliersTmp >= nInliers:
-            s = np.linalg.svd(M[0:3, 0:3], compute_uv=False)
-            
-            if nInliersTmp > nInliers and s[0] / s[-1] < svdRatio: 
-                nInliers = nInliersTmp
-                inliers = inliersTmp
-            
-    if len(inliers)<4:
-        return np.array([]), np.asarray([])
-    
-    M = np.linalg.lstsq(B[:, inliers].T, A[:, inliers].T)[0].T
-    
-    print "Number of ransac inliers: " + str(nInliers)
-    return M, inliers
+    return batchRansacTransform.ransacTransformBatch(A, B, thres, ransacRound, svdRatio, model="affine")
 
 #
-# TODO : create AC-RANSAC version, or LO-RANSAC version
+# TODO : create AC-RANSAC version
 # setting good threshold for unscaled 3D model is difficult
 #
-def ransacTransform(A, B, thres, ransacRound, svdRatio=sys.float_info.max):
+# method is "ransac" or "loransac"
+# if method is "loransac", ransacRound is maximum number of rounds, and RANSAC is terminated 
+# when enough rounds are tested with given confidence.
+# quality of each match (larger is better) is used to draw samples by PROSAC if given
+# if method is "ransac" and nProcess is not 1 or seed is given, hypotheses are tested by
+# nProcess worker processes, and the result is reproducible by seed for any nProcess
+def ransacTransform(A, B, thres, ransacRound, svdRatio=sys.float_info.max, method="ransac", confidence=0.99, quality=None, 
+                    nProcess=1, seed=None):
+    if method not in ["ransac", "loransac"]:
+        sys.exit("unknown RANSAC method : " + str(method))
+    
+    if method == "loransac" or nProcess != 1 or seed is not None:
+        try:
+            __import__("hulo_transform.ransacTransform")
+            model = "similarity"
+        except ImportError:
+            model = "affine"
+        if method == "loransac":
+            return batchRansacTransform.loRansacTransform(A, B, thres, ransacRound, svdRatio, model=model, 
+                                                          confidence=confidence, quality=quality, seed=seed)
+        return batchRansacTransform.parallelRansacTransform(A, B, thres, ransacRound, svdRatio, model=model, 
+                                                            seed=seed, nProcess=nProcess)
+    
     try:
         ransacTransform = __import__("hulo_transform.ransacTransform")        
         return ransacTransform.ransacTransform.ransacSimilarityTransform(A, B, thres, ransacRound, svdRatio)
@@ -417,29 +455,7 @@ def getInliersByAffineTransform(A, B, M, thres):
 
 # transform coordinate of sfm_data with M as transformation matrix
 def transform_sfm_data(sfm_data, M):
-    
-    for extKey in range(0,len(sfm_data['extrinsics'])):
-        # transform rotation
-        matRot = np.asarray(sfm_data['extrinsics'][extKey]['value']['rotation'])
-        nmatRot = np.dot(M[:,0:3], matRot)
-        sfm_data['extrinsics'][extKey]['value']['rotation'] = np.ndarray.tolist(nmatRot)
-                
-        # transform center
-        vCenter = np.asarray(sfm_data['extrinsics'][extKey]['value']['center'])
-        nvCenter = np.dot(M[:,0:3],vCenter).flatten() + M[:,3].flatten()
-        if len(nvCenter.shape)==1:
-            sfm_data['extrinsics'][extKey]['value']['center'] = [nvCenter[0],nvCenter[1],nvCenter[2]]
-        else:
-            sfm_data['extrinsics'][extKey]['value']['center'] = [nvCenter[0,0],nvCenter[0,1],nvCenter[0,2]]
-        
-    for strKey in range(0,len(sfm_data['structure'])):
-        # transform 3d coordinate
-        X = np.asarray(sfm_data['structure'][strKey]['value']['X'])
-        nX = np.dot(M[:,0:3],X).flatten() + M[:,3].flatten()
-        if len(nX.shape)==1:
-            sfm_data['structure'][strKey]['value']['X'] = [nX[0],nX[1],nX[2]]
-        else:
-            sfm_data['structure'][strKey]['value']['X'] = [nX[0,0],nX[0,1],nX[0,2]]
+    sfm_data.transform(M)
 
 # merge sfm_dataB into sfm_dataA with M as transformation matrix
 # inlierMapBA maps key key of 3D pt of model B to that of model A
@@ -448,99 +464,102 @@ def merge_sfm_data(sfm_dataA, sfm_dataB, M, inlierMapBA, sfmViewBeaconDataA=None
     # note that use the same intrinsics parameters as sfm_dataA
     
     # get ID of first view after all views of sfm_dataA
-    firstViewB = sfm_dataA["views"][-1]["value"]["ptr_wrapper"]["data"]["id_view"]+1
+    firstViewB = sfm_dataA.viewId[-1]+1
     
     # merge view
-    for viewKey in range(0, len(sfm_dataB['views'])):
-        view = sfm_dataB['views'][viewKey]  # reference
-        view['key'] = firstViewB + view['value']['ptr_wrapper']['data']['id_view']
-        view['value'] = sfm_dataB['views'][viewKey]['value']
-        view['value']['ptr_wrapper']['data']['filename'] = view['value']['ptr_wrapper']['data']['filename']
-        view['value']['ptr_wrapper']['data']['id_intrinsic'] = 0
-        view['value']['ptr_wrapper']['data']['id_view'] = firstViewB + view['value']['ptr_wrapper']['data']['id_view']
-        view['value']['ptr_wrapper']['data']['id_pose'] = firstViewB + view['value']['ptr_wrapper']['data']['id_pose']
-        sfm_dataA['views'].append(view)
-        
-        # merge beacon data if specified
-        if sfmViewBeaconDataA is not None and sfmViewBeaconDataB is not None:
-            sfmViewBeaconDataA[len(sfm_dataA['views'])-1] = sfmViewBeaconDataB[viewKey]
-            
-    # load transformation matrix
-    #Minv = np.linalg.inv(np.vstack((M,np.asarray([0,0,0,1]))))
-    #Minv = Minv[0:3,:]
+    nViewA = len(sfm_dataA.views)
+    sfm_dataA.views.extend(sfm_dataB.views)
+    sfm_dataA.viewId = np.concatenate((sfm_dataA.viewId, firstViewB + sfm_dataB.viewId))
+    sfm_dataA.viewPoseId = np.concatenate((sfm_dataA.viewPoseId, firstViewB + sfm_dataB.viewPoseId))
+    sfm_dataA.viewIntrinsicId = np.concatenate((sfm_dataA.viewIntrinsicId, np.zeros(len(sfm_dataB.views), dtype=np.int64)))
+    
+    # merge beacon data if specified
+    if sfmViewBeaconDataA is not None and sfmViewBeaconDataB is not None:
+        for viewKey in range(0, len(sfm_dataB.views)):
+            sfmViewBeaconDataA[nViewA + viewKey] = sfmViewBeaconDataB[viewKey]
     
     # merge extrinsics
-    for extKey in range(0,len(sfm_dataB['extrinsics'])):
-        extr = sfm_dataB['extrinsics'][extKey]
-        extr['key']  =  firstViewB+sfm_dataB['extrinsics'][extKey]['key']
-            
-        # transform rotation
-        matRot = np.asarray(extr['value']['rotation'])
-        nmatRot = np.dot(M[:,0:3],matRot)
-        extr['value']['rotation'] = np.ndarray.tolist(nmatRot)
-        
-        # transform center
-        vCenter = np.asarray(extr['value']['center'])
-        nvCenter = np.dot(M[:,0:3],vCenter) + M[:,3] #np.dot(matRot,Minv[:,3]) + vCenter
-        extr['value']['center'] = np.ndarray.tolist(nvCenter)
-        sfm_dataA['extrinsics'].append(extr) 
+    sfm_dataA.extrinsicKey = np.concatenate((sfm_dataA.extrinsicKey, firstViewB + sfm_dataB.extrinsicKey))
+    sfm_dataA.extrinsicRotation = np.concatenate((sfm_dataA.extrinsicRotation, 
+                                                  TransformUtils.transformSfmRotations(M, sfm_dataB.extrinsicRotation)))
+    sfm_dataA.extrinsicCenter = np.concatenate((sfm_dataA.extrinsicCenter, TransformUtils.transformPoints(M, sfm_dataB.extrinsicCenter)))
     
     # merge 3D points
     
-    # get mapping from 3D pt key (ID) of model A to list index
-    # and also get next key for adding 3D pt of model B
-    keyToListInd = {}
+    # get next key for adding 3D pt of model B
+    nPointA = len(sfm_dataA.structureKey)
+    keyOrderA = sfm_dataA.getStructureKeyOrder()
     nextKey = 0
-    for i in range(0,len(sfm_dataA["structure"])):
-        ptKey = sfm_dataA["structure"][i]["key"]
-        keyToListInd[ptKey] = i
-        
-        if ptKey > nextKey:
-            nextKey = ptKey
-            
+    if nPointA > 0:
+        nextKey = max(nextKey, sfm_dataA.structureKey[keyOrderA[-1]])
     nextKey = nextKey + 1 # add 1 to max
     
-    # copy structure
-    for strKey in range(0,len(sfm_dataB['structure'])):
-        stru = sfm_dataB['structure'][strKey]
-        
-        # if this point matches to a 3D point in model A then merge
-        if stru["key"] in inlierMapBA:
-            ptAkey = inlierMapBA[stru["key"]] # key/ID of this point in model A
-            ptAind = keyToListInd[ptAkey] # index in list
-             
-            # update view ID and add to points in model A
-            for ptB in stru["value"]["observations"]:
-                ptB["key"] = firstViewB + ptB["key"] 
-                sfm_dataA["structure"][ptAind]["value"]["observations"].append(ptB)
-         
-        # if has no match then add to the end of point list of model A
-        else:
-            # update view ID for all observations
-            for ptB in stru["value"]["observations"]:
-                ptB["key"] = firstViewB + ptB["key"] 
-                  
-            # reset key value to be the next point
-            stru["key"] = nextKey
-            nextKey = nextKey + 1
-              
-            # transform its 3D coordinate
-            # transform 3d coordinate
-            X = np.asarray(stru['value']['X'])
-            nX = np.dot(M[:,0:3],X) + M[:,3]
-            stru['value']['X'] = np.ndarray.tolist(nX)
-              
-            # add stru to the end of list of point of model A
-            sfm_dataA["structure"].append(stru)
+    # find index in model A of 3D points in model B which match to model A
+    inlierKeyB = np.array(inlierMapBA.keys(), dtype=np.int64)
+    inlierKeyA = np.array([inlierMapBA[key] for key in inlierMapBA.keys()], dtype=np.int64)
+    inlierIdx = findKeyIndex(inlierKeyB, sfm_dataB.structureKey)
+    isMatch = inlierIdx >= 0
+    ptAind = sfm_dataA.getStructureIndex(inlierKeyA[inlierIdx[isMatch]])
+    if np.any(ptAind < 0):
+        raise KeyError("3D point of model A is not found : " + str(inlierKeyA[inlierIdx[isMatch]][ptAind < 0].tolist()))
+    
+    # index of each point of model B in merged structure
+    # if this point matches to a 3D point in model A then merge, 
+    # if has no match then add to the end of point list of model A
+    nNewPoint = np.count_nonzero(~isMatch)
+    mergeInd = np.empty(len(sfm_dataB.structureKey), dtype=np.int64)
+    mergeInd[isMatch] = ptAind
+    mergeInd[~isMatch] = nPointA + np.arange(nNewPoint, dtype=np.int64)
+    
+    # combine observations, observations of model B are added after ones in model A for each point
+    # keeping order of model B. Observations of model A are only shifted, and only observations
+    # of model B are sorted by merged point
+    countA = np.concatenate((sfm_dataA.getObservationCount(), np.zeros(nNewPoint, dtype=np.int64)))
+    ownerB = mergeInd[sfm_dataB.getObservationPointIndex()]
+    obsOffset = np.concatenate(([0], np.cumsum(countA + np.bincount(ownerB, minlength=nPointA + nNewPoint)))).astype(np.int64)
+    
+    posA = np.arange(len(sfm_dataA.obsViewId), dtype=np.int64) + \
+        np.repeat(obsOffset[0:nPointA] - sfm_dataA.obsOffset[0:nPointA], countA[0:nPointA])
+    orderB = np.argsort(ownerB, kind="mergesort")
+    sortedOwnerB = ownerB[orderB]
+    posB = np.empty(len(ownerB), dtype=np.int64)
+    posB[orderB] = obsOffset[sortedOwnerB] + countA[sortedOwnerB] + \
+        np.arange(len(ownerB), dtype=np.int64) - np.searchsorted(sortedOwnerB, sortedOwnerB, side="left")
+    
+    nObs = obsOffset[-1]
+    sfm_dataA.obsOffset = obsOffset
+    for name, valueB in [("obsViewId", firstViewB + sfm_dataB.obsViewId), ("obsFeatId", sfm_dataB.obsFeatId), ("obsX", sfm_dataB.obsX)]:
+        valueA = getattr(sfm_dataA, name)
+        value = np.empty((nObs,) + valueA.shape[1:], dtype=valueA.dtype)
+        value[posA] = valueA
+        value[posB] = valueB
+        setattr(sfm_dataA, name, value)
+    
+    # add points with new key value and transformed 3D coordinate
+    # new keys are larger than all keys of model A, so that order of keys is kept
+    sfm_dataA.structureKey = np.concatenate((sfm_dataA.structureKey, nextKey + np.arange(nNewPoint, dtype=np.int64)))
+    sfm_dataA.structureX = np.concatenate((sfm_dataA.structureX, TransformUtils.transformPoints(M, sfm_dataB.structureX[~isMatch])))
+    sfm_dataA.setStructureKeyOrder(np.concatenate((keyOrderA, nPointA + np.arange(nNewPoint, dtype=np.int64))))
+
+# check if transformation M found with nInlier inliers is used to merge models in mergeModel
+def isValidMergeTransform(M, nInlier, minLimit=4, svdRatio=1.75):
+    if M.size==0 or nInlier <= minLimit:
+        return False
+    sSvd = np.linalg.svd(M[0:3,0:3],compute_uv=0)
+    return sSvd[0]/sSvd[-1] <= svdRatio
 
 # main function   
 # merge 3D models given path to sfm_dataA, sfm_dataB, loc_folderB
 # minLimit is minimum number of match between 3D models found before considering merging
+# ransacMethod is "ransac" or "loransac", ransacProcessNum and ransacSeed are nProcess and seed, see ransacTransform
+# if ransacProsac is True, number of 2D matches supporting each 3D match is used as quality for PROSAC
+# if outfile is None, only transformation is found and models are not merged
 # return the number of inliers for transformation
-def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, mergePointThres, ransacRoundMul=100, inputImgDir="", minLimit=4, svdRatio=1.75):
+def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, mergePointThres, ransacRoundMul=100, inputImgDir="", minLimit=4, svdRatio=1.75, 
+               ransacMethod="ransac", ransacConfidence=0.99, ransacProcessNum=1, ransacSeed=None, ransacProsac=False):
     
     print "Loading sfm_data"
-    sfm_dataB = FileUtils.loadjson(sfm_data_dirB)
+    sfm_dataB = SfmData.load(sfm_data_dirB)
     
     # read matching pairs from localization result
     imgnameB, matchlistB = readMatch(locFolderB)
@@ -548,12 +567,9 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
     # get viewID from image name for model B
     viewIDB = imgnameToViewID(imgnameB, sfm_dataB)
 
-    # get mapping between viewID,featID to 3D point ID
-    viewFeatMapB = getViewFeatTo3DMap(sfm_dataB)
-
     # find consistent match between 3D of model B to 3D of model A
     print "Calculating consistent 3D matches"
-    match3D_BA = getConsistent3DMatch(viewIDB, matchlistB, viewFeatMapB)
+    match3D_BA, matchCount_BA = getConsistent3DMatchFromSfmData(viewIDB, matchlistB, sfm_dataB, returnCount=True)
     print "Found " + str(len(match3D_BA)) + " consistent matches"
     
     # not enough matches
@@ -561,7 +577,7 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
         return len(match3D_BA), len(match3D_BA), np.asarray([])
  
     # move the load of larger model here to reduce time if merging is not possible
-    sfm_dataA = FileUtils.loadjson(sfm_data_dirA)
+    sfm_dataA = SfmData.load(sfm_data_dirA)
  
     # get 3D point. Note that element 0 of each pair in match3D_BA
     # is 3D pt ID of model B and element 1 is that of model A
@@ -576,7 +592,9 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
     print "Find transformation with RANSAC"
     ransacRound = len(match3D_BA)*ransacRoundMul
     print "Number of RANSAC round : " + str(ransacRound)
-    M, inliers = ransacTransform(pointAn, pointBn, ransacThres, ransacRound, svdRatio)
+    M, inliers = ransacTransform(pointAn, pointBn, ransacThres, ransacRound, svdRatio, 
+                                 method=ransacMethod, confidence=ransacConfidence, quality=matchCount_BA if ransacProsac else None, 
+                                 nProcess=ransacProcessNum, seed=ransacSeed)
     
     # cannot find RANSAC transformation
     if (M.size==0):
@@ -584,10 +602,11 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
     print M
     
     # stop if not enough inliers
-    sSvd = np.linalg.svd(M[0:3,0:3],compute_uv=0)
     # fixed by T.Ishihara to use minLimit 2016.06.06
     #if len(inliers) <= 4 or sSvd[0]/sSvd[-1] > svdRatio:
-    if len(inliers) <= minLimit or sSvd[0]/sSvd[-1] > svdRatio:
+    if not isValidMergeTransform(M, len(inliers), minLimit, svdRatio):
+        return len(match3D_BA), len(inliers), M
+    if outfile is None:
         return len(match3D_BA), len(inliers), M
         
     # perform merge 
@@ -602,11 +621,11 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
     
     # change input image folder
     if inputImgDir != "":
-        sfm_dataA["root_path"] = inputImgDir
+        sfm_dataA.header["root_path"] = inputImgDir
     
     # save json file
     print "Saving json file"
-    FileUtils.savejson(sfm_dataA,outfile)
+    sfm_dataA.save(outfile)
     
     # return number of inliers for transformation
     return len(match3D_BA), len(inliers), M
@@ -623,37 +642,28 @@ def mergeModel(sfm_data_dirA, sfm_data_dirB, locFolderB, outfile, ransacThres, m
 # of merged camera location, then we say localization agrees with merged location.
 # The function returns the number of frames localized and number of frames 
 # in which each localized location agrees with merged location.
-def modelMergeCheckLocal(sfm_data_path, sfm_locOut, medThres):
+# If M is given, camera locations of sfm_data are transformed by M before comparison, so that
+# merged model is checked from sfm_data of model B and transformation returned by mergeModel.
+def modelMergeCheckLocal(sfm_data_path, sfm_locOut, medThres, M=None):
     
     # load sfm_data
-    sfm_data = FileUtils.loadjson(sfm_data_path)
+    sfm_data = SfmData.load(sfm_data_path)
         
     # collect all image names ad location
-    imgName = []
-    imgLoc = []
-    for filename in os.listdir(sfm_locOut):
-        
-        if filename[-4:]!="json":
-                continue
-        
-        locJsonDict = FileUtils.loadjson(os.path.join(sfm_locOut,filename))
-        if "t" in locJsonDict:
-            imgName.append(os.path.basename(locJsonDict["filename"]))
-            imgLoc.append(locJsonDict["t"])
+    locResult = LocResult.load(sfm_locOut)
+    localized = locResult.getLocalizedIndex()
+    imgName = [os.path.basename(locResult.filename[i]) for i in localized.tolist()]
+    imgLoc = locResult.t[localized]
         
     imgID = imgnameToViewID(imgName, sfm_data)    
     imgSfMLoc = get3DViewloc(sfm_data, imgID)
+    if M is not None:
+        isFound = np.all(np.isfinite(imgSfMLoc), axis=1)
+        imgSfMLoc[isFound] = TransformUtils.transformPoints(M, imgSfMLoc[isFound])
         
     # calculate distance and count agreement
-    countFile = 0
-    countAgree = 0
-    
-    for j in range(0,len(imgLoc)):
-        dist = np.linalg.norm(np.array(imgLoc[j])-np.array(imgSfMLoc[j]))
-        if dist < float("inf"):
-            countFile = countFile + 1
-            
-            if dist < medThres:
-                countAgree = countAgree + 1
+    dist = np.linalg.norm(np.asarray(imgLoc, dtype=np.float).reshape(-1,3) - imgSfMLoc, axis=1)
+    countFile = int(np.count_nonzero(dist < float("inf")))
+    countAgree = int(np.count_nonzero(dist < medThres))
                 
     return countFile, countAgree
\ No newline at end of file
@@ -28,9 +28,45 @@ import numpy as np
 import scipy.sparse.csgraph
 import pickle
 import sys
+import multiprocessing
 import hulo_file.FileUtils as FileUtils
+import hulo_file.SfmDataCache as SfmDataCache
 import hulo_param.ReconstructParam as ReconstructParam
 import hulo_sfm.mergeSfM as mergeSfM
+from hulo_file.SfmData import SfmData
+from hulo_file.LocResult import LocResult
+
+# merge candidates evaluated by worker processes, set before the pool is forked
+# so that graph and models are not pickled for each task
+_mergeCandidateTasks = []
+
+# run mergeOneModel for k-th merge candidate in worker process
+def mergeCandidateWorker(k):
+    graph, model1, model2, mergeArgs, pairSuffix = _mergeCandidateTasks[k]
+    return graph.mergeOneModel(model1, model2, *mergeArgs, pairSuffix=pairSuffix)
+
+# select spread-out sample of nFrame reconstructed frames for progressive localization
+# returns sorted indexes of sample frames, or None if progressive localization is not used
+def selectSampleFrames(nFrame, reconParam):
+    if not reconParam.progressiveLoc:
+        return None
+    nSample = max(reconParam.progressiveLocMinSample, int(np.ceil(nFrame*reconParam.progressiveLocSampleRatio)))
+    if nSample >= nFrame:
+        return None
+    return np.unique(np.linspace(0, nFrame-1, nSample).round().astype(np.int64))
+
+# update matrix of graph between models after a round of tree merge
+# row and column of model merged to other model are combined to the merged model, and removed
+def mergeGraphMatrix(graphMatrix, mergedIdx):
+    graphMatrix = graphMatrix.copy()
+    for i,j in mergedIdx:
+        graphMatrix[i,:] = np.maximum(graphMatrix[i,:],graphMatrix[j,:])
+        graphMatrix[:,i] = np.maximum(graphMatrix[:,i],graphMatrix[:,j])
+        graphMatrix[i,i] = 0
+    listRemove = [j for i,j in mergedIdx]
+    graphMatrix = np.delete(graphMatrix,listRemove,0)
+    graphMatrix = np.delete(graphMatrix,listRemove,1)
+    return graphMatrix
 
 class sfmModel:
     
@@ -57,9 +93,12 @@ class sfmModel:
                 
         # get list of reconstructed frames
         if self.sfm_dataLoc != "":
-            sfm_data = FileUtils.loadjson(self.sfm_dataLoc)
-            extKeyTmp = [x["key"] for x in sfm_data["extrinsics"]]
-            self.reconFrame = [x["value"]["ptr_wrapper"]["data"]["id_view"] for x in sfm_data["views"] if x["value"]["ptr_wrapper"]["data"]["id_pose"] in extKeyTmp]
+            # load structure only if it is needed to calculate threshold
+            sections = ["views", "extrinsics"]
+            if ransacStructureThresK>0 or mergeStructureThresK>0:
+                sections.append("structure")
+            sfm_data = SfmData.load(self.sfm_dataLoc, sections)
+            self.reconFrame = sfm_data.viewId[sfm_data.getPosedViewMask()].tolist()
             if validMergeRansacThresK>0:
                 self.validMergeRansacThres = mergeSfM.findMedianThres(sfm_data, validMergeRansacThresK)
             else:
@@ -88,6 +127,18 @@ class sfmModel:
         self.validMergeRansacThres = newInfo.validMergeRansacThres
         self.ransacStructureThres = newInfo.ransacStructureThres
         self.mergeStructureThres = newInfo.mergeStructureThres
+    
+    # write files made from output of this model, which are read when the model is merged
+    # called before merge candidates are evaluated in worker processes, so that
+    # workers merging to the same model do not write the same files at once
+    def prepareMergeFiles(self):
+        SfmData.load(self.sfm_dataLoc)
+    
+    # change paths of output files of this model to sfmOutPath
+    # called when output folder of merged model is moved
+    def setOutputFolder(self, sfmOutPath):
+        self.sfm_dataLoc = os.path.join(sfmOutPath,"sfm_data.json")
+        self.locFolLoc = os.path.join(sfmOutPath,"loc")
         
 class sfmGraph:
         
@@ -210,64 +261,33 @@ class sfmGraph:
     # merge one sfmModel to other (specifically, model 2 to model 1)
     # all required folder will be created
     # returns whether the merge is success, and merged sfmModel    
-    def mergeOneModel(self, model1, model2, reconParam):
+    # pairSuffix is added to names of output, localization and temporary image folders of this pair
+    def mergeOneModel(self, model1, model2, reconParam, pairSuffix=""):
         
-        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel))
+        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel)+pairSuffix)
         
         # modified by T. IShihara 2016.06.14
         # fix file name too long issue
         # 
         # create a temporary folder for reconstructed image of model2
         #inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmp"+model2.name)        
-        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2")
-        if os.path.isdir(inputImgTmpFolder):
-            FileUtils.removedir(inputImgTmpFolder)
-        
-        # copy reconstructed image fom model2 to tmp folder
-        sfm_data2 = FileUtils.loadjson(model2.sfm_dataLoc)
-        if not os.path.isdir(inputImgTmpFolder):
-            listReconFrameName = [sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["filename"] for x in range(0,len(sfm_data2["views"])) if sfm_data2["views"][x]["value"]["ptr_wrapper"]["data"]["id_view"] in model2.reconFrame]
-            FileUtils.makedir(inputImgTmpFolder)
-            for reconFrameName in listReconFrameName:
-                os.system("cp -s " + os.path.join(model2.imgFolLoc,reconFrameName) + " " + inputImgTmpFolder)
+        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2"+pairSuffix)
         
-        
-        # remove all old localization result
-        FileUtils.removedir(model2.locFolLoc) 
-        FileUtils.makedir(model2.locFolLoc)
-
         # localize the images from model2 on model1
-        guideMatchOption = ""
-        if reconParam.bGuidedMatchingLocalize:
-            guideMatchOption = " -gm"
-        os.system(reconParam.LOCALIZE_PROJECT_PATH + \
-                  " " + inputImgTmpFolder + \
-                  " " + os.path.dirname(model1.sfm_dataLoc) + \
-                  " " + self.mMatchesPath + \
-                  " " + model2.locFolLoc + \
-                  " -f=" + str(reconParam.locFeatDistRatio) + \
-                  " -r=" + str(reconParam.locRansacRound) + \
-                  " -e=" + model2.csvFolLoc + \
-                  " -i=" + str(reconParam.locSkipFrame) + \
-                  guideMatchOption)
+        # in progressive mode, merge is rejected if localization of sample frames is not promising
+        locFolLoc = model2.locFolLoc + pairSuffix
+        if not self.localizeReconFrames(model1, model2, sfmOutPath, locFolLoc, inputImgTmpFolder, reconParam):
+            return False, sfmModel("","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
+                                   ransacStructureThres=0, ransacStructureThresK=0, 
+                                   mergeStructureThres=0, mergeStructureThresK=0)
                   
         # remove temporary image folder
         # removedir(inputImgTmpFolder)
         
-        # extract centers from all json file and write to a file
-        fileLoc = open(os.path.join(model2.locFolLoc,"center.txt"),"w")
-        countLocFrame = 0
-        for filename in sorted(os.listdir(model2.locFolLoc)):
-            if filename[-4:]!="json":
-                continue
-            
-            countLocFrame = countLocFrame + 1
-            with open(os.path.join(model2.locFolLoc,filename)) as locJson:
-                locJsonDict = json.load(locJson)
-                if "t" in locJsonDict:
-                    loc = locJsonDict["t"]
-                    fileLoc.write(str(loc[0]) + " "  + str(loc[1]) + " "  +str(loc[2]) + " 255 0 0\n" )   
-        fileLoc.close() 
+        # convert all json files to consolidated result, and write centers to a file
+        locResult = LocResult.convertFolder(locFolLoc)
+        countLocFrame = locResult.getImageCount()
+        locResult.saveCenterTxt(os.path.join(locFolLoc,"center.txt"))
         
         # get inlier matches
         FileUtils.makedir(sfmOutPath)
@@ -277,13 +297,18 @@ class sfmGraph:
         # TODO : revisit ransacRound parameter, use number of reconstruction frame to determine structure points transform seems small
         nMatchPointsTmp, nInlierTmp, M = mergeSfM.mergeModel(model1.sfm_dataLoc,
                             model2.sfm_dataLoc,
-                            model2.locFolLoc,
+                            locFolLoc,
                             resultSfMDataFile,
                             ransacThres=model1.ransacStructureThres,
                             mergePointThres=model1.mergeStructureThres,
                             ransacRoundMul=reconParam.ransacRoundMul,
                             inputImgDir=self.mInputImgPath,
-                            minLimit=reconParam.min3DnInliers)
+                            minLimit=reconParam.min3DnInliers,
+                            ransacMethod=reconParam.ransacMethod,
+                            ransacConfidence=reconParam.ransacConfidence,
+                            ransacProsac=reconParam.ransacProsac,
+                            ransacProcessNum=reconParam.ransacProcessNum,
+                            ransacSeed=reconParam.ransacSeed)
         
         ratioInlierMatchPoints = 0.0
         if nMatchPointsTmp>0:
@@ -295,7 +320,7 @@ class sfmGraph:
         countFileLoc = 1
         if os.path.isfile(resultSfMDataFile):
             os.system(reconParam.BUNDLE_ADJUSTMENT_PROJECT_PATH + " " + resultSfMDataFile + " " + resultSfMDataFile)
-            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, model2.locFolLoc, model1.validMergeRansacThres)
+            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(resultSfMDataFile, locFolLoc, model1.validMergeRansacThres)
         else:
             sfm_merge_generated = False
         
@@ -307,7 +332,7 @@ class sfmGraph:
             ratioAgreeFrameLocFrame = float(countFileAgree)/countFileLoc
         
         # write log file
-        with open(os.path.join(self.mSfMPath,"global"+str(self.nMergedModel),"log.txt"),"a") as filelog:
+        with open(os.path.join(sfmOutPath,"log.txt"),"a") as filelog:
             filelog.write(("M1: " + model1.name + "\n" + \
                           "M2: " + model2.name + "\n" + \
                           "nMatchedPoints: " + str(nMatchPointsTmp) + "\n" + \
@@ -387,6 +412,8 @@ class sfmGraph:
             if os.path.isfile(os.path.join(sfmOutPath,"sfm_data.json")):
                 os.rename(os.path.join(sfmOutPath,"sfm_data.json"), \
                           os.path.join(sfmOutPath,"sfm_data_fail_merge.json"))
+                # remove cache of sfm_data.json so that it is not used for other sfm_data.json in this folder
+                SfmDataCache.removeCache(os.path.join(sfmOutPath,"sfm_data.json"))
             
             # move to next video
             return False, sfmModel("","","","","","",validMergeRansacThres=0,validMergeRansacThresK=0,
@@ -421,6 +448,119 @@ class sfmGraph:
                               ransacStructureThres=model1.ransacStructureThres, 
                               mergeStructureThres=model1.mergeStructureThres)
             
+    # localize images in inputImgTmpFolder on model1, and write results to locFolLoc
+    def localizeFrames(self, model1, model2, inputImgTmpFolder, locFolLoc, reconParam):
+        guideMatchOption = ""
+        if reconParam.bGuidedMatchingLocalize:
+            guideMatchOption = " -gm"
+        os.system(reconParam.LOCALIZE_PROJECT_PATH + \
+                  " " + inputImgTmpFolder + \
+                  " " + os.path.dirname(model1.sfm_dataLoc) + \
+                  " " + self.mMatchesPath + \
+                  " " + locFolLoc + \
+                  " -f=" + str(reconParam.locFeatDistRatio) + \
+                  " -r=" + str(reconParam.locRansacRound) + \
+                  " -e=" + model2.csvFolLoc + \
+                  " -i=" + str(reconParam.locSkipFrame) + \
+                  guideMatchOption)
+    
+    # make temporary folder with symbolic links to images of model2
+    def linkReconFrames(self, model2, listFrameName, inputImgTmpFolder):
+        if os.path.isdir(inputImgTmpFolder):
+            FileUtils.removedir(inputImgTmpFolder)
+        FileUtils.makedir(inputImgTmpFolder)
+        for reconFrameName in listFrameName:
+            os.system("cp -s " + os.path.join(model2.imgFolLoc,reconFrameName) + " " + inputImgTmpFolder)
+    
+    # localize reconstructed frames of model2 on model1 by localizeFrames, and write results to locFolLoc
+    # if reconParam.progressiveLoc is True, sample of frames is localized and checked by checkLocalizeSample first,
+    # and other frames are localized only if the sample is promising
+    # localizeArgs are arguments of localizeFrames after reconParam
+    # returns whether all frames are localized
+    def localizeReconFrames(self, model1, model2, sfmOutPath, locFolLoc, inputImgTmpFolder, reconParam, *localizeArgs):
+        sfm_data2 = SfmData.load(model2.sfm_dataLoc, ["views"])
+        listReconFrameName = np.asarray(sfm_data2.getViewFilenames())[np.in1d(sfm_data2.viewId, model2.reconFrame)].tolist()
+        
+        # remove all old localization result
+        FileUtils.removedir(locFolLoc) 
+        FileUtils.makedir(locFolLoc)
+        
+        sampleIdx = selectSampleFrames(len(listReconFrameName), reconParam)
+        if sampleIdx is not None:
+            print "Localize " + str(len(sampleIdx)) + " sample frames of " + model2.name + " on " + model1.name
+            self.linkReconFrames(model2, [listReconFrameName[i] for i in sampleIdx], inputImgTmpFolder)
+            self.localizeFrames(model1, model2, inputImgTmpFolder, locFolLoc, reconParam, *localizeArgs)
+            if not self.checkLocalizeSample(model1, model2, sfmOutPath, locFolLoc, len(sampleIdx), reconParam):
+                print "Localization of sample frames is not promising. Skip merge between " + model1.name + " and " + model2.name + "."
+                return False
+            
+            # localize other frames to the same folder
+            isSample = np.zeros(len(listReconFrameName), dtype=bool)
+            isSample[sampleIdx] = True
+            listReconFrameName = [listReconFrameName[i] for i in np.flatnonzero(~isSample)]
+        
+        self.linkReconFrames(model2, listReconFrameName, inputImgTmpFolder)
+        self.localizeFrames(model1, model2, inputImgTmpFolder, locFolLoc, reconParam, *localizeArgs)
+        return True
+    
+    # check localization of sample frames of model2 on model1 in locFolLoc
+    # sample is merged without bundle adjustment, and number of agreed frames and 3D inliers are
+    # extrapolated to all reconstructed frames of model2 by ratio of sample frames
+    # returns False if the merge condition cannot be satisfied with margin reconParam.progressiveLocRejectMargin
+    def checkLocalizeSample(self, model1, model2, sfmOutPath, locFolLoc, nSample, reconParam):
+        sampleRatio = float(nSample)/len(model2.reconFrame)
+        margin = reconParam.progressiveLocRejectMargin
+        
+        locResult = LocResult.convertFolder(locFolLoc)
+        countLocFrame = len(locResult.getLocalizedIndex())
+        
+        # agreement of sample is checked with transformed model2 without writing merged sfm_data
+        FileUtils.makedir(sfmOutPath)
+        minLimit = int(reconParam.min3DnInliers*sampleRatio*margin)
+        nMatchPoints, nInlier, M = mergeSfM.mergeModel(model1.sfm_dataLoc,
+                            model2.sfm_dataLoc,
+                            locFolLoc,
+                            None,
+                            ransacThres=model1.ransacStructureThres,
+                            mergePointThres=model1.mergeStructureThres,
+                            ransacRoundMul=reconParam.ransacRoundMul,
+                            inputImgDir=self.mInputImgPath,
+                            minLimit=minLimit,
+                            ransacMethod=reconParam.ransacMethod,
+                            ransacConfidence=reconParam.ransacConfidence,
+                            ransacProsac=reconParam.ransacProsac,
+                            ransacProcessNum=reconParam.ransacProcessNum,
+                            ransacSeed=reconParam.ransacSeed)
+        
+        countFileAgree = 0
+        countFileLoc = 0
+        sfm_merge_generated = mergeSfM.isValidMergeTransform(M, nInlier, minLimit)
+        if sfm_merge_generated:
+            countFileLoc, countFileAgree = mergeSfM.modelMergeCheckLocal(model2.sfm_dataLoc, locFolLoc, model1.validMergeRansacThres, M)
+        ratioAgreeFrameLocFrame = 0.0
+        if countFileLoc>0:
+            ratioAgreeFrameLocFrame = float(countFileAgree)/countFileLoc
+        
+        isPromising = sfm_merge_generated and \
+            countFileAgree/sampleRatio > margin*reconParam.vldMergeMinCountFileAgree and \
+            ratioAgreeFrameLocFrame > margin*reconParam.vldMergeRatioAgrFLocF and \
+            nInlier/sampleRatio > margin*reconParam.min3DnInliers
+        
+        # write log file
+        with open(os.path.join(sfmOutPath,"log.txt"),"a") as filelog:
+            filelog.write(("M1: " + model1.name + "\n" + \
+                          "M2: " + model2.name + "\n" + \
+                          "nSampleFrame: " + str(nSample) + "\n" + \
+                          "sample nMatchedPoints: " + str(nMatchPoints) + "\n" + \
+                          "sample nInliers: " + str(nInlier) + "\n" + \
+                          "sample ratioLocWithSampleFrame: " + str(float(countLocFrame)/nSample) + "\n" + \
+                          "sample countFileAgree: " + str(countFileAgree) + "\n" + \
+                          "sample countFileLoc: " + str(countFileLoc) + "\n" + \
+                          "sample ratioLocAgreeWithLocFrame: " + str(ratioAgreeFrameLocFrame) + "\n" + \
+                          "sample is promising: " + str(isPromising) + "\n\n"))
+        
+        return isPromising
+    
     # check if the pair video1, video2 is a bad match, i.e. a localization 
     # between these videos failed before, so can skip without redoing localization
     def isBadMatch(self,video1,video2):
@@ -432,6 +572,177 @@ class sfmGraph:
     def clearBadMatches(self):
         self.badMatches = []
     
+    # move output of merge candidate evaluated with pairSuffix to the folders
+    # which mergeOneModel uses without suffix, as if the pair is evaluated alone
+    # candMergedModel is value of nMergedModel when the candidate is evaluated
+    # if the merge is success, paths of mergedModelTmp are changed to the moved folders
+    def moveCandidateOutput(self, model2, pairSuffix, candMergedModel, mergeResult, mergedModelTmp):
+        sfmOutPath = os.path.join(self.mSfMPath,"global"+str(self.nMergedModel))
+        candOutPath = os.path.join(self.mSfMPath,"global"+str(candMergedModel)+pairSuffix)
+        if os.path.isdir(candOutPath):
+            FileUtils.makedir(sfmOutPath)
+            for filename in os.listdir(candOutPath):
+                candFile = os.path.join(candOutPath,filename)
+                outFile = os.path.join(sfmOutPath,filename)
+                if filename=="log.txt" and os.path.isfile(outFile):
+                    with open(outFile,"a") as filelog, open(candFile,"r") as candLog:
+                        filelog.write(candLog.read())
+                    os.remove(candFile)
+                    continue
+                if os.path.isdir(outFile):
+                    FileUtils.removedir(outFile)
+                elif os.path.exists(outFile):
+                    os.remove(outFile)
+                os.rename(candFile,outFile)
+            FileUtils.removedir(candOutPath)
+        
+        if os.path.isdir(model2.locFolLoc + pairSuffix):
+            FileUtils.removedir(model2.locFolLoc)
+            os.rename(model2.locFolLoc + pairSuffix, model2.locFolLoc)
+        
+        inputImgTmpFolder = os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2"+pairSuffix)
+        FileUtils.removedir(inputImgTmpFolder)
+        
+        if mergeResult:
+            mergedModelTmp.setOutputFolder(sfmOutPath)
+    
+    # remove output of merge candidate evaluated with pairSuffix
+    def removeCandidateOutput(self, model2, pairSuffix):
+        FileUtils.removedir(os.path.join(self.mSfMPath,"global"+str(self.nMergedModel)+pairSuffix))
+        FileUtils.removedir(model2.locFolLoc + pairSuffix)
+        FileUtils.removedir(os.path.join(self.mSfMPath,"inputImgTmp","inputImgTmpModel2"+pairSuffix))
+    
+    # run mergeOneModel for all pairs (model1, model2) by nProcess worker processes
+    # output of k-th pair is written with pairSuffix "_cand"+str(k)
+    # returns pair suffixes, and list of whether the merge is success and merged sfmModel
+    def evaluateMergePairs(self, pairs, mergeArgs, nProcess):
+        global _mergeCandidateTasks
+        
+        pairSuffixes = ["_cand"+str(k) for k in range(len(pairs))]
+        _mergeCandidateTasks = [(self, model1, model2, mergeArgs, pairSuffix) 
+                                for (model1, model2), pairSuffix in zip(pairs, pairSuffixes)]
+        try:
+            if nProcess<=1 or len(pairs)==1:
+                results = map(mergeCandidateWorker, range(len(pairs)))
+            else:
+                # files shared by workers are written before workers start
+                models = []
+                for model in [x for pair in pairs for x in pair]:
+                    if model not in models:
+                        models.append(model)
+                        model.prepareMergeFiles()
+                
+                pool = multiprocessing.Pool(min(nProcess,len(pairs)))
+                try:
+                    results = pool.map(mergeCandidateWorker, range(len(pairs)), chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _mergeCandidateTasks = []
+        
+        return pairSuffixes, results
+    
+    # attempt merge of pairs (model1, model2) in the given order
+    # yields model1, model2, whether the merge is success, and merged sfmModel for each pair
+    # until the caller stops iteration after a successful merge
+    # if nProcess is larger than 1, up to nProcess pairs are evaluated at once in worker processes,
+    # and results are yielded in the same order as sequential evaluation
+    def mergeCandidates(self, pairs, mergeArgs, nProcess=1):
+        if nProcess<=1:
+            for model1, model2 in pairs:
+                mergeResult, mergedModelTmp = self.mergeOneModel(model1, model2, *mergeArgs)
+                yield model1, model2, mergeResult, mergedModelTmp
+            return
+        
+        for batchStart in range(0,len(pairs),nProcess):
+            batchPairs = pairs[batchStart:batchStart+nProcess]
+            pairSuffixes, results = self.evaluateMergePairs(batchPairs, mergeArgs, nProcess)
+            
+            # merge after the first successful one is not used, as in sequential evaluation
+            nUsed = len(batchPairs)
+            for k in range(len(batchPairs)):
+                if results[k][0]:
+                    nUsed = k+1
+                    break
+            for k in range(nUsed,len(batchPairs)):
+                self.removeCandidateOutput(batchPairs[k][1], pairSuffixes[k])
+            
+            for k in range(nUsed):
+                model1, model2 = batchPairs[k]
+                mergeResult, mergedModelTmp = results[k]
+                self.moveCandidateOutput(model2, pairSuffixes[k], self.nMergedModel, mergeResult, mergedModelTmp)
+                yield model1, model2, mergeResult, mergedModelTmp
+    
+    # select disjoint pairs of connected models to merge in one round of tree merge
+    # models are visited from the smallest one, and paired with the smallest connected model 
+    # which is not paired yet and did not fail merge with it before
+    # returns list of model index pairs, larger model first
+    def selectMergePairs(self, connectionGraph):
+        nReconFrame = [len(x.reconFrame) for x in self.sfmModel]
+        orderModel = [x[0] for x in sorted(enumerate(nReconFrame), key=lambda y:y[1])]
+        
+        mergePairs = []
+        listPaired = []
+        for i in orderModel:
+            if i in listPaired:
+                continue
+            for j in orderModel:
+                if j==i or j in listPaired or not connectionGraph[i,j] or \
+                    self.isBadMatch(self.sfmModel[i],self.sfmModel[j]):
+                    continue
+                if nReconFrame[i] < nReconFrame[j]:
+                    mergePairs.append((j,i))
+                else:
+                    mergePairs.append((i,j))
+                listPaired.extend([i,j])
+                break
+        
+        return mergePairs
+    
+    # perform one round of tree merge, pairs of model indexes (model1, model2) are merged 
+    # at once by nProcess worker processes
+    # merged models are numbered in the order of pairs, and models merged to other model are removed
+    # returns list of index pairs which are merged, and indexes of merged models after removal
+    def mergeRound(self, mergePairs, mergeArgs, nProcess):
+        pairs = [(self.sfmModel[i],self.sfmModel[j]) for i,j in mergePairs]
+        print "Merge round : " + str([(x.name,y.name) for x,y in pairs])
+        
+        candMergedModel = self.nMergedModel
+        pairSuffixes, results = self.evaluateMergePairs(pairs, mergeArgs, nProcess)
+        
+        mergedIdx = []
+        listMergedModelNum = []
+        for k in range(len(pairs)):
+            model1, model2 = pairs[k]
+            mergeResult, mergedModelTmp = results[k]
+            self.moveCandidateOutput(model2, pairSuffixes[k], candMergedModel, mergeResult, mergedModelTmp)
+            
+            if mergeResult:
+                model1.update(mergedModelTmp)
+                mergedIdx.append(mergePairs[k])
+                listMergedModelNum.append(self.nMergedModel)
+                self.nMergedModel = self.nMergedModel+1
+                
+                # write result log file
+                with open(os.path.join(self.mSfMPath,"logRecon.txt"),"a") as outLogFile:
+                    outLogFile.write(str(self.nMergedModel-1) + " " + model1.name + "\n")
+            else:
+                # add to bad matches
+                self.badMatches.append([model2.name,model1.name])
+        
+        # remove models merged to other model
+        listRemove = [j for i,j in mergedIdx]
+        mergedModels = [self.sfmModel[i] for i,j in mergedIdx]
+        self.sfmModel = [self.sfmModel[x] for x in range(len(self.sfmModel)) if x not in listRemove]
+        
+        # save
+        for nMergedModel in listMergedModelNum:
+            self.save(os.path.join(self.mSfMPath,"global" + str(nMergedModel),"mergeGraph.txt"))
+        self.save(os.path.join(self.mSfMPath,"mergeGraph.txt"))
+        
+        return mergedIdx, [self.sfmModel.index(x) for x in mergedModels]
+    
     # perform merging model
     # Input
     # image_descFile : path to image_describer.txt
@@ -453,6 +764,21 @@ class sfmGraph:
         # copy image_describer.txt
         os.system("cp --remove-destination " + image_descFile + " " + self.mMatchesPath)
          
+        # merge disjoint pairs of models at once in each round
+        if reconParam.mergeStrategy=="tree":
+            graphEdges = self.calcGraph()
+            while True:
+                print "graph edges : " + str(graphEdges)
+                print "SfM model names : " + str([x.name for x in self.sfmModel])
+                
+                mergePairs = self.selectMergePairs(graphEdges > 0.0)
+                if len(mergePairs)==0:
+                    print "No more mergable pairs. Exiting."
+                    return
+                
+                mergedIdx = self.mergeRound(mergePairs, (reconParam,), reconParam.mergeProcessNum)[0]
+                graphEdges = mergeGraphMatrix(graphEdges, mergedIdx)
+        
         listLead = range(0,len(self.sfmModel)) # list of model indexes which can initiate merge (list of model indexes which did not fail merge yet)
         listBye = [] # list of model indexes which will not be used to initiate merge (list of model indexes which already failed merge)
         baseVideo = -1
@@ -520,6 +846,8 @@ class sfmGraph:
             print "Based model: " + mergedModel.name
             print "To merge with: " + str([x.name for x in mergeCandidateModel])
             mergeCandidatesRemainsForBaseVideo = False            
+            # list pairs to attempt merge
+            mergePairs = []
             for video in mergeCandidateModel:
                 
                 # check if failed localization has been performed on this pair before
@@ -528,15 +856,14 @@ class sfmGraph:
                     continue
                 
                 # swap order so small model is merged to larger model
-                swap = False
                 if len(mergedModel.reconFrame) < len(video.reconFrame):
-                    tmp = mergedModel
-                    mergedModel = video
-                    video = tmp
-                    swap = True
-                
-                # attempt merge
-                mergeResult, mergedModelTmp = self.mergeOneModel(mergedModel,video,reconParam)
+                    mergePairs.append((video,mergedModel))
+                else:
+                    mergePairs.append((mergedModel,video))
+            
+            # attempt merge, pairs are evaluated at once if reconParam.mergeProcessNum is larger than 1
+            for mergedModel, video, mergeResult, mergedModelTmp in self.mergeCandidates(mergePairs, 
+                    (reconParam,), reconParam.mergeProcessNum):
                 
                 if mergeResult:
                     mergedModel.update(mergedModelTmp)
@@ -567,7 +894,3 @@ class sfmGraph:
                 
                     # save
                     self.save(os.path.join(self.mSfMPath,"mergeGraph.txt"))
-                
-                    if swap:
-                        # swap back if not merged
-                        mergedModel = video
@@ -0,0 +1,66 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+################################################################################
+# Apply 3 x 4 similarity or affine transformation M to stacked arrays
+# of points and rotations at once
+################################################################################
+
+import numpy as np
+
+# transform n x 3 points X, return n x 3 points M[:,0:3] X + M[:,3]
+def transformPoints(M, X):
+    M = np.asarray(M, dtype=np.float)
+    X = np.asarray(X, dtype=np.float).reshape(-1,3)
+    return np.dot(X, M[:,0:3].T) + M[:,3]
+
+# transform n x 3 x 3 rotations of extrinsics in sfm_data, return M[:,0:3] R
+def transformSfmRotations(M, R):
+    M = np.asarray(M, dtype=np.float)
+    R = np.asarray(R, dtype=np.float).reshape(-1,3,3)
+    return np.einsum("ij,njk->nik", M[:,0:3], R)
+
+# transform n x 3 x 3 rotations of localization results, return R M[:,0:3]^T
+def transformLocRotations(M, R):
+    M = np.asarray(M, dtype=np.float)
+    R = np.asarray(R, dtype=np.float).reshape(-1,3,3)
+    return np.einsum("nij,kj->nik", R, M[:,0:3])
+
+# transform list of localization json objects in place
+# original location and rotation are kept as "t_relative" and "R_relative"
+# return list of transformed locations
+def transformLocJson(M, jsonLocList):
+    jsonLocs = [jsonLoc for jsonLoc in jsonLocList if "t" in jsonLoc]
+    if len(jsonLocs) == 0:
+        return []
+    
+    t = transformPoints(M, [jsonLoc["t"] for jsonLoc in jsonLocs]).tolist()
+    R = transformLocRotations(M, [jsonLoc["R"] for jsonLoc in jsonLocs]).tolist()
+    for i, jsonLoc in enumerate(jsonLocs):
+        jsonLoc["t_relative"] = jsonLoc["t"]
+        jsonLoc["R_relative"] = jsonLoc["R"]
+        jsonLoc["t"] = t[i]
+        jsonLoc["R"] = R[i]
+    
+    return t
@@ -0,0 +1,449 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+
+import sys
+import random
+import multiprocessing
+import numpy as np
+
+# maximum memory in bytes used to score a block of RANSAC hypotheses
+# against all points at once
+RANSAC_BLOCK_MAX_MEMORY = 1 << 26
+
+# find affine transformation M such that A = MB for each hypothesis
+# by least square, same as np.linalg.lstsq at each RANSAC step
+# A and B are both 3 x n, sel is h x k array of indices of points used by each hypothesis
+# return M as h x 3 x 4
+def estimateAffineBatch(A, B, sel):
+    # h x k x 4 matrix of B with column of 1, and h x k x 3 matrix of A
+    Bs = np.concatenate((B.T[sel], np.ones(sel.shape + (1,))), axis=2)
+    As = A.T[sel]
+    
+    # minimum norm least square solution by pseudo inverse, singular values smaller than 
+    # machine precision times the largest singular value are treated as zero like lstsq
+    U, s, Vt = np.linalg.svd(Bs, full_matrices=False)
+    cutoff = np.finfo(np.float).eps * s[:, 0:1]
+    sInv = np.zeros(s.shape)
+    sInv[s > cutoff] = 1.0 / s[s > cutoff]
+    UtA = np.einsum("hki,hkj->hij", U, As) * sInv[:, :, np.newaxis]
+    X = np.einsum("hki,hkj->hij", Vt, UtA)
+    
+    return X.transpose(0,2,1)
+
+# find similarity transformation M such that A = MB for each hypothesis,
+# same as superimposition_matrix(B, A, scale=True) in transformations.py
+# A and B are both 3 x n, sel is h x k array of indices of points used by each hypothesis
+# return M as h x 3 x 4
+def estimateSimilarityBatch(A, B, sel):
+    # h x 3 x k points moved to centroid
+    v0 = B.T[sel].transpose(0,2,1)
+    v1 = A.T[sel].transpose(0,2,1)
+    mean0 = np.mean(v0, axis=2)
+    mean1 = np.mean(v1, axis=2)
+    v0 = v0 - mean0[:, :, np.newaxis]
+    v1 = v1 - mean1[:, :, np.newaxis]
+    
+    # rotation via SVD of covariance matrix
+    u, s, vh = np.linalg.svd(np.einsum("hik,hjk->hij", v1, v0))
+    R = np.einsum("hij,hjk->hik", u, vh)
+    
+    # fix R which does not constitute right handed system
+    flip = np.linalg.det(R) < 0.0
+    R[flip] -= 2.0 * u[flip, :, 2, np.newaxis] * vh[flip, np.newaxis, 2, :]
+    
+    # scale is ratio of RMS deviations from centroid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.sqrt(np.sum(v1*v1, axis=(1,2)) / np.sum(v0*v0, axis=(1,2)))
+    sR = R * scale[:, np.newaxis, np.newaxis]
+    
+    # move centroids back
+    t = mean1 - np.einsum("hij,hj->hi", sR, mean0)
+    
+    return np.concatenate((sR, t[:, :, np.newaxis]), axis=2)
+
+# count inliers of each hypothesis M (h x 3 x 4) for points A and B (3 x n)
+# return h x n boolean array of inliers
+def findInliersBatch(A, B, M, thres):
+    Btmp = np.einsum("hij,jn->hin", M[:, :, 0:3], B) + M[:, :, 3, np.newaxis]
+    Btmp -= A
+    with np.errstate(invalid="ignore"):
+        return np.sqrt(np.add.reduce(Btmp*Btmp, axis=1)) < thres
+
+# ratio between the largest and smallest singular values of M[0:3,0:3] of each hypothesis
+# return infinity for hypothesis which is not finite
+def conditionNumberBatch(M):
+    cond = np.empty(M.shape[0])
+    cond.fill(float("inf"))
+    isFinite = np.all(np.isfinite(M.reshape(M.shape[0], -1)), axis=1)
+    if np.any(isFinite):
+        s = np.linalg.svd(M[isFinite, :, 0:3], compute_uv=False)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cond[isFinite] = s[:, 0] / s[:, -1]
+    cond[np.isnan(cond)] = float("inf")
+    return cond
+
+# draw indices of 4 points for each hypothesis, in the same way as random.sample at each RANSAC step
+def drawSamples(listInd, nHypo):
+    return np.asarray([random.sample(listInd, 4) for i in range(0, nHypo)], dtype=np.int64).reshape(-1,4)
+
+# find matrix M such that A = MB
+# where A and B are both 3 x n
+# return M as 3 x 4
+# use ransac with threshold to find M
+#
+# hypotheses are made and scored block by block, where block size is limited
+# by maxMemory. The result is the same as trying hypotheses one by one.
+# model is "similarity" or "affine"
+def ransacTransformBatch(A, B, thres, ransacRound, svdRatio=sys.float_info.max, model="similarity", 
+                         maxMemory=RANSAC_BLOCK_MAX_MEMORY):
+    A = np.asarray(A, dtype=np.float)
+    B = np.asarray(B, dtype=np.float)
+    if model == "similarity":
+        estimateBatch = estimateSimilarityBatch
+    elif model == "affine":
+        estimateBatch = estimateAffineBatch
+    else:
+        raise ValueError("Unknown transformation model : " + str(model))
+    
+    # number of hypotheses in a block, 
+    # scoring a hypothesis needs 3 x n array of transformed points and n array of inliers
+    blockSize = max(1, int(maxMemory / (B.shape[1] * 8 * 4)))
+    
+    # RANSAC
+    listInd = range(0, B.shape[1])  # list of all indices
+    inliers = np.asarray([])  # to save list of inliers
+    nInliers = 0
+    
+    for blockStart in range(0, ransacRound, blockSize):
+        
+        # select 4 points for each hypothesis
+        sel = drawSamples(listInd, min(blockSize, ransacRound - blockStart))
+        
+        # find tranformation
+        M = estimateBatch(A, B, sel)
+        
+        # count inliers
+        isInlier = findInliersBatch(A, B, M, thres)
+        nInliersTmp = np.sum(isInlier, axis=1)
+        
+        # compare, the first hypothesis having the most inliers is selected
+        isBetter = nInliersTmp > nInliers
+        if np.any(isBetter):
+            isBetter[isBetter] = conditionNumberBatch(M[isBetter]) < svdRatio
+            if np.any(isBetter):
+                best = np.flatnonzero(isBetter)[np.argmax(nInliersTmp[isBetter])]
+                nInliers = nInliersTmp[best]
+                inliers = np.flatnonzero(isInlier[best])
+    
+    if len(inliers)<4:
+        return np.array([]), np.asarray([])
+    
+    M = estimateBatch(A, B, inliers[np.newaxis, :])[0]
+    
+    print "Number of ransac inliers: " + str(nInliers)
+    return M, inliers
+
+# number of hypotheses in a block for adaptive RANSAC,
+# termination is checked after each block
+ADAPTIVE_RANSAC_BLOCK_SIZE = 64
+
+# sample m distinct integers from [0, k) for each hypothesis
+# k is scalar or array with length nHypo, and should be larger than or equal to m
+# return nHypo x m array
+def sampleDistinct(rng, k, nHypo, m):
+    k = np.zeros(nHypo, dtype=np.int64) + k
+    sel = np.zeros((nHypo, m), dtype=np.int64)
+    for i in range(0, m):
+        # draw from [0, k-i), then shift over already selected values in ascending order
+        val = np.floor(rng.random_sample(nHypo) * (k - i)).astype(np.int64)
+        prev = np.sort(sel[:, 0:i], axis=1)
+        for j in range(0, i):
+            val += (val >= prev[:, j])
+        sel[:, i] = val
+    return sel
+
+# schedule of PROSAC
+# hypotheses are drawn from the top n points ordered by quality, where n grows from m to nPoint
+# so that the top n points are used for as many hypotheses as the standard PROSAC schedule
+# return array of first hypothesis index using top m+1, m+2, ... points
+def prosacSchedule(nPoint, maxRound, m=4):
+    schedule = []
+    
+    Tn = float(maxRound)
+    for i in range(0, m):
+        Tn = Tn * (m - i) / (nPoint - i)
+    TnPrime = 1
+    for n in range(m, nPoint):
+        if TnPrime >= maxRound:
+            break
+        TnNext = Tn * (n + 1) / (n + 1 - m)
+        TnPrime = TnPrime + int(np.ceil(TnNext - Tn))
+        Tn = TnNext
+        schedule.append(TnPrime)
+    return np.asarray(schedule, dtype=np.int64)
+
+# number of top points used for sampling at hypothesis index t by PROSAC schedule
+def prosacSampleSize(schedule, nPoint, t, m=4):
+    return np.minimum(m + np.searchsorted(schedule, t, side="right"), nPoint)
+
+# number of RANSAC rounds needed to find all inlier sample with given confidence
+def requiredRound(nInliers, nPoint, confidence, m=4):
+    w = float(nInliers) / nPoint
+    pGood = w ** m
+    if pGood >= 1.0:
+        return 1
+    if pGood <= 0.0:
+        return sys.maxint
+    return int(np.ceil(np.log(1.0 - confidence) / np.log(1.0 - pGood)))
+
+# improve model by fitting to all inliers repeatedly while number of inliers increases
+# return M, inliers and number of inliers
+def localOptimize(A, B, estimateBatch, M, inliers, thres, svdRatio, maxIteration):
+    for i in range(0, maxIteration):
+        if len(inliers) < 4:
+            break
+        
+        Mtmp = estimateBatch(A, B, inliers[np.newaxis, :])
+        if conditionNumberBatch(Mtmp)[0] >= svdRatio:
+            break
+        inliersTmp = np.flatnonzero(findInliersBatch(A, B, Mtmp, thres)[0])
+        if len(inliersTmp) <= len(inliers):
+            break
+        
+        M = Mtmp[0]
+        inliers = inliersTmp
+    return M, inliers
+
+# find matrix M such that A = MB
+# where A and B are both 3 x n
+# return M as 3 x 4
+# use LO-RANSAC with threshold to find M
+#
+# RANSAC is terminated when enough hypotheses are tested to find all inlier sample with 
+# given confidence, or when maxRound hypotheses are tested. Every time the best model 
+# is updated, it is improved by fitting to all of its inliers.
+# If quality of each match (larger is better) is given, hypotheses are drawn from
+# matches with higher quality first (PROSAC).
+# model is "similarity" or "affine"
+def loRansacTransform(A, B, thres, maxRound, svdRatio=sys.float_info.max, model="similarity", 
+                      confidence=0.99, quality=None, seed=None, loIteration=10, 
+                      maxMemory=RANSAC_BLOCK_MAX_MEMORY):
+    A = np.asarray(A, dtype=np.float)
+    B = np.asarray(B, dtype=np.float)
+    if model == "similarity":
+        estimateBatch = estimateSimilarityBatch
+    elif model == "affine":
+        estimateBatch = estimateAffineBatch
+    else:
+        raise ValueError("Unknown transformation model : " + str(model))
+    
+    nPoint = B.shape[1]
+    if nPoint < 4:
+        return np.array([]), np.asarray([])
+    
+    if seed is None:
+        seed = random.randint(0, 2**31-1)
+    rng = np.random.RandomState(seed)
+    
+    # order points by quality for PROSAC
+    if quality is not None:
+        order = np.argsort(-np.asarray(quality, dtype=np.float), kind="mergesort")
+        schedule = prosacSchedule(nPoint, maxRound)
+    else:
+        order = np.arange(nPoint)
+    
+    blockSize = max(1, min(ADAPTIVE_RANSAC_BLOCK_SIZE, int(maxMemory / (nPoint * 8 * 4))))
+    
+    # RANSAC
+    bestM = None
+    inliers = np.asarray([], dtype=np.int64)  # to save list of inliers
+    nRequired = maxRound
+    nRound = 0
+    
+    while nRound < min(maxRound, nRequired):
+        nHypo = min(blockSize, min(maxRound, nRequired) - nRound)
+        
+        # select 4 points for each hypothesis
+        if quality is not None:
+            # newest point in sample set and 3 other points from the rest of sample set
+            n = prosacSampleSize(schedule, nPoint, np.arange(nRound, nRound+nHypo))
+            sel = np.hstack((sampleDistinct(rng, n - 1, nHypo, 3), (n - 1)[:, np.newaxis]))
+            sel[n == nPoint] = sampleDistinct(rng, nPoint, np.count_nonzero(n == nPoint), 4)
+            sel = order[sel]
+        else:
+            sel = sampleDistinct(rng, nPoint, nHypo, 4)
+        nRound = nRound + nHypo
+        
+        # find tranformation and count inliers
+        M = estimateBatch(A, B, sel)
+        isInlier = findInliersBatch(A, B, M, thres)
+        nInliersTmp = np.sum(isInlier, axis=1)
+        
+        # compare
+        isBetter = nInliersTmp > len(inliers)
+        if not np.any(isBetter):
+            continue
+        isBetter[isBetter] = conditionNumberBatch(M[isBetter]) < svdRatio
+        if not np.any(isBetter):
+            continue
+        best = np.flatnonzero(isBetter)[np.argmax(nInliersTmp[isBetter])]
+        
+        # local optimization of new best model
+        bestM, inliers = localOptimize(A, B, estimateBatch, M[best], np.flatnonzero(isInlier[best]), 
+                                       thres, svdRatio, loIteration)
+        
+        # update number of rounds needed
+        nRequired = requiredRound(len(inliers), nPoint, confidence)
+    
+    print "Number of LO-RANSAC round : " + str(nRound)
+    if len(inliers)<4:
+        return np.array([]), np.asarray([])
+    
+    M = estimateBatch(A, B, inliers[np.newaxis, :])[0]
+    
+    print "Number of ransac inliers: " + str(len(inliers))
+    return M, inliers
+
+# number of hypotheses in a task of parallel RANSAC
+# each task has fixed hypotheses and seed, so that the result does not depend on number of processes
+PARALLEL_RANSAC_TASK_SIZE = 1024
+
+# points and parameters shared by worker processes of parallel RANSAC
+_parallelRansacData = {}
+
+# set points in shared memory and parameters for worker process
+def initParallelRansac(sharedA, sharedB, nPoint, thres, svdRatio, model, maxMemory):
+    _parallelRansacData["A"] = np.frombuffer(sharedA, dtype=np.float).reshape(3, nPoint)
+    _parallelRansacData["B"] = np.frombuffer(sharedB, dtype=np.float).reshape(3, nPoint)
+    _parallelRansacData["thres"] = thres
+    _parallelRansacData["svdRatio"] = svdRatio
+    _parallelRansacData["maxMemory"] = maxMemory
+    if model == "similarity":
+        _parallelRansacData["estimateBatch"] = estimateSimilarityBatch
+    else:
+        _parallelRansacData["estimateBatch"] = estimateAffineBatch
+
+# test hypotheses of a task
+# task is tuple of seed, task index and number of hypotheses
+# return number of inliers and M of the first best hypothesis, M is None if no valid hypothesis is found
+def runParallelRansacTask(task):
+    seed, taskIndex, nTaskHypo = task
+    A = _parallelRansacData["A"]
+    B = _parallelRansacData["B"]
+    estimateBatch = _parallelRansacData["estimateBatch"]
+    
+    rng = np.random.RandomState([seed, taskIndex])
+    blockSize = max(1, int(_parallelRansacData["maxMemory"] / (B.shape[1] * 8 * 4)))
+    
+    bestM = None
+    nInliers = 0
+    for blockStart in range(0, nTaskHypo, blockSize):
+        
+        # select 4 points for each hypothesis, and find transformation
+        sel = sampleDistinct(rng, B.shape[1], min(blockSize, nTaskHypo - blockStart), 4)
+        M = estimateBatch(A, B, sel)
+        
+        # count inliers
+        nInliersTmp = np.sum(findInliersBatch(A, B, M, _parallelRansacData["thres"]), axis=1)
+        
+        # compare, the first hypothesis having the most inliers is selected
+        isBetter = nInliersTmp > nInliers
+        if np.any(isBetter):
+            isBetter[isBetter] = conditionNumberBatch(M[isBetter]) < _parallelRansacData["svdRatio"]
+            if np.any(isBetter):
+                best = np.flatnonzero(isBetter)[np.argmax(nInliersTmp[isBetter])]
+                nInliers = nInliersTmp[best]
+                bestM = M[best]
+    
+    return nInliers, bestM
+
+# find matrix M such that A = MB
+# where A and B are both 3 x n
+# return M as 3 x 4
+# use ransac with threshold to find M
+#
+# hypotheses are split into tasks of fixed size, and tasks are run by nProcess worker processes 
+# sharing points A and B. Each task draws samples by random generator seeded with seed and 
+# task index, and the first best hypothesis in task order is selected. The result is the same 
+# for any nProcess if seed is given.
+# nProcess is number of CPUs if None, and no worker process is used if nProcess is 1 or
+# this is called in a daemonic worker process, which cannot have child processes
+# model is "similarity" or "affine"
+def parallelRansacTransform(A, B, thres, ransacRound, svdRatio=sys.float_info.max, model="similarity", 
+                            seed=None, nProcess=None, maxMemory=RANSAC_BLOCK_MAX_MEMORY):
+    if model not in ["similarity", "affine"]:
+        raise ValueError("Unknown transformation model : " + str(model))
+    
+    nPoint = np.asarray(B).shape[1]
+    if nPoint < 4:
+        return np.array([]), np.asarray([])
+    if seed is None:
+        seed = random.randint(0, 2**31-1)
+    if nProcess is None:
+        nProcess = multiprocessing.cpu_count()
+    
+    # copy points to shared memory
+    sharedA = multiprocessing.RawArray("d", 3 * nPoint)
+    sharedB = multiprocessing.RawArray("d", 3 * nPoint)
+    np.frombuffer(sharedA, dtype=np.float)[:] = np.asarray(A, dtype=np.float).ravel()
+    np.frombuffer(sharedB, dtype=np.float)[:] = np.asarray(B, dtype=np.float).ravel()
+    initArgs = (sharedA, sharedB, nPoint, thres, svdRatio, model, maxMemory)
+    
+    tasks = [(seed, i, min(PARALLEL_RANSAC_TASK_SIZE, ransacRound - taskStart)) 
+             for i, taskStart in enumerate(range(0, ransacRound, PARALLEL_RANSAC_TASK_SIZE))]
+    
+    # run tasks
+    if nProcess == 1 or len(tasks) == 1 or multiprocessing.current_process().daemon:
+        initParallelRansac(*initArgs)
+        results = map(runParallelRansacTask, tasks)
+    else:
+        pool = multiprocessing.Pool(min(nProcess, len(tasks)), initParallelRansac, initArgs)
+        try:
+            results = pool.map(runParallelRansacTask, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    
+    # select the first best hypothesis in task order
+    bestM = None
+    nInliers = 0
+    for nInliersTmp, M in results:
+        if nInliersTmp > nInliers:
+            nInliers = nInliersTmp
+            bestM = M
+    
+    if bestM is None or nInliers < 4:
+        return np.array([]), np.asarray([])
+    
+    A = np.frombuffer(sharedA, dtype=np.float).reshape(3, nPoint)
+    B = np.frombuffer(sharedB, dtype=np.float).reshape(3, nPoint)
+    if model == "similarity":
+        estimateBatch = estimateSimilarityBatch
+    else:
+        estimateBatch = estimateAffineBatch
+    inliers = np.flatnonzero(findInliersBatch(A, B, bestM[np.newaxis], thres)[0])
+    M = estimateBatch(A, B, inliers[np.newaxis, :])[0]
+    
+    print "Number of ransac inliers: " + str(nInliers)
+    return M, inliers
@@ -0,0 +1,44 @@
+################################################################################
+# Copyright (c) 2015 IBM Corporation
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+################################################################################
+
+# -*- coding: utf-8 -*-
+import os
+import json
+from hulo_file.SfmData import SfmData
+
+def main():
+    sfmData = SfmData.load(os.path.join("../data","sfm_data.json"))
+    print "number of views : " + str(len(sfmData.views))
+    print "number of extrinsics : " + str(len(sfmData.extrinsicKey))
+    print "number of 3D points : " + str(len(sfmData.structureKey))
+    print "number of observations : " + str(len(sfmData.obsViewId))
+    
+    sfmData.save(os.path.join("../data","sfm_data_copy.json"))
+    
+    with open(os.path.join("../data","sfm_data.json")) as fp:
+        jsonData = json.load(fp)
+    with open(os.path.join("../data","sfm_data_copy.json")) as fp:
+        jsonDataCopy = json.load(fp)
+    print "saved sfm_data is same as original : " + str(jsonData==jsonDataCopy)
+    
+if __name__ == '__main__':
+    main()